@@ -0,0 +1,105 @@
+# analytics.py
+
+import io
+
+import numpy as np
+
+import query_cache
+
+HISTOGRAM_BINS = 10
+
+# group_by name -> (label expression, GROUP BY list)
+GROUPS = {
+    'class': ('s.class_name', 's.class_name'),
+    'subject': ('g.subject', 'g.subject'),
+    'student': ("s.name || ' <' || s.email || '>'", 's.id, s.name, s.email'),
+}
+
+STAT_COLUMNS = ('Count', 'Mean', 'Median', 'P25', 'P75', 'P90', 'Std Dev', 'Min', 'Max', 'Rank')
+
+
+def _where(class_name=None, subject=None):
+    conditions, params = [], []
+    if class_name:
+        conditions.append('s.class_name = %s')
+        params.append(class_name)
+    if subject:
+        conditions.append('g.subject = %s')
+        params.append(subject)
+    return ('WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+
+def _round(value):
+    return None if value is None else round(float(value), 2)
+
+
+def group_stats(conn, group_by, class_name=None, subject=None):
+    """Percentage statistics per class, subject or student, computed in SQL
+
+    Returns (label, count, mean, median, p25, p75, p90, stddev, min, max,
+    rank) rows ordered by rank, where rank orders groups by mean percentage.
+    """
+    label, group = GROUPS[group_by]
+    where, params = _where(class_name, subject)
+    rows = query_cache.fetchall(conn, f'''
+        SELECT {label}, COUNT(*), AVG(p),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY p),
+               percentile_cont(0.25) WITHIN GROUP (ORDER BY p),
+               percentile_cont(0.75) WITHIN GROUP (ORDER BY p),
+               percentile_cont(0.9) WITHIN GROUP (ORDER BY p),
+               stddev_samp(p), MIN(p), MAX(p),
+               RANK() OVER (ORDER BY AVG(p) DESC)
+        FROM grades g
+        JOIN students s ON g.student_id = s.id
+        CROSS JOIN LATERAL (SELECT (g.grade / g.max_marks * 100)::float8 AS p) pct
+        {where}
+        GROUP BY {group}
+        ORDER BY 11, 1
+    ''', params, tables=('grades', 'students'))
+    return [(row[0], row[1]) + tuple(_round(value) for value in row[2:10]) + (row[10],)
+            for row in rows]
+
+
+def percentages(conn, class_name=None, subject=None):
+    """All matching grade percentages as a float64 array, read with COPY
+
+    Grades without max marks have no percentage and are left out.
+    """
+    where, params = _where(class_name, subject)
+    where = f'{where} AND g.max_marks IS NOT NULL' if where else 'WHERE g.max_marks IS NOT NULL'
+    cursor = conn.cursor()
+    query = cursor.mogrify(f'''
+        SELECT (g.grade / g.max_marks * 100)::float8
+        FROM grades g
+        JOIN students s ON g.student_id = s.id
+        {where}
+    ''', params).decode()
+    buffer = io.StringIO()
+    cursor.copy_expert(f'COPY ({query}) TO STDOUT', buffer)
+    return np.array(buffer.getvalue().split(), dtype=np.float64)
+
+
+def summarize(values, bins=HISTOGRAM_BINS):
+    """Descriptive statistics and a histogram of a percentage array"""
+    if values.size == 0:
+        return {'count': 0, 'histogram': (np.zeros(bins, dtype=np.int64), np.linspace(0, 100, bins + 1))}
+    p25, median, p75, p90 = np.percentile(values, [25, 50, 75, 90])
+    top = max(100.0, float(values.max()))
+    return {
+        'count': int(values.size),
+        'mean': float(values.mean()),
+        'median': float(median),
+        'p25': float(p25),
+        'p75': float(p75),
+        'p90': float(p90),
+        'std': float(values.std(ddof=1)) if values.size > 1 else 0.0,
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'histogram': np.histogram(values, bins=bins, range=(0.0, top)),
+    }
+
+
+def report(conn, group_by, class_name=None, subject=None):
+    """Grouped statistics plus an overall summary for one filter"""
+    return (group_stats(conn, group_by, class_name, subject),
+            summarize(percentages(conn, class_name, subject)))
@@ -0,0 +1,204 @@
+# api_client.py
+#
+# The repository functions over HTTP, for running the desktop app against
+# api_server.py instead of a database connection of its own. Each function
+# takes an ApiClient where the repository takes a psycopg2 connection, so
+# the same jobs run on the QueryExecutor with session=api_client.session.
+
+import datetime
+import http.client
+import json
+import threading
+import urllib.parse
+from contextlib import contextmanager
+
+import db_config
+from repository import ValidationError, DuplicateError, ConflictError
+
+
+class ApiError(Exception):
+    """The API server rejected a request or could not be reached"""
+
+
+class ApiClient:
+    """A keep-alive HTTP connection to the API server
+
+    closed and cancel() mirror a psycopg2 connection, so a running QueryExecutor
+    job can be cancelled by dropping its connection.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        parts = urllib.parse.urlsplit(base_url)
+        self._connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                  else http.client.HTTPConnection)
+        self._netloc = parts.netloc
+        self._prefix = parts.path.rstrip('/')
+        self._timeout = timeout
+        self._conn = None
+        self._used = False
+        self.closed = False
+
+    def request(self, method, path, body=None, **query):
+        """Send a request and return the decoded JSON reply"""
+        if self.closed:
+            raise ApiError("Connection closed")
+        url = self._prefix + path
+        query = {name: value for name, value in query.items() if value is not None}
+        if query:
+            url += '?' + urllib.parse.urlencode(query)
+        payload = json.dumps(body).encode() if body is not None else None
+        # Writes are audited as this process's actor; quoted, as headers are Latin-1
+        headers = {'X-Actor': urllib.parse.quote(db_config.AUDIT_ACTOR)}
+        if payload is not None:
+            headers['Content-Type'] = 'application/json'
+        try:
+            response = self._send(method, url, payload, headers)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            if not self._used or self.closed:
+                raise
+            # The server closed an idle keep-alive connection; reconnect once
+            self._reset()
+            response = self._send(method, url, payload, headers)
+        self._used = True
+        status, data = response.status, response.read()
+        reply = json.loads(data) if data else {}
+        if status == 400:
+            raise ValidationError(reply.get('error', "Invalid request"))
+        if status == 409:
+            raise DuplicateError(reply.get('error', "Duplicate record"))
+        if status == 412:
+            current = reply.get('current')
+            raise ConflictError(reply.get('error', "Record changed"), tuple(current) if current else None)
+        if status == 404:
+            return None
+        if status >= 300:
+            raise ApiError(reply.get('error', f"HTTP {status}"))
+        return reply
+
+    def _send(self, method, url, payload, headers):
+        if self._conn is None:
+            self._conn = self._connection_class(self._netloc, timeout=self._timeout)
+        self._conn.request(method, url, body=payload, headers=headers)
+        return self._conn.getresponse()
+
+    def _reset(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._used = False
+
+    def cancel(self):
+        """Abort an in-flight request; the client cannot be used afterwards"""
+        self.closed = True
+        conn = self._conn
+        if conn is not None and conn.sock is not None:
+            try:
+                conn.sock.shutdown(2)
+            except OSError:
+                pass
+
+    def close(self):
+        self.closed = True
+        self._reset()
+
+
+_base_url = None
+_local = threading.local()
+
+
+def configure(base_url):
+    """Set the API server every session() connects to"""
+    global _base_url
+    _base_url = base_url
+
+
+@contextmanager
+def session():
+    """This thread's ApiClient; the counterpart of db_config.connect()"""
+    client = getattr(_local, 'client', None)
+    if client is None or client.closed:
+        client = _local.client = ApiClient(_base_url)
+    yield client
+
+
+class ApiSource:
+    """A students or grades listing paged through the API, for a VirtualTable"""
+
+    def __init__(self, table):
+        self.table = table
+        self.session = session
+
+    def query(self):
+        # There is no SQL to export on the client side
+        return None
+
+    def count(self, client):
+        return client.request('GET', f'/{self.table}/count')['count']
+
+    def fetch(self, client, after=None, offset=0, limit=100):
+        reply = client.request('GET', f'/{self.table}', limit=limit, offset=offset or None,
+                               after=json.dumps(list(after)) if after is not None else None)
+        return list(zip(map(tuple, reply['keys']), map(tuple, reply['rows'])))
+
+    def fetch_rows(self, client, ids):
+        ids = list(ids)
+        reply = client.request('GET', f'/{self.table}', limit=len(ids),
+                               ids=','.join(map(str, ids)))
+        return list(zip(map(tuple, reply['keys']), map(tuple, reply['rows'])))
+
+
+def create_student(client, student):
+    return tuple(client.request('POST', '/students', student)['row'])
+
+
+def create_students(client, students):
+    return [tuple(row) for row in client.request('POST', '/students/batch', students)['rows']]
+
+
+def update_student(client, student_id, student, version=None):
+    reply = client.request('PUT', f'/students/{student_id}', dict(student, version=version))
+    return tuple(reply['row']) if reply else None
+
+
+def change_class(client, student_ids, class_name):
+    reply = client.request('POST', '/students/class',
+                           {'ids': list(student_ids), 'class_name': class_name})
+    return [tuple(row) for row in reply['rows']]
+
+
+def delete_students(client, student_ids, versions=None):
+    reply = client.request('POST', '/students/delete', {'ids': list(student_ids), 'versions': versions})
+    return reply['students'], reply['grades']
+
+
+def create_grade(client, grade):
+    return client.request('POST', '/grades', grade)['id']
+
+
+def create_grades(client, grades):
+    return client.request('POST', '/grades/batch', grades)['ids']
+
+
+def update_grade(client, grade_id, grade, version=None):
+    return client.request('PUT', f'/grades/{grade_id}', dict(grade, version=version))['ids']
+
+
+def delete_grades(client, grade_ids, versions=None):
+    return client.request('POST', '/grades/delete', {'ids': list(grade_ids), 'versions': versions})['ids']
+
+
+def curve_grades(client, subject=None, grade_ids=None, points=0, factor=1):
+    body = {'subject': subject, 'ids': list(grade_ids) if grade_ids is not None else None,
+            'points': points, 'factor': factor}
+    return client.request('POST', '/grades/curve', body)['ids']
+
+
+def record_history(client, table, row_id):
+    """audit.record_history over the API"""
+    rows = client.request('GET', f'/{table}/{int(row_id)}/history')['rows']
+    return [(datetime.datetime.fromisoformat(changed_at), action, actor, old_row, new_row)
+            for changed_at, action, actor, old_row, new_row in rows]
+
+
+def student_choices(client):
+    return [tuple(row) for row in client.request('GET', '/students/choices')['rows']]
@@ -0,0 +1,339 @@
+# api_server.py
+#
+# HTTP/JSON API over the repository queries, so clients (the desktop app
+# with STUDENT_API_URL set, scripts) do not need database access of their
+# own. Runs on asyncio with aiohttp and asyncpg:
+#
+#     python api_server.py --host 0.0.0.0 --port 8080
+#
+# Routes ({table} is students or grades):
+#   GET    /health
+#   GET    /metrics             request timings, Prometheus text format
+#   GET    /{table}?after=<json key>&offset=&limit=&ids=1,2,3   one keyset page
+#   GET    /{table}/count
+#   POST   /{table}             create one record
+#   POST   /{table}/batch       create a JSON list of records in one transaction
+#   POST   /{table}/delete      delete {"ids": [...], "versions": [...]} in one transaction
+#   PUT    /{table}/{id}        update one record; "version" in the body checks it
+#   DELETE /{table}/{id}        delete one record
+#   GET    /{table}/{id}/history   audit log entries of one record, newest first
+#   GET    /students/choices    (id, name) of every student
+#   POST   /students/class      move {"ids": [...], "class_name": ...}
+#   POST   /grades/curve        {"subject", "ids", "points", "factor"}
+#
+# Pages come back as {"rows": [...], "keys": [...]}; pass the last key as
+# after to get the next page. A write carrying versions that are no longer
+# current fails with 412 and {"error", "current": row or null}. Writes are
+# audited under the X-Actor request header when the client sends one.
+
+import argparse
+import datetime
+import decimal
+import json
+import time
+import urllib.parse
+from contextlib import asynccontextmanager
+
+import asyncpg
+from aiohttp import web
+
+import audit
+import db_config
+import instrumentation
+import repository
+from repository import numbered
+
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 100
+
+
+def _json_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _dumps(data):
+    return json.dumps(data, default=_json_value)
+
+
+def _reply(data, status=200):
+    return web.json_response(data, status=status, dumps=_dumps)
+
+
+def _numbered_args(sql, params):
+    sql, args = numbered(sql, params)
+    return (sql, *args)
+
+
+async def _fetch(db, sql, params):
+    return await db.fetch(*_numbered_args(sql, params))
+
+
+@asynccontextmanager
+async def _writing(request):
+    """A pooled connection in a transaction whose changes are audited as the caller's"""
+    async with request.app['pool'].acquire() as conn:
+        async with conn.transaction():
+            actor = urllib.parse.unquote(request.headers.get('X-Actor', '')) or db_config.AUDIT_ACTOR
+            await conn.execute("SELECT set_config('audit.actor', $1, true)", actor)
+            yield conn
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    """Turn repository and input errors into JSON error replies"""
+    try:
+        return await handler(request)
+    except repository.ValidationError as e:
+        return _reply({'error': str(e)}, 400)
+    except repository.ConflictError as e:
+        return _reply({'error': str(e), 'current': e.current}, 412)
+    except (repository.DuplicateError, asyncpg.UniqueViolationError):
+        return _reply({'error': "Email already exists!"}, 409)
+    except asyncpg.ForeignKeyViolationError:
+        return _reply({'error': "Student does not exist"}, 400)
+    except (ValueError, TypeError, KeyError) as e:
+        return _reply({'error': f"Bad request: {e}"}, 400)
+
+
+@web.middleware
+async def timing_middleware(request, handler):
+    """Time every request under its route, for /metrics"""
+    start = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        route = request.match_info.route.resource
+        name = f"{request.method} {route.canonical if route is not None else 'unmatched'}"
+        instrumentation.metrics.record('request', time.perf_counter() - start, operation=name)
+
+
+async def metrics(request):
+    return web.Response(text=instrumentation.metrics.to_prometheus('student_api'),
+                        content_type='text/plain')
+
+
+def _listing(request):
+    return repository.LISTINGS[request.match_info['table']]
+
+
+async def health(request):
+    await request.app['pool'].fetchval('SELECT 1')
+    return _reply({'status': 'ok'})
+
+
+async def list_rows(request):
+    listing = _listing(request)
+    query = request.query
+    limit = min(int(query.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    after = json.loads(query['after']) if 'after' in query else None
+    ids = [int(i) for i in query['ids'].split(',') if i] if 'ids' in query else None
+    sql, params = repository.page_query(listing, after, int(query.get('offset', 0)), limit, ids)
+    rows = await _fetch(request.app['pool'], sql, params)
+    pairs = repository.split_keys(listing, [tuple(row) for row in rows])
+    return _reply({'keys': [key for key, _ in pairs], 'rows': [values for _, values in pairs]})
+
+
+async def count_rows(request):
+    count = await request.app['pool'].fetchval(repository.count_query(_listing(request)))
+    return _reply({'count': count})
+
+
+async def student_choices(request):
+    rows = await request.app['pool'].fetch(repository.STUDENT_CHOICES)
+    return _reply({'rows': [tuple(row) for row in rows]})
+
+
+async def create_student(request):
+    params = repository.student_params(await request.json())
+    async with _writing(request) as conn:
+        row = await conn.fetchrow(*_numbered_args(repository.INSERT_STUDENT, params))
+    return _reply({'row': tuple(row)}, 201)
+
+
+async def create_students(request):
+    params = repository.batch_params(await request.json(), repository.student_params,
+                                     repository.STUDENT_FIELDS)
+    async with _writing(request) as conn:
+        rows = await _fetch(conn, repository.INSERT_STUDENTS, params)
+    return _reply({'rows': [tuple(row) for row in rows]}, 201)
+
+
+async def _current_row(db, table, row_id):
+    listing = repository.LISTINGS[table]
+    sql, params = repository.page_query(listing, ids=[row_id])
+    pairs = repository.split_keys(listing, [tuple(row) for row in await _fetch(db, sql, params)])
+    return pairs[0][1] if pairs else None
+
+
+async def _check_deleted(conn, table, params):
+    """Raise ConflictError if a versioned delete left rows behind"""
+    remaining = await _fetch(conn, repository.REMAINING[table], params)
+    if remaining:
+        raise repository.delete_conflict(table, remaining)
+
+
+async def update_student(request):
+    body = await request.json()
+    student_id = int(request.match_info['id'])
+    params = dict(repository.student_params(body), id=student_id, version=body.get('version'))
+    async with _writing(request) as conn:
+        row = await conn.fetchrow(*_numbered_args(repository.UPDATE_STUDENT, params))
+        if row is None and params['version'] is not None:
+            raise repository.conflict('students', student_id, await _current_row(conn, 'students', student_id))
+    if row is None:
+        return _reply({'error': "Student not found"}, 404)
+    return _reply({'row': tuple(row)})
+
+
+async def _delete_students(request, student_ids, versions=None):
+    params = repository.delete_params(student_ids, versions)
+    async with _writing(request) as conn:
+        grades = await _fetch(conn, repository.DELETE_STUDENT_GRADES, params)
+        students = await _fetch(conn, repository.DELETE_STUDENTS, params)
+        if versions is not None and len(students) < len(student_ids):
+            await _check_deleted(conn, 'students', params)
+    return _reply({'students': [row[0] for row in students], 'grades': [row[0] for row in grades]})
+
+
+async def delete_student(request):
+    return await _delete_students(request, [int(request.match_info['id'])])
+
+
+async def delete_students(request):
+    body = await request.json()
+    return await _delete_students(request, body['ids'], body.get('versions'))
+
+
+async def change_class(request):
+    body = await request.json()
+    params = repository.class_params(body['ids'], body.get('class_name'))
+    async with _writing(request) as conn:
+        rows = await _fetch(conn, repository.CHANGE_CLASS, params)
+    return _reply({'rows': [tuple(row) for row in rows]})
+
+
+async def create_grade(request):
+    params = repository.grade_params(await request.json())
+    async with _writing(request) as conn:
+        grade_id = await conn.fetchval(*_numbered_args(repository.INSERT_GRADE, params))
+    return _reply({'id': grade_id}, 201)
+
+
+async def create_grades(request):
+    params = repository.batch_params(await request.json(), repository.grade_params,
+                                     repository.GRADE_FIELDS)
+    async with _writing(request) as conn:
+        rows = await _fetch(conn, repository.INSERT_GRADES, params)
+    return _reply({'ids': [row[0] for row in rows]}, 201)
+
+
+async def update_grade(request):
+    body = await request.json()
+    grade_id = int(request.match_info['id'])
+    params = dict(repository.grade_params(body), id=grade_id, version=body.get('version'))
+    async with _writing(request) as conn:
+        rows = await _fetch(conn, repository.UPDATE_GRADE, params)
+        if not rows and params['version'] is not None:
+            raise repository.conflict('grades', grade_id, await _current_row(conn, 'grades', grade_id))
+    return _reply({'ids': [row[0] for row in rows]})
+
+
+async def _delete_grades(request, grade_ids, versions=None):
+    params = repository.delete_params(grade_ids, versions)
+    async with _writing(request) as conn:
+        rows = await _fetch(conn, repository.DELETE_GRADES, params)
+        if versions is not None and len(rows) < len(grade_ids):
+            await _check_deleted(conn, 'grades', params)
+    return _reply({'ids': [row[0] for row in rows]})
+
+
+async def delete_grade(request):
+    return await _delete_grades(request, [int(request.match_info['id'])])
+
+
+async def delete_grades(request):
+    body = await request.json()
+    return await _delete_grades(request, body['ids'], body.get('versions'))
+
+
+async def curve_grades(request):
+    body = await request.json()
+    params = repository.curve_params(body.get('subject'), body.get('ids'),
+                                     body.get('points', 0), body.get('factor', 1))
+    async with _writing(request) as conn:
+        rows = await _fetch(conn, repository.CURVE_GRADES, params)
+    return _reply({'ids': [row[0] for row in rows]})
+
+
+async def record_history(request):
+    params = audit.history_params(request.match_info['table'], request.match_info['id'],
+                                  request.query.get('limit', audit.HISTORY_LIMIT))
+    rows = await _fetch(request.app['pool'], audit.HISTORY, params)
+    return _reply({'rows': [(row['changed_at'], row['action'], row['actor'],
+                             json.loads(row['old_row']) if row['old_row'] else None,
+                             json.loads(row['new_row']) if row['new_row'] else None)
+                            for row in rows]})
+
+
+def _connect_settings():
+    """DB_SETTINGS in asyncpg's keyword names"""
+    settings = dict(db_config.DB_SETTINGS)
+    settings['database'] = settings.pop('dbname')
+    if 'port' in settings:
+        settings['port'] = int(settings['port'])
+    return settings
+
+
+async def _open_pool(app):
+    app['pool'] = await asyncpg.create_pool(min_size=db_config.MIN_CONNECTIONS,
+                                            max_size=db_config.MAX_CONNECTIONS,
+                                            **_connect_settings())
+    # Skipped on a database that has not been migrated to the audit log yet
+    if await app['pool'].fetchval("SELECT to_regproc('create_audit_partitions')") is not None:
+        await app['pool'].execute('SELECT create_audit_partitions($1)', audit.MONTHS_AHEAD)
+
+
+async def _close_pool(app):
+    await app['pool'].close()
+
+
+def create_app():
+    app = web.Application(middlewares=[timing_middleware, error_middleware])
+    app.on_startup.append(_open_pool)
+    app.on_cleanup.append(_close_pool)
+    table = '{table:students|grades}'
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/students/choices', student_choices)
+    app.router.add_get(f'/{table}', list_rows)
+    app.router.add_get(f'/{table}/count', count_rows)
+    app.router.add_get(f'/{table}/{{id:\\d+}}/history', record_history)
+    app.router.add_post('/students', create_student)
+    app.router.add_post('/students/batch', create_students)
+    app.router.add_post('/students/delete', delete_students)
+    app.router.add_post('/students/class', change_class)
+    app.router.add_put('/students/{id:\\d+}', update_student)
+    app.router.add_delete('/students/{id:\\d+}', delete_student)
+    app.router.add_post('/grades', create_grade)
+    app.router.add_post('/grades/batch', create_grades)
+    app.router.add_post('/grades/delete', delete_grades)
+    app.router.add_post('/grades/curve', curve_grades)
+    app.router.add_put('/grades/{id:\\d+}', update_grade)
+    app.router.add_delete('/grades/{id:\\d+}', delete_grade)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the student database over HTTP/JSON")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
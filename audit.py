@@ -0,0 +1,152 @@
+# audit.py
+#
+# History of every insert, update and delete on students and grades
+# (migration 7). Triggers append one audit_log row per changed row, holding
+# the row before and after as JSON, the time and the actor: the connection's
+# audit.actor setting (db_config.AUDIT_ACTOR, or for API requests the
+# client's X-Actor header), else the database user. The triggers run once
+# per statement and read the changed rows from transition tables, so a bulk
+# write - deleting a class, with its cascaded grades - costs one extra
+# INSERT ... SELECT per table rather than one per row, and a change and its
+# audit rows commit or roll back together.
+#
+# audit_log is partitioned by month and only ever appended to. The coming
+# months' partitions are created ahead (the app calls ensure_partitions() at
+# startup when partitions_missing() finds the last of them absent; anything
+# outside them lands in audit_log_default), and old months are removed by
+# dropping their partitions:
+#
+#     python audit.py history students 42
+#     python audit.py drop-before 2024-09
+
+import argparse
+import datetime
+import re
+
+import queries
+import repository
+from db_config import connect
+
+# Months of partitions kept ready beyond the current one
+MONTHS_AHEAD = 3
+
+# Most changes shown for one record
+HISTORY_LIMIT = 200
+
+# Bookkeeping columns left out when describing a change; the rest are
+# described in form order (JSONB does not keep the column order)
+IGNORED_FIELDS = ('id', 'version', 'updated_at', 'created_at')
+FIELD_ORDER = repository.STUDENT_FIELDS + repository.GRADE_FIELDS + ('exam_date',)
+
+# Served by audit_log_row_idx, newest first
+HISTORY = queries.define('record_history', '''
+    SELECT changed_at, action, actor, old_row, new_row
+    FROM audit_log
+    WHERE table_name = %(table)s AND row_id = %(id)s
+    ORDER BY changed_at DESC, id DESC
+    LIMIT %(limit)s
+''')
+
+PARTITIONS = '''
+    SELECT c.relname
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'audit_log'::regclass
+    ORDER BY c.relname
+'''
+
+_MONTHLY = re.compile(r'audit_log_(\d{4})_(\d{2})$')
+
+
+def ensure_partitions(conn, months_ahead=MONTHS_AHEAD):
+    """Create this month's and the next months' partitions; returns how many were new"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT create_audit_partitions(%s)', (months_ahead,))
+    return cursor.fetchone()[0]
+
+
+def partitions_missing(conn, months_ahead=MONTHS_AHEAD):
+    """True if the furthest partition ensure_partitions() creates does not exist
+
+    A catalog lookup, where ensure_partitions() runs DDL and locks audit_log.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT to_regclass('audit_log_' || to_char(date_trunc('month', CURRENT_DATE)
+                                                   + %s * INTERVAL '1 month', 'YYYY_MM'))
+    ''', (months_ahead,))
+    return cursor.fetchone()[0] is None
+
+
+def history_params(table, row_id, limit=HISTORY_LIMIT):
+    if table not in ('students', 'grades'):
+        raise ValueError(f"No history for {table}")
+    return {'table': table, 'id': int(row_id), 'limit': int(limit)}
+
+
+def record_history(conn, table, row_id, limit=HISTORY_LIMIT):
+    """(changed_at, action, actor, old_row, new_row) of a record, newest first
+
+    old_row and new_row are dicts of the row's columns, None where the
+    action has no such side.
+    """
+    return queries.execute(conn.cursor(), HISTORY, history_params(table, row_id, limit)).fetchall()
+
+
+def changes(action, old_row, new_row):
+    """(field, old value, new value) for the fields a change touched"""
+    if action == 'update':
+        fields = [field for field in new_row
+                  if field not in IGNORED_FIELDS and old_row.get(field) != new_row[field]]
+    else:
+        fields = [field for field in (new_row or old_row) if field not in IGNORED_FIELDS]
+    fields.sort(key=lambda field: (FIELD_ORDER.index(field) if field in FIELD_ORDER else len(FIELD_ORDER), field))
+    return [(field, (old_row or {}).get(field), (new_row or {}).get(field)) for field in fields]
+
+
+def describe(action, old_row, new_row):
+    """One line summing up a change, for the history view"""
+    if action == 'update':
+        parts = [f"{field}: {old} → {new}" for field, old, new in changes(action, old_row, new_row)]
+        return '; '.join(parts) or "no visible change"
+    parts = [f"{field}={new if action == 'insert' else old}"
+             for field, old, new in changes(action, old_row, new_row)]
+    return ', '.join(parts)
+
+
+def drop_before(conn, month):
+    """Drop the monthly partitions wholly before month (a date); returns their names"""
+    cursor = conn.cursor()
+    cursor.execute(PARTITIONS)
+    dropped = []
+    for (name,) in cursor.fetchall():
+        match = _MONTHLY.match(name)
+        if match and datetime.date(int(match.group(1)), int(match.group(2)), 1) < month:
+            cursor.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    return dropped
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Read or trim the student/grade audit log")
+    commands = parser.add_subparsers(dest='command', required=True)
+    history = commands.add_parser('history', help="changes to one record, newest first")
+    history.add_argument('table', choices=('students', 'grades'))
+    history.add_argument('id', type=int)
+    trim = commands.add_parser('drop-before', help="drop the months before YYYY-MM")
+    trim.add_argument('month')
+    args = parser.parse_args()
+
+    with connect() as conn:
+        if args.command == 'history':
+            for changed_at, action, actor, old_row, new_row in record_history(conn, args.table, args.id):
+                print(f"{changed_at:%Y-%m-%d %H:%M:%S}  {action:<6}  {actor:<12}  "
+                      f"{describe(action, old_row, new_row)}")
+        else:
+            month = datetime.datetime.strptime(args.month, '%Y-%m').date()
+            dropped = drop_before(conn, month)
+            print(f"Dropped {len(dropped)} partition(s): {', '.join(dropped) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+# benchmark.py
+#
+# Reproducible timings for the app's main query paths. A seeded generator
+# fills a dedicated database (the configured one with "_benchmark" appended,
+# created on first use) so the numbers never depend on, or touch, real data:
+#
+#     python benchmark.py --rows 100000 --output baseline.json
+#     python benchmark.py --rows 100000 --compare baseline.json
+#
+# --rows is the number of grades; there is one student per GRADES_PER_STUDENT
+# grades. Data is regenerated only when the size or seed changes. Every path
+# runs the SQL the app runs (built by StudentManagementSystem itself) with the
+# query cache cleared, so results measure the database rather than the cache.
+# The resort.* entries sort every search row in memory, as plain tuples and
+# as a row_store.RowStore, and also report the bytes each row takes.
+# Treeview population and the app's time to interactive are timed on real
+# widgets when a display is available (use xvfb-run on a headless machine)
+# and skipped otherwise.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import psycopg2
+
+import db_config
+import live_search
+import queries
+import query_cache
+from db_config import connect, init_pool, close_pool
+from importer import _CopyBuffer
+from migrations import migrate
+from row_store import RowStore
+
+SIZES = (1000, 100000, 1000000)
+GRADES_PER_STUDENT = 4
+DEFAULT_SEED = 42
+DEFAULT_REPEAT = 5
+
+FIRST_NAMES = ('Aarav', 'Ananya', 'Ben', 'Chloe', 'Diego', 'Emma', 'Farah', 'George', 'Hana',
+               'Ivan', 'Jia', 'Kofi', 'Lena', 'Mateo', 'Nadia', 'Omar', 'Priya', 'Quinn',
+               'Rosa', 'Sven', 'Tara', 'Umar', 'Vera', 'Wei', 'Yusuf', 'Zoe')
+LAST_NAMES = ('Ahmed', 'Brown', 'Chen', 'Da Silva', 'Evans', 'Fischer', 'Garcia', 'Huang',
+              'Ito', 'Jones', 'Khan', 'Lopez', 'Muller', 'Nguyen', 'Okafor', 'Patel', 'Rossi',
+              'Singh', 'Tanaka', 'Williams')
+SUBJECTS = ('Mathematics', 'Physics', 'Chemistry', 'Biology', 'English', 'History',
+            'Geography', 'Computer Science', 'Art', 'Music')
+CLASS_NAMES = tuple(f'{year}{section}' for year in range(1, 13) for section in 'ABCD')
+
+# Search terms: a common substring and one that matches few names
+SEARCH_TERMS = ('an', 'Yusuf Tan')
+
+
+def benchmark_settings(settings):
+    return dict(settings, dbname=f"{settings['dbname']}_benchmark")
+
+
+def ensure_database(settings):
+    """Create the benchmark database if it does not exist"""
+    conn = psycopg2.connect(**db_config.DB_SETTINGS)
+    conn.autocommit = True
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM pg_database WHERE datname = %s', (settings['dbname'],))
+        if cursor.fetchone() is None:
+            cursor.execute(f'CREATE DATABASE "{settings["dbname"]}"')
+    finally:
+        conn.close()
+
+
+def generate_students(rng, count):
+    """(name, email, class_name, phone) rows; emails are unique by position"""
+    for number in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        email = f"{first}.{last}.{number}@example.org".lower().replace(' ', '')
+        yield (f"{first} {last}", email, rng.choice(CLASS_NAMES), f"555-{rng.randrange(10000):04d}")
+
+
+def generate_grades(rng, student_ids, count):
+    """(student_id, subject, grade, max_marks, exam_date) rows"""
+    first_exam = datetime.date(2024, 1, 8)
+    for _ in range(count):
+        max_marks = rng.choice((50, 100, 100, 100))
+        yield (rng.choice(student_ids), rng.choice(SUBJECTS), round(rng.uniform(0.2, 1.0) * max_marks, 2),
+               max_marks, first_exam + datetime.timedelta(days=rng.randrange(365)))
+
+
+def populate(conn, rows, seed, progress=None):
+    """Replace the benchmark data with rows grades from seed, unless already there"""
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS benchmark_meta (rows INTEGER, seed INTEGER)')
+    cursor.execute('SELECT rows, seed FROM benchmark_meta')
+    if cursor.fetchone() == (rows, seed):
+        return False
+
+    rng = random.Random(seed)
+    cursor.execute('TRUNCATE grades, students, student_summary, deleted_rows, benchmark_meta '
+                   'RESTART IDENTITY CASCADE')
+    buffer = _CopyBuffer(cursor, 'students', ('name', 'email', 'class_name', 'phone'))
+    for student in generate_students(rng, max(1, rows // GRADES_PER_STUDENT)):
+        buffer.add(student)
+    buffer.flush()
+    cursor.execute('SELECT id FROM students ORDER BY id')
+    student_ids = [row[0] for row in cursor.fetchall()]
+
+    buffer = _CopyBuffer(cursor, 'grades', ('student_id', 'subject', 'grade', 'max_marks', 'exam_date'))
+    for number, grade in enumerate(generate_grades(rng, student_ids, rows), 1):
+        buffer.add(grade)
+        if progress and number % 100000 == 0:
+            progress(number)
+    buffer.flush()
+    cursor.execute('INSERT INTO benchmark_meta (rows, seed) VALUES (%s, %s)', (rows, seed))
+    conn.commit()
+    cursor.execute('ANALYZE')
+    conn.commit()
+    return True
+
+
+def _app():
+    """A stand-in for StudentManagementSystem, enough to build its queries"""
+    return SimpleNamespace(api_url=None, mirror=None,
+                           search_summary_var=SimpleNamespace(get=lambda: False))
+
+
+def _summary_app():
+    return SimpleNamespace(api_url=None, mirror=None,
+                           search_summary_var=SimpleNamespace(get=lambda: True))
+
+
+def query_paths():
+    """{name: work(conn) -> rows} for each path, as the app runs it
+
+    A table path is what a VirtualTable does when given a source: count the
+    rows and fetch the first page. The .jump variants fetch a page from the
+    middle, as dragging the scrollbar does.
+    """
+    from main import StudentManagementSystem as App
+
+    def first_page(source):
+        def work(conn):
+            source.count(conn)
+            return len(source.fetch(conn, limit=200))
+        return work
+
+    def middle_page(source):
+        def work(conn):
+            return len(source.fetch(conn, offset=source.count(conn) // 2, limit=200))
+        return work
+
+    def name_search(term):
+        source = App.search_source(_app(), 's.name ILIKE %s', (live_search.like_pattern(term),))
+        sql, params = source.query()
+
+        def work(conn):
+            cursor = queries.execute(conn.cursor(), sql + ' LIMIT %s', params + (live_search.RESULT_LIMIT + 1,),
+                                     f'{source.name}.results')
+            return len(RowStore.from_cursor(cursor))
+        return work
+
+    sources = {
+        'load_students': App.listing_source(_app(), 'students'),
+        'load_grades': App.listing_source(_app(), 'grades'),
+        'filter_by_class': App.search_source(_app(), 's.class_name = %s', (CLASS_NAMES[0],)),
+        'filter_by_subject': App.search_source(_app(), 'g.subject = %s', (SUBJECTS[0],), join='JOIN'),
+        'filter_by_subject.summary': App.search_source(
+            _summary_app(), 'EXISTS (SELECT 1 FROM grades g WHERE g.student_id = s.id AND g.subject = %s)',
+            (SUBJECTS[0],)),
+        'reset_filters': App.search_source(_app()),
+        'reset_filters.summary': App.search_source(_summary_app()),
+        'reset_filters.sorted': App.search_source(_app()).sorted(5, descending=True),
+        'combined_filter': App.search_source(_app(), *live_search.SearchFilter(
+            name='an', class_name=CLASS_NAMES[0], subject=SUBJECTS[0], low=50).sql()),
+    }
+    paths = {}
+    for name, source in sources.items():
+        paths[name] = first_page(source)
+        paths[name + '.jump'] = middle_page(source)
+    for term in SEARCH_TERMS:
+        paths[f'search_by_name[{term}]'] = name_search(term)
+    return paths
+
+
+def measure(work, repeat):
+    """Timings of repeat runs after one warm-up run, with the query cache cleared"""
+    times, rows = [], None
+    for run in range(repeat + 1):
+        query_cache.cache.clear()
+        start = time.perf_counter()
+        rows = work()
+        elapsed = (time.perf_counter() - start) * 1000
+        if run:
+            times.append(elapsed)
+    return {'min_ms': round(min(times), 2), 'median_ms': round(statistics.median(times), 2),
+            'max_ms': round(max(times), 2), 'rows': rows}
+
+
+def measure_row_store(conn, repeat):
+    """Memory per row and re-sort time for every search row, as tuples and as a RowStore"""
+    from main import StudentManagementSystem as App
+    sql, params = App.search_source(_app()).query()
+    results = {}
+    for name, load, sort in (
+            ('tuples', lambda cursor: cursor.fetchall(),
+             lambda rows: sorted(rows, key=lambda row: (row[3] or '', row[4] is not None, row[4] or 0))),
+            ('row_store', RowStore.from_cursor, lambda rows: rows.sorted([3, 4]))):
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        # psycopg2 holds the whole result until the cursor goes; only the
+        # Python objects built from it are counted
+        tracemalloc.start()
+        rows = load(cursor)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        cursor.close()
+        result = measure(lambda: sort(rows) and len(rows), repeat)
+        result['bytes_per_row'] = round(size / max(len(rows), 1), 1)
+        results[f'resort.{name}'] = result
+        del rows
+    conn.rollback()
+    return results
+
+
+def measure_render(repeat):
+    """Time filling and scrolling a VirtualTable, or None without a display"""
+    import tkinter as tk
+    from virtual_table import VirtualTable, ListSource
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    try:
+        root.geometry('1000x700')
+        table = VirtualTable(root, columns=tuple((name, 100) for name in
+                                                 ('Student', 'Email', 'Class', 'Subject', 'Grade', '%')))
+        table.pack(fill='both', expand=True)
+        root.update()
+        rows = [(f"Student {i}", f"s{i}@example.org", '1A', 'Mathematics', 75, 75.0) for i in range(100000)]
+
+        def fill():
+            table.set_source(ListSource(rows))
+            root.update()
+            for index in range(0, len(rows), len(rows) // 50):
+                table.scroll_to(index)
+                root.update()
+            return len(rows)
+        return measure(fill, repeat)
+    finally:
+        root.destroy()
+
+
+def measure_startup(repeat, timeout=60):
+    """Time from constructing the app until its first tab shows data"""
+    import tkinter as tk
+    from main import StudentManagementSystem
+    try:
+        tk.Tk().destroy()
+    except tk.TclError:
+        return None
+
+    def start():
+        root = tk.Tk()
+        app = StudentManagementSystem(root)
+        deadline = time.monotonic() + timeout
+        while app.startup_seconds is None and time.monotonic() < deadline:
+            root.update()
+            time.sleep(0.005)
+        seconds = app.startup_seconds
+        app.on_close()
+        return seconds
+
+    times = [start() for _ in range(repeat + 1)][1:]
+    if None in times:
+        return None
+    result = {'min_ms': round(min(times) * 1000, 2), 'median_ms': round(statistics.median(times) * 1000, 2),
+              'max_ms': round(max(times) * 1000, 2), 'rows': None,
+              'budget_ms': StudentManagementSystem.STARTUP_BUDGET * 1000}
+    result['over_budget'] = result['median_ms'] > result['budget_ms']
+    return result
+
+
+def run(rows, seed, repeat, progress=None):
+    """Populate the benchmark database and return the results document"""
+    settings = benchmark_settings(db_config.DB_SETTINGS)
+    ensure_database(settings)
+    close_pool()
+    db_config.DB_SETTINGS = settings
+    init_pool()
+
+    with connect() as conn:
+        migrate(conn)
+    with connect() as conn:
+        start = time.perf_counter()
+        generated = populate(conn, rows, seed, progress)
+        generate_seconds = time.perf_counter() - start
+        cursor = conn.cursor()
+        cursor.execute('SELECT version()')
+        server = cursor.fetchone()[0]
+        cursor.execute('SELECT (SELECT COUNT(*) FROM students), (SELECT COUNT(*) FROM grades)')
+        students, grades = cursor.fetchone()
+
+    results = {}
+    with connect() as conn:
+        for name, work in query_paths().items():
+            results[name] = measure(lambda: work(conn), repeat)
+            conn.rollback()
+        results.update(measure_row_store(conn, repeat))
+    results['render'] = measure_render(repeat)
+    results['startup'] = measure_startup(repeat)
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'meta': {
+            'rows': rows, 'seed': seed, 'repeat': repeat, 'students': students, 'grades': grades,
+            'generated_seconds': round(generate_seconds, 1) if generated else None,
+            'server': server, 'python': platform.python_version(), 'commit': commit,
+            'at': datetime.datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+
+
+def compare(document, baseline, tolerance):
+    """Print median ratios against baseline; True if none exceeds tolerance"""
+    if (document['meta']['rows'], document['meta']['seed']) != (baseline['meta']['rows'], baseline['meta']['seed']):
+        print("Warning: baseline was taken with a different size or seed", file=sys.stderr)
+    passed = True
+    print(f"{'path':40} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for name, result in document['results'].items():
+        before = baseline['results'].get(name)
+        if not result or not before or 'median_ms' not in result:
+            continue
+        ratio = result['median_ms'] / max(before['median_ms'], 0.01)
+        slower = ratio > tolerance
+        passed = passed and not slower
+        print(f"{name:40} {before['median_ms']:>10.2f} {result['median_ms']:>10.2f} {ratio:>7.2f}"
+              + ("  SLOWER" if slower else ""))
+    return passed
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Time the app's query paths on generated data")
+    parser.add_argument('--rows', type=int, default=SIZES[1],
+                        help=f"grades to generate, e.g. {', '.join(map(str, SIZES))}")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--output', help="write the results JSON here instead of stdout")
+    parser.add_argument('--compare', metavar='BASELINE', help="results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="fail when a median is this many times the baseline's")
+    args = parser.parse_args()
+
+    def progress(rows):
+        print(f"{rows} grades generated", file=sys.stderr)
+
+    document = run(args.rows, args.seed, args.repeat, progress)
+    close_pool()
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    elif not args.compare:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(document, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
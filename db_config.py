@@ -1,12 +1,117 @@
 # db_config.py
 
+import getpass
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import pool
+
+import instrumentation
+import queries
+
+DB_SETTINGS = {
+    "dbname": "testdb",
+    "user": "postgres",
+    "password": "1234",
+    "host": "localhost",
+    "port": "5432",
+}
+
+# Who changes made through this process are recorded as in the audit log
+# (audit.py); STUDENT_ACTOR overrides the login name
+AUDIT_ACTOR = os.environ.get('STUDENT_ACTOR') or getpass.getuser()
+
+# Pool sizing; MAX_CONNECTIONS also bounds how many callers may hold a
+# connection at once (extra callers wait instead of failing)
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 10
+
+# Idle connections older than this are pinged before being handed out
+HEALTH_CHECK_INTERVAL = 30
+
+_pool = None
+_slots = None
+_last_used = {}
+_pool_lock = threading.Lock()
+
+
+def _actor_option(actor):
+    """libpq options setting audit.actor for the session"""
+    return '-c audit.actor=' + actor.replace('\\', '\\\\').replace(' ', '\\ ')
+
+
+def init_pool(minconn=MIN_CONNECTIONS, maxconn=MAX_CONNECTIONS):
+    """Create the shared connection pool if it does not exist yet"""
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = pool.ThreadedConnectionPool(minconn, maxconn, **DB_SETTINGS,
+                                                options=_actor_option(AUDIT_ACTOR),
+                                                connection_factory=queries.PreparingConnection,
+                                                cursor_factory=instrumentation.InstrumentedCursor)
+            _slots = threading.BoundedSemaphore(maxconn)
+    return _pool
+
+
+def close_pool():
+    """Close every pooled connection"""
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _slots = None
+        _last_used.clear()
+
+
+def _is_healthy(conn):
+    """Cheap liveness check; only pings connections that sat idle"""
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout(db_pool):
+    conn = db_pool.getconn()
+    while not _is_healthy(conn):
+        _last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+        conn = db_pool.getconn()
+    return conn
+
 
+@contextmanager
 def connect():
-    return psycopg2.connect(
-        dbname="testdb",
-        user="postgres",
-        password="1234",
-        host="localhost",
-        port="5432"
-    )
+    """Borrow a pooled connection; commits on success, rolls back on error"""
+    db_pool = init_pool()
+    slots = _slots
+    start = time.perf_counter()
+    slots.acquire()
+    conn = None
+    try:
+        conn = _checkout(db_pool)
+        # Includes waiting for a free slot and any reconnects
+        instrumentation.metrics.record('connect', time.perf_counter() - start)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+    finally:
+        if conn is not None:
+            _last_used[id(conn)] = time.monotonic()
+            db_pool.putconn(conn, close=bool(conn.closed))
+        slots.release()
@@ -0,0 +1,260 @@
+# dedup.py
+#
+# Finding students entered more than once - "Jon Smith" and "John Smith" in
+# the same class, or one student under two spellings of an email - and
+# merging them. Comparing every pair of students is quadratic, so candidate
+# pairs are blocked first:
+#
+#   - within a class, names whose character bigrams (of the words in sorted
+#     order) overlap by at least BLOCK_SIMILARITY (Jaccard). A prefix filter
+#     finds all of them: with a name's bigrams ordered rarest first, two
+#     names that similar must share one of their first few bigrams, so only
+#     students sharing one are compared (the AllPairs set-similarity join),
+#     a posting list at a time with numpy on bit-packed bigram sets;
+#   - in any class, the same email local part, ignoring case, dots and any
+#     +tag.
+#
+# Candidates are scored with difflib on the names (in either word order) and
+# email local parts. Pairs scoring MATCH_SCORE or more are grouped into
+# suggestions that keep the student with the most grades; merging re-points
+# the others' grades to that student and deletes them in one transaction
+# (repository.merge_students).
+#
+#     python dedup.py [--threshold 0.85] [--class 7B ...]
+
+import argparse
+import math
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+import numpy as np
+
+import repository
+from db_config import connect
+
+# Bigrams rather than trigrams: one typo changes two of them, not three,
+# so "Jon Smith" and "John Smith" (0.75) clear the bar
+BLOCK_SIMILARITY = 0.6
+MATCH_SCORE = 0.85
+
+# Score = NAME_WEIGHT * name similarity + EMAIL_WEIGHT * email similarity,
+# plus PHONE_BONUS when both have the same phone number
+NAME_WEIGHT = 0.6
+EMAIL_WEIGHT = 0.4
+PHONE_BONUS = 0.05
+
+# Most student pairs compared in one numpy operation
+CHUNK_PAIRS = 1_000_000
+
+# Set bits in each byte value, for counting shared bigrams
+_BITS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+STUDENTS = '''
+    SELECT s.id, s.name, s.email, s.class_name, s.phone, s.version, COALESCE(ss.grade_count, 0)
+    FROM students s
+    LEFT JOIN student_summary ss ON ss.student_id = s.id
+    WHERE %(classes)s::varchar[] IS NULL OR s.class_name = ANY(%(classes)s::varchar[])
+    ORDER BY s.id
+'''
+
+
+def _fold(text):
+    """Lower case ASCII letters, digits and single spaces"""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().casefold()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+
+def _email_key(email):
+    local = (email or '').casefold().split('@')[0].split('+')[0]
+    return re.sub(r'[^a-z0-9]', '', local)
+
+
+class Student:
+    """A student as the dedup engine compares them"""
+
+    __slots__ = ('id', 'name', 'email', 'class_name', 'phone', 'version', 'grade_count',
+                 'name_key', 'sorted_name', 'email_key', 'grams')
+
+    def __init__(self, student_id, name, email, class_name, phone, version, grade_count):
+        self.id = student_id
+        self.name = name
+        self.email = email
+        self.class_name = class_name
+        self.phone = phone or ''
+        self.version = version
+        self.grade_count = grade_count
+        self.name_key = _fold(name)
+        self.sorted_name = ' '.join(sorted(self.name_key.split()))
+        self.email_key = _email_key(email)
+        padded = f' {self.sorted_name} '
+        self.grams = {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+    def label(self):
+        return f"{self.name} <{self.email}> (#{self.id}, {self.class_name}, {self.grade_count} grades)"
+
+
+class Suggestion:
+    """Students that look like one person: keep absorbs the duplicates
+
+    score is the best pair score within the group.
+    """
+
+    def __init__(self, keep, duplicates, score):
+        self.keep = keep
+        self.duplicates = duplicates
+        self.score = score
+
+    def merge(self, conn):
+        """Merge the duplicates into keep; ConflictError if any changed since they were read"""
+        return repository.merge_students(conn, self.keep.id, [student.id for student in self.duplicates],
+                                         self.keep.version,
+                                         [student.version for student in self.duplicates])
+
+
+def load_students(conn, classes=None):
+    cursor = conn.cursor()
+    cursor.execute(STUDENTS, {'classes': list(classes) if classes else None})
+    return [Student(*row) for row in cursor.fetchall()]
+
+
+def _similar_names(students, threshold):
+    """Pairs of students whose name bigram sets have Jaccard similarity >= threshold"""
+    frequency = Counter(gram for student in students for gram in student.grams)
+    rank = {gram: i for i, gram in enumerate(sorted(frequency, key=lambda gram: (frequency[gram], gram)))}
+    members = np.zeros((len(students), len(rank)), dtype=bool)
+    sizes = np.empty(len(students), dtype=np.int64)
+    postings = defaultdict(list)
+    for row, student in enumerate(students):
+        grams = sorted(rank[gram] for gram in student.grams)
+        members[row, grams] = True
+        sizes[row] = len(grams)
+        # Rarest first: the prefix that any similar enough name shares a bigram of
+        for gram in grams[:len(grams) - math.ceil(threshold * len(grams)) + 1]:
+            postings[gram].append(row)
+    packed = np.packbits(members, axis=1)
+    if len(students) ** 2 <= CHUNK_PAIRS:
+        # A class-sized block is quicker compared all at once
+        postings = {None: range(len(students))}
+    found = set()
+    for rows in postings.values():
+        rows = np.array(rows)
+        step = max(1, CHUNK_PAIRS // len(rows))
+        for first in range(0, len(rows) - 1, step):
+            left = rows[first:first + step]
+            shared = _BITS[packed[left][:, None, :] & packed[rows][None, :, :]].sum(axis=2, dtype=np.int64)
+            union = sizes[left][:, None] + sizes[rows][None, :] - shared
+            later = np.arange(len(rows))[None, :] > np.arange(first, first + len(left))[:, None]
+            i, j = np.nonzero(later & (shared >= threshold * union))
+            found.update(zip(left[i].tolist(), rows[j].tolist()))
+    return [(students[a], students[b]) for a, b in found]
+
+
+def candidate_pairs(students, threshold=BLOCK_SIMILARITY):
+    """Blocked candidate pairs: similar names in a class, or the same email local part"""
+    by_class = defaultdict(list)
+    by_email = defaultdict(list)
+    for student in students:
+        by_class[student.class_name].append(student)
+        if student.email_key:
+            by_email[student.email_key].append(student)
+    pairs = {}
+    for members in by_class.values():
+        for a, b in _similar_names(members, threshold):
+            pairs[min(a.id, b.id), max(a.id, b.id)] = (a, b)
+    for members in by_email.values():
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pairs.setdefault((min(a.id, b.id), max(a.id, b.id)), (a, b))
+    return list(pairs.values())
+
+
+def score(a, b, threshold=0.0, names=None, emails=None):
+    """How alike two students are, from 0 to 1 (plus PHONE_BONUS)
+
+    Pairs that cannot reach threshold score 0 without a full comparison.
+    names and emails are SequenceMatchers to reuse.
+    """
+    names = names or SequenceMatcher(autojunk=False)
+    emails = emails or SequenceMatcher(autojunk=False)
+    bonus = PHONE_BONUS if a.phone and a.phone == b.phone else 0
+    names.set_seqs(a.name_key, b.name_key)
+    emails.set_seqs(a.email_key, b.email_key)
+    # quick_ratio bounds ratio from above (for either word order)
+    if NAME_WEIGHT * names.quick_ratio() + EMAIL_WEIGHT * emails.quick_ratio() + bonus < threshold:
+        return 0.0
+    name = names.ratio()
+    if a.sorted_name != a.name_key or b.sorted_name != b.name_key:
+        names.set_seqs(a.sorted_name, b.sorted_name)
+        name = max(name, names.ratio())
+    return NAME_WEIGHT * name + EMAIL_WEIGHT * emails.ratio() + bonus
+
+
+def find_duplicates(conn, classes=None, threshold=MATCH_SCORE):
+    """Merge suggestions, most alike first"""
+    students = load_students(conn, classes)
+    names = SequenceMatcher(autojunk=False)
+    emails = SequenceMatcher(autojunk=False)
+    matches = []
+    for a, b in candidate_pairs(students):
+        pair_score = score(a, b, threshold, names, emails)
+        if pair_score >= threshold:
+            matches.append((pair_score, a, b))
+    return group(matches)
+
+
+def group(matches):
+    """Suggestions from (score, a, b) matches, joining pairs that share a student"""
+    members = {}
+    parent = {}
+
+    def root(student_id):
+        while parent[student_id] != student_id:
+            parent[student_id] = parent[parent[student_id]]
+            student_id = parent[student_id]
+        return student_id
+
+    for _, a, b in matches:
+        for student in (a, b):
+            members[student.id] = student
+            parent.setdefault(student.id, student.id)
+        parent[root(a.id)] = root(b.id)
+    groups = defaultdict(list)
+    for student in members.values():
+        groups[root(student.id)].append(student)
+    best = defaultdict(float)
+    for pair_score, a, _ in matches:
+        best[root(a.id)] = max(best[root(a.id)], pair_score)
+    suggestions = []
+    for key, students in groups.items():
+        # Keep the student with the most grades, then the earliest entered
+        students.sort(key=lambda student: (-student.grade_count, student.id))
+        suggestions.append(Suggestion(students[0], students[1:], round(min(best[key], 1.0), 3)))
+    suggestions.sort(key=lambda suggestion: (-suggestion.score, suggestion.keep.id))
+    return suggestions
+
+
+def main():
+    """Command-line entry point: list merge suggestions"""
+    parser = argparse.ArgumentParser(description="Find students entered more than once")
+    parser.add_argument('--threshold', type=float, default=MATCH_SCORE,
+                        help=f"lowest score reported (default {MATCH_SCORE})")
+    parser.add_argument('--class', dest='classes', action='append', metavar='CLASS',
+                        help="only this class; may be repeated")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with connect() as conn:
+        suggestions = find_duplicates(conn, args.classes, args.threshold)
+    for suggestion in suggestions:
+        print(f"{suggestion.score:.2f}  keep {suggestion.keep.label()}")
+        for student in suggestion.duplicates:
+            print(f"      merge {student.label()}")
+    print(f"{len(suggestions)} suggestion(s) in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
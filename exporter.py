@@ -0,0 +1,138 @@
+# exporter.py
+#
+# Streams a query's results to CSV, JSON Lines or Parquet without holding
+# the result in memory: CSV goes through COPY ... TO STDOUT, the other
+# formats read from a named (server-side) cursor in fixed-size batches.
+# Parquet output needs pyarrow.
+
+import datetime
+import decimal
+import json
+import os
+
+BATCH_SIZE = 5000
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl', '.parquet': 'parquet'}
+
+
+def format_for(path):
+    """Pick the export format from a file extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported export format: {extension or path}")
+    return FORMATS[extension]
+
+
+def _json_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _batches(conn, sql, params, batch_size):
+    """Yield (cursor.description, rows) batches from a server-side cursor"""
+    cursor = conn.cursor(name='export_cursor')
+    cursor.itersize = batch_size
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield cursor.description, rows
+    finally:
+        cursor.close()
+
+
+def export_csv(conn, sql, params, path):
+    """Write the query to CSV with a header row; returns the row count"""
+    cursor = conn.cursor()
+    query = cursor.mogrify(sql, params).decode()
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    return cursor.rowcount
+
+
+def export_jsonl(conn, sql, params, path, batch_size=BATCH_SIZE):
+    """Write one JSON object per row; returns the row count"""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for description, rows in _batches(conn, sql, params, batch_size):
+            columns = [column.name for column in description]
+            for row in rows:
+                record = {name: _json_value(value) for name, value in zip(columns, row)}
+                f.write(json.dumps(record) + '\n')
+            count += len(rows)
+    return count
+
+
+def _parquet_type(pa, column):
+    """The Arrow type for a result column, from its Postgres type oid"""
+    if column.type_code in (20, 21, 23):
+        return pa.int64()
+    if column.type_code == 1700:
+        # numeric without a declared precision, e.g. ROUND(...), has no fixed scale
+        if column.precision and column.precision <= 38 and column.scale is not None:
+            return pa.decimal128(column.precision, column.scale)
+        return pa.float64()
+    if column.type_code in (700, 701):
+        return pa.float64()
+    if column.type_code == 16:
+        return pa.bool_()
+    if column.type_code == 1082:
+        return pa.date32()
+    if column.type_code == 1114:
+        return pa.timestamp('us')
+    if column.type_code == 1184:
+        return pa.timestamp('us', tz='UTC')
+    return pa.string()
+
+
+def _parquet_value(value, type_):
+    if value is None:
+        return None
+    if isinstance(value, decimal.Decimal) and type_ == 'double':
+        return float(value)
+    if type_ == 'string' and not isinstance(value, str):
+        return str(value)
+    return value
+
+
+def export_parquet(conn, sql, params, path, batch_size=BATCH_SIZE):
+    """Write the query as Parquet, one row group per batch; returns the row count"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow")
+
+    count = 0
+    writer = None
+    try:
+        for description, rows in _batches(conn, sql, params, batch_size):
+            if writer is None:
+                # From the column types rather than the values, which may
+                # all be NULL in the first batch
+                schema = pa.schema([(column.name, _parquet_type(pa, column)) for column in description])
+                writer = pq.ParquetWriter(path, schema)
+            data = {field.name: [_parquet_value(row[i], str(field.type)) for row in rows]
+                    for i, field in enumerate(schema)}
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+            count += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        # Empty result: still leave a valid (empty) file behind
+        pq.write_table(pa.table({}), path)
+    return count
+
+
+EXPORTERS = {'csv': export_csv, 'jsonl': export_jsonl, 'parquet': export_parquet}
+
+
+def export_query(conn, sql, params, path):
+    """Export a query to path in the format implied by its extension"""
+    return EXPORTERS[format_for(path)](conn, sql, params, path)
@@ -0,0 +1,249 @@
+# importer.py
+#
+# Bulk import of students and grades from CSV (or .xlsx when openpyxl is
+# installed). Rows are streamed, validated with the same rules as the forms,
+# loaded into a temporary staging table with COPY in fixed-size batches and
+# then merged with one set-based statement, so memory use does not grow
+# with the file.
+#
+#   students: name, email, class_name, phone
+#   grades:   student_email, subject, grade, max_marks, exam_date (YYYY-MM-DD)
+#
+# Students are matched on email and updated if they already exist.
+
+import argparse
+import csv
+import io
+import sys
+from datetime import date
+
+from db_config import connect
+from validation import student_error, grade_error, round_marks
+
+BATCH_SIZE = 10000
+
+# Rejected rows kept in memory for display; the rest are only counted
+# (or written to the rejects file)
+MAX_REPORTED_REJECTS = 100
+
+
+class ImportResult:
+    """Counts and rejected rows from one import"""
+
+    def __init__(self, kind, rejects_path=None):
+        self.kind = kind
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.rejects = []
+        self._rejects_file = open(rejects_path, 'w', newline='') if rejects_path else None
+        self._rejects_writer = csv.writer(self._rejects_file) if self._rejects_file else None
+        if self._rejects_writer:
+            self._rejects_writer.writerow(('line', 'reason'))
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append((line, reason))
+        if self._rejects_writer:
+            self._rejects_writer.writerow((line, reason))
+
+    def close(self):
+        if self._rejects_file:
+            self._rejects_file.close()
+
+    def summary(self):
+        """Human-readable report of the import"""
+        lines = [f"Read {self.read} {self.kind} rows: {self.inserted} added, "
+                 f"{self.updated} updated, {self.rejected} rejected"]
+        for line, reason in self.rejects[:10]:
+            lines.append(f"  line {line}: {reason}")
+        if self.rejected > 10:
+            lines.append(f"  ... and {self.rejected - 10} more")
+        return '\n'.join(lines)
+
+
+class _CopyBuffer:
+    """Accumulates rows as CSV and ships them to a table with COPY"""
+
+    def __init__(self, cursor, table, columns, batch_size=BATCH_SIZE):
+        self.cursor = cursor
+        self.sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        self.batch_size = batch_size
+        self._reset()
+
+    def _reset(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.rows = 0
+
+    def add(self, values):
+        self.writer.writerow(values)
+        self.rows += 1
+        if self.rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.buffer.seek(0)
+            self.cursor.copy_expert(self.sql, self.buffer)
+        self._reset()
+
+
+def read_rows(path):
+    """Yield (line_number, row) pairs with lower-cased column names"""
+    if path.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise RuntimeError("Importing .xlsx files requires openpyxl")
+        workbook = load_workbook(path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(name or '').strip().lower() for name in next(rows, ())]
+            for number, row in enumerate(rows, start=2):
+                yield number, {name: '' if value is None else str(value)
+                               for name, value in zip(header, row)}
+        finally:
+            workbook.close()
+        return
+
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        for row in reader:
+            yield reader.line_num, dict(zip(header, row))
+
+
+def _field(row, name):
+    return (row.get(name) or '').strip()
+
+
+def import_students(conn, path, progress=None, rejects_path=None):
+    """Load a students file; existing emails are updated"""
+    result = ImportResult('student', rejects_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TEMP TABLE import_students (
+                line INTEGER, name TEXT, email TEXT, class_name TEXT, phone TEXT
+            ) ON COMMIT DROP
+        ''')
+        staging = _CopyBuffer(cursor, 'import_students',
+                              ('line', 'name', 'email', 'class_name', 'phone'))
+
+        for line, row in read_rows(path):
+            result.read += 1
+            name, email, class_name, phone = (_field(row, column) for column in
+                                              ('name', 'email', 'class_name', 'phone'))
+            error = student_error(name, email, class_name, phone)
+            if error:
+                result.reject(line, error)
+            else:
+                staging.add((line, name, email, class_name, phone))
+            if progress and result.read % BATCH_SIZE == 0:
+                progress(result.read)
+        staging.flush()
+
+        # The last occurrence of an email in the file wins
+        cursor.execute('''
+            WITH merged AS (
+                INSERT INTO students (name, email, class_name, phone)
+                SELECT DISTINCT ON (email) name, email, class_name, phone
+                FROM import_students
+                ORDER BY email, line DESC
+                ON CONFLICT (email) DO UPDATE
+                    SET name = EXCLUDED.name,
+                        class_name = EXCLUDED.class_name,
+                        phone = EXCLUDED.phone
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted)
+            FROM merged
+        ''')
+        result.inserted, result.updated = cursor.fetchone()
+    finally:
+        result.close()
+    return result
+
+
+def import_grades(conn, path, progress=None, rejects_path=None):
+    """Load a grades file; students are looked up by email"""
+    result = ImportResult('grade', rejects_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TEMP TABLE import_grades (
+                line INTEGER, student_email TEXT, subject TEXT,
+                grade NUMERIC, max_marks NUMERIC, exam_date DATE
+            ) ON COMMIT DROP
+        ''')
+        staging = _CopyBuffer(cursor, 'import_grades',
+                              ('line', 'student_email', 'subject', 'grade', 'max_marks', 'exam_date'))
+
+        for line, row in read_rows(path):
+            result.read += 1
+            email, subject, grade, max_marks, exam_date = (
+                _field(row, column) for column in
+                ('student_email', 'subject', 'grade', 'max_marks', 'exam_date'))
+            max_marks = max_marks or '100'
+            error = grade_error(email, subject, grade, max_marks)
+            if not error and exam_date:
+                try:
+                    date.fromisoformat(exam_date)
+                except ValueError:
+                    error = "Exam date must be YYYY-MM-DD"
+            if error:
+                result.reject(line, error)
+            else:
+                # Stored as the DECIMAL(5,2) column would round them
+                staging.add((line, email, subject, round_marks(grade), round_marks(max_marks), exam_date))
+            if progress and result.read % BATCH_SIZE == 0:
+                progress(result.read)
+        staging.flush()
+        cursor.execute('ANALYZE import_grades')
+
+        unknown = conn.cursor(name='import_unknown_students')
+        unknown.execute('''
+            SELECT i.line FROM import_grades i
+            WHERE NOT EXISTS (SELECT 1 FROM students s WHERE s.email = i.student_email)
+            ORDER BY i.line
+        ''')
+        for rows in iter(lambda: unknown.fetchmany(BATCH_SIZE), []):
+            for (line,) in rows:
+                result.reject(line, "Unknown student email")
+
+        cursor.execute('''
+            INSERT INTO grades (student_id, subject, grade, max_marks, exam_date)
+            SELECT s.id, i.subject, i.grade, i.max_marks, i.exam_date
+            FROM import_grades i
+            JOIN students s ON s.email = i.student_email
+        ''')
+        result.inserted = cursor.rowcount
+    finally:
+        result.close()
+    return result
+
+
+IMPORTERS = {'students': import_students, 'grades': import_grades}
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Bulk-load students or grades from CSV/XLSX")
+    parser.add_argument('kind', choices=sorted(IMPORTERS))
+    parser.add_argument('path')
+    parser.add_argument('--rejects', help="write every rejected row to this CSV file")
+    args = parser.parse_args()
+
+    def progress(rows):
+        print(f"{rows} rows read", file=sys.stderr)
+
+    with connect() as conn:
+        result = IMPORTERS[args.kind](conn, args.path, progress, args.rejects)
+    print(result.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# instrumentation.py
+#
+# Timing for every pooled database call, grouped by the operation it ran for
+# (a QueryExecutor job, a VirtualTable, the mirror sync...). db_config hands
+# out connections whose cursors are InstrumentedCursor, so queries are timed
+# without touching the code that issues them. Statements slower than
+# SLOW_QUERY_MS keep their text and, for plain SELECTs, a plan: EXPLAIN
+# (ANALYZE, BUFFERS) for statements from the queries catalog, run in a
+# savepoint that is always rolled back, and a plain EXPLAIN for other SQL,
+# which could do harm if run twice (a rollback does not undo
+# pg_advisory_lock, say). The Diagnostics tab shows the numbers; to_json()
+# and to_prometheus() export them, and serve() publishes them over HTTP.
+
+import json
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+import psycopg2.extensions
+
+SLOW_QUERY_MS = 250
+
+# EXPLAIN ANALYZE runs the statement again, so each statement is explained at
+# most once per interval
+EXPLAIN_INTERVAL = 300
+
+MAX_SLOW_QUERIES = 50
+
+# Only plain SELECTs are explained: a WITH may hold a data-modifying CTE
+_READ_ONLY = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+_EXECUTE = re.compile(r'\s*EXECUTE\s+(\w+)', re.IGNORECASE)
+
+
+class Stat:
+    __slots__ = ('count', 'total', 'max', 'rows')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+
+class Metrics:
+    """Thread-safe counters keyed by (operation, kind)
+
+    kind is what was measured: connect, query, copy, cache hit, job or
+    render; or statement, for the runs of one query through queries.execute(),
+    keyed by the query's name in place of the operation. Times are in
+    seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow = deque(maxlen=MAX_SLOW_QUERIES)
+        self._explained = {}
+
+    def record(self, kind, seconds, rows=0, operation=None):
+        key = (operation or current_operation(), kind)
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = Stat()
+            stat.count += 1
+            stat.total += seconds
+            stat.max = max(stat.max, seconds)
+            stat.rows += rows
+
+    def record_slow(self, sql, seconds, rows, plan=None):
+        with self._lock:
+            self._slow.appendleft({
+                'operation': current_operation(),
+                'sql': sql,
+                'ms': round(seconds * 1000, 1),
+                'rows': rows,
+                'plan': plan,
+                'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            })
+
+    def should_explain(self, sql):
+        """True at most once per EXPLAIN_INTERVAL for a statement"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get(sql, -EXPLAIN_INTERVAL) < EXPLAIN_INTERVAL:
+                return False
+            self._explained[sql] = now
+            return True
+
+    def stats(self):
+        """One dict per (operation, kind), slowest total first"""
+        with self._lock:
+            items = [(key, stat.count, stat.total, stat.max, stat.rows)
+                     for key, stat in self._stats.items()]
+        items.sort(key=lambda item: item[2], reverse=True)
+        return [{'operation': operation, 'kind': kind, 'count': count,
+                 'total_ms': round(total * 1000, 1), 'avg_ms': round(total * 1000 / count, 2),
+                 'max_ms': round(peak * 1000, 1), 'rows': rows}
+                for (operation, kind), count, total, peak, rows in items]
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+            self._explained.clear()
+
+    def to_json(self):
+        return json.dumps({'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           'stats': self.stats(), 'slow_queries': self.slow_queries()}, indent=2)
+
+    def to_prometheus(self, prefix='student_app'):
+        """The counters in the Prometheus text exposition format"""
+        lines = [f'# TYPE {prefix}_seconds summary',
+                 f'# TYPE {prefix}_seconds_max gauge',
+                 f'# TYPE {prefix}_rows_total counter']
+        for stat in self.stats():
+            labels = 'operation="{}",kind="{}"'.format(_label(stat['operation']), _label(stat['kind']))
+            lines.append(f'{prefix}_seconds_count{{{labels}}} {stat["count"]}')
+            lines.append(f'{prefix}_seconds_sum{{{labels}}} {stat["total_ms"] / 1000}')
+            lines.append(f'{prefix}_seconds_max{{{labels}}} {stat["max_ms"] / 1000}')
+            lines.append(f'{prefix}_rows_total{{{labels}}} {stat["rows"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+_current = threading.local()
+
+
+def current_operation():
+    return getattr(_current, 'name', None) or 'other'
+
+
+@contextmanager
+def operation(name):
+    """Attribute measurements made on this thread to name"""
+    previous = getattr(_current, 'name', None)
+    _current.name = name
+    try:
+        yield
+    finally:
+        _current.name = previous
+
+
+@contextmanager
+def timed(kind, operation=None, rows=0):
+    """Record how long the with block took"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record(kind, time.perf_counter() - start, rows, operation)
+
+
+def operation_name(work):
+    """A readable operation name for a job's callable"""
+    name = getattr(work, '__qualname__', None) or type(work).__name__
+    return name.replace('.<locals>', '')
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """A cursor that times execute(), executemany() and copy_expert()"""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - start
+            rows = max(self.rowcount, 0)
+            metrics.record('query', elapsed, rows)
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                self._record_slow(query, elapsed, rows)
+
+    def executemany(self, query, vars_list):
+        with timed('query'):
+            return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        with timed('copy'):
+            return super().copy_expert(sql, file, size)
+
+    def _record_slow(self, query, elapsed, rows):
+        sql = self.query.decode(errors='replace') if self.query else str(query)
+        plan = None
+        conn = self.connection
+        # A prepared statement is judged by, and listed with, the SQL it runs
+        prepared = _EXECUTE.match(sql)
+        source = getattr(conn, 'sources', {}).get(prepared.group(1)) if prepared else None
+        statement = source or sql
+        explain = (self.name is None and _READ_ONLY.match(statement) and 'FOR UPDATE' not in statement.upper()
+                   and conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+                   and metrics.should_explain(source or str(query)))
+        if explain:
+            # A plain cursor, so the EXPLAIN is neither timed nor explained itself
+            cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+            try:
+                cursor.execute('SAVEPOINT explain_slow_query')
+                try:
+                    # Only the catalog's statements are known to be safe to run twice
+                    options = '(ANALYZE, BUFFERS) ' if source is not None else ''
+                    cursor.execute(f'EXPLAIN {options}{sql}')
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+                except psycopg2.Error as e:
+                    plan = f"EXPLAIN failed: {e}"
+                # Undo whatever the second run did, whether or not it succeeded
+                cursor.execute('ROLLBACK TO SAVEPOINT explain_slow_query')
+                cursor.execute('RELEASE SAVEPOINT explain_slow_query')
+            except psycopg2.Error:
+                plan = None
+            finally:
+                cursor.close()
+        if source is not None:
+            sql = f'{source.strip()}\n-- run as {sql}'
+        metrics.record_slow(sql, elapsed, rows, plan)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = metrics.to_prometheus(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = metrics.to_json(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,159 @@
+# live_search.py
+
+from collections import OrderedDict
+
+import queries
+from row_store import RowStore
+
+# Wait this long after the last keystroke before querying
+DEBOUNCE_MS = 250
+
+# Results up to this size are cached and narrowed locally; larger ones are
+# paged from the database instead
+RESULT_LIMIT = 2000
+
+
+def like_pattern(term):
+    """ILIKE pattern matching term anywhere, with wildcards in term escaped"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def matches(name, term):
+    """Local equivalent of name ILIKE like_pattern(term)"""
+    return term.casefold() in (name or '').casefold()
+
+
+# Columns of a search table row, in both the grade and the summary layout
+NAME, CLASS, SUBJECT, PERCENTAGE = 0, 2, 3, 5
+
+
+class SearchFilter:
+    """The search tab's criteria, all of which a row must meet
+
+    name matches anywhere in the student's name, ignoring case; class_name
+    and subject match exactly; the percentage (a grade's, or a student's
+    average in summary mode) must lie within low..high. Criteria left as
+    None are not applied.
+    """
+
+    def __init__(self, name=None, class_name=None, subject=None, low=None, high=None, summary=False):
+        self.name = name or None
+        self.class_name = class_name or None
+        self.subject = subject or None
+        self.low = low
+        self.high = high
+        self.summary = summary
+
+    def key(self):
+        return (self.name.casefold() if self.name else None, self.class_name, self.subject,
+                self.low, self.high, self.summary)
+
+    def sql(self):
+        """(where, params, join) selecting the matching rows in StudentManagementSystem.search_source"""
+        conditions, params, join = [], [], 'LEFT JOIN'
+        if self.name:
+            conditions.append('s.name ILIKE %s')
+            params.append(like_pattern(self.name))
+        if self.class_name:
+            conditions.append('s.class_name = %s')
+            params.append(self.class_name)
+        if self.subject:
+            if self.summary:
+                conditions.append('EXISTS (SELECT 1 FROM grades g WHERE g.student_id = s.id AND g.subject = %s)')
+            else:
+                conditions.append('g.subject = %s')
+                join = 'JOIN'
+            params.append(self.subject)
+        percentage = 'ss.average_percentage' if self.summary else queries.PERCENTAGE
+        if self.low is not None:
+            conditions.append(f'{percentage} >= %s')
+            params.append(self.low)
+        if self.high is not None:
+            conditions.append(f'{percentage} <= %s')
+            params.append(self.high)
+        return ' AND '.join(conditions) or None, tuple(params), join
+
+    def covers(self, other):
+        """True if other's rows are a subset of ours that apply() can pick out"""
+        if self.summary != other.summary:
+            return False
+        if self.name and not (other.name and self.name.casefold() in other.name.casefold()):
+            return False
+        if self.class_name and self.class_name != other.class_name:
+            return False
+        # Summary rows have no subject column to filter on
+        if self.subject != other.subject and (self.subject or self.summary):
+            return False
+        if self.low is not None and (other.low is None or other.low < self.low):
+            return False
+        if self.high is not None and (other.high is None or other.high > self.high):
+            return False
+        return True
+
+    def matches(self, row):
+        if self.name and not matches(row[NAME], self.name):
+            return False
+        if self.class_name and row[CLASS] != self.class_name:
+            return False
+        if self.subject and not self.summary and row[SUBJECT] != self.subject:
+            return False
+        if self.low is not None or self.high is not None:
+            percentage = row[PERCENTAGE]
+            if percentage is None:
+                return False
+            if self.low is not None and percentage < self.low:
+                return False
+            if self.high is not None and percentage > self.high:
+                return False
+        return True
+
+    def apply(self, rows):
+        """The matching rows of a list of rows or a RowStore"""
+        if not isinstance(rows, RowStore):
+            return [row for row in rows if self.matches(row)]
+        if self.name:
+            rows = rows.where(NAME, lambda name: matches(name, self.name))
+        if self.class_name:
+            rows = rows.where(CLASS, lambda class_name: class_name == self.class_name)
+        if self.subject and not self.summary:
+            rows = rows.where(SUBJECT, lambda subject: subject == self.subject)
+        if self.low is not None or self.high is not None:
+            rows = rows.between(PERCENTAGE, self.low, self.high)
+        return rows
+
+
+class SearchCache:
+    """Complete results of recent searches
+
+    A search is answered from any cached result whose filter covers it, such
+    as a shorter name, no class, or a wider percentage range: every row the
+    narrower filter matches is already among the cached rows.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, search_filter):
+        """Rows matching search_filter, or None if the database must be asked"""
+        key = search_filter.key()
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key][1]
+        covering = [rows for cached, rows in self._entries.values() if cached.covers(search_filter)]
+        if not covering:
+            return None
+        rows = search_filter.apply(min(covering, key=len))
+        self.put(search_filter, rows)
+        return rows
+
+    def put(self, search_filter, rows):
+        key = search_filter.key()
+        self._entries[key] = (search_filter, rows)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
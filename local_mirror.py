@@ -0,0 +1,656 @@
+# local_mirror.py
+#
+# Optional SQLite mirror of students and grades for slow or unreliable links
+# (set STUDENT_OFFLINE_MIRROR to the mirror file). Reads are served from the
+# local file. Writes are applied locally and queued in an outbox that
+# SyncThread replays against Postgres, after which it pulls whatever changed
+# on the server since the last sync (updated_at and deleted_rows, migration 6).
+#
+# Conflicts are detected with the version column: an offline edit to a row
+# that changed on the server in the meantime is dropped in favour of the
+# server's copy and recorded in sync_conflicts. Updates and deletes are
+# queued with the version of the mirror's copy they replaced; edits that carry
+# the version the app read are checked against that copy first. Rows created
+# offline get negative ids until they have been pushed.
+#
+# The functions below mirror repository.py, taking a MirrorSession where the
+# repository takes a psycopg2 connection.
+
+import datetime
+import decimal
+import json
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+
+import db_config
+import instrumentation
+import repository
+from repository import ValidationError, DuplicateError
+
+SYNC_INTERVAL = 10
+
+# Re-read server changes this far behind the last pull, to catch transactions
+# that started before it but committed after it
+SYNC_OVERLAP = datetime.timedelta(seconds=60)
+
+PUSH_BATCH = 500
+PULL_BATCH = 5000
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS students (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL,
+        class_name TEXT NOT NULL,
+        phone TEXT,
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS students_name_id_idx ON students (name, id)',
+    'CREATE INDEX IF NOT EXISTS students_email_idx ON students (email)',
+    '''
+    CREATE TABLE IF NOT EXISTS grades (
+        id INTEGER PRIMARY KEY,
+        student_id INTEGER,
+        subject TEXT NOT NULL,
+        grade REAL NOT NULL,
+        max_marks REAL NOT NULL DEFAULT 100,
+        exam_date TEXT,
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS grades_student_id_idx ON grades (student_id)',
+    'CREATE INDEX IF NOT EXISTS grades_subject_idx ON grades (subject)',
+    '''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        op TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS id_map (
+        table_name TEXT NOT NULL,
+        temp_id INTEGER NOT NULL,
+        real_id INTEGER NOT NULL,
+        PRIMARY KEY (table_name, temp_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sync_conflicts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        op TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        reason TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)',
+]
+
+# Columns pulled from Postgres, in the mirror's column order
+PULLED = {
+    'students': 'id, name, email, class_name, phone, version, updated_at',
+    'grades': 'id, student_id, subject, grade, max_marks, exam_date, version, updated_at',
+}
+
+# Table each outbox operation writes to
+OP_TABLES = {
+    'create_student': 'students', 'update_student': 'students',
+    'delete_students': 'students', 'change_class': 'students',
+    'create_grade': 'grades', 'update_grade': 'grades',
+    'delete_grades': 'grades', 'curve_grades': 'grades',
+}
+
+
+class Conflict(Exception):
+    """An offline change no longer applies to the server's copy"""
+
+
+class LocalMirror:
+    """The mirror file, with one SQLite connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.dirty = threading.Event()
+        self._local = threading.local()
+        with self.session() as session:
+            for statement in SCHEMA:
+                session.db.execute(statement)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def session(self):
+        """This thread's mirror connection; commits on success, rolls back on error"""
+        session = MirrorSession(self, self._db())
+        try:
+            yield session
+            session.db.commit()
+        except Exception:
+            session.db.rollback()
+            raise
+        if session.queued:
+            self.dirty.set()
+
+    def status(self):
+        """(outbox entries waiting, conflicts recorded)"""
+        with self.session() as session:
+            pending = session.db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+            conflicts = session.db.execute('SELECT COUNT(*) FROM sync_conflicts').fetchone()[0]
+        return pending, conflicts
+
+
+class MirrorSession:
+    """A mirror connection, with the closed/cancel() a QueryExecutor job expects"""
+
+    closed = False
+
+    def __init__(self, mirror, db):
+        self.mirror = mirror
+        self.db = db
+        self.queued = False
+
+    def cancel(self):
+        self.db.interrupt()
+
+
+_NAMED = re.compile(r'%\((\w+)\)s')
+
+
+def _sqlite_sql(sql):
+    """Rewrite %(name)s placeholders to sqlite3's :name"""
+    return _NAMED.sub(r':\1', sql)
+
+
+def _sqlite_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _id_list(ids):
+    return json.dumps([int(i) for i in ids])
+
+
+def _upsert_sql(table):
+    """INSERT of a row pulled from Postgres, replacing the mirror's copy"""
+    columns = PULLED[table]
+    names = columns.split(', ')
+    return (f'INSERT INTO {table} ({columns}) VALUES ({", ".join("?" * len(names))}) '
+            f'ON CONFLICT (id) DO UPDATE SET '
+            + ', '.join(f'{name} = excluded.{name}' for name in names[1:]))
+
+
+class MirrorSource:
+    """A students or grades listing read from the mirror, for a VirtualTable"""
+
+    def __init__(self, mirror, table):
+        self.listing = repository.LISTINGS[table]
+        self.session = mirror.session
+
+    def query(self):
+        # Exports read from Postgres, not from the mirror
+        return None
+
+    def count(self, session):
+        return session.db.execute(repository.count_query(self.listing)).fetchone()[0]
+
+    def fetch(self, session, after=None, offset=0, limit=100):
+        sql, params = repository.page_query(self.listing, after, offset, limit)
+        rows = session.db.execute(_sqlite_sql(sql), params).fetchall()
+        return repository.split_keys(self.listing, rows)
+
+    def fetch_rows(self, session, ids):
+        return _listing_rows(session.db, self.listing, ids)
+
+
+def _listing_rows(db, listing, ids):
+    columns, from_clause, order_by, id_column = listing
+    keys = ', '.join(order_by)
+    rows = db.execute(
+        f'SELECT {columns}, {keys} FROM {from_clause} '
+        f'WHERE {id_column} IN (SELECT value FROM json_each(?)) ORDER BY {keys}',
+        (_id_list(ids),)).fetchall()
+    return repository.split_keys(listing, rows)
+
+
+def _check_version(db, table, row_id, found, version):
+    """Raise ConflictError unless the mirror's row is still at version"""
+    if version is None or (found is not None and found[0] == version):
+        return
+    pairs = _listing_rows(db, repository.LISTINGS[table], [row_id])
+    raise repository.conflict(table, row_id, pairs[0][1] if pairs else None)
+
+
+def _check_versions(db, table, row_ids, versions):
+    if versions is None:
+        return
+    expected = {int(row_id): version for row_id, version in zip(row_ids, versions) if version is not None}
+    changed = [row_id for row_id, version in db.execute(
+        f'SELECT id, version FROM {table} WHERE id IN (SELECT value FROM json_each(?))',
+        (_id_list(expected),)) if version != expected[row_id]]
+    if changed:
+        raise repository.delete_conflict(table, changed)
+
+
+# Local writes
+def _enqueue(session, op, **payload):
+    session.db.execute('INSERT INTO outbox (op, payload) VALUES (?, ?)', (op, json.dumps(payload)))
+    session.queued = True
+
+
+def _temp_id(db):
+    """Next negative id for a row created offline; never reused"""
+    row = db.execute("SELECT value FROM sync_state WHERE key = 'next_temp_id'").fetchone()
+    temp_id = int(row[0]) if row else -1
+    db.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('next_temp_id', ?)",
+               (str(temp_id - 1),))
+    return temp_id
+
+
+def _check_email(db, email, student_id=None):
+    row = db.execute('SELECT id FROM students WHERE email = ?', (email,)).fetchone()
+    if row is not None and row[0] != student_id:
+        raise DuplicateError("Email already exists!")
+
+
+def create_student(session, student):
+    params = repository.student_params(student)
+    _check_email(session.db, params['email'])
+    student_id = _temp_id(session.db)
+    row = (student_id, params['name'], params['email'], params['class_name'], params['phone'])
+    session.db.execute('INSERT INTO students (id, name, email, class_name, phone) VALUES (?, ?, ?, ?, ?)',
+                       row)
+    _enqueue(session, 'create_student', id=student_id, student=params)
+    return row + (1,)
+
+
+def create_students(session, students):
+    return [create_student(session, student) for student in students]
+
+
+def update_student(session, student_id, student, version=None):
+    params = repository.student_params(student)
+    found = session.db.execute('SELECT version FROM students WHERE id = ?', (student_id,)).fetchone()
+    _check_version(session.db, 'students', student_id, found, version)
+    if found is None:
+        return None
+    _check_email(session.db, params['email'], student_id)
+    session.db.execute('''
+        UPDATE students SET name = ?, email = ?, class_name = ?, phone = ?, version = version + 1
+        WHERE id = ?
+    ''', (params['name'], params['email'], params['class_name'], params['phone'], student_id))
+    _enqueue(session, 'update_student', id=student_id, version=found[0], student=params)
+    return (student_id, params['name'], params['email'], params['class_name'], params['phone'], found[0] + 1)
+
+
+def change_class(session, student_ids, class_name):
+    params = repository.class_params(student_ids, class_name)
+    rows = session.db.execute('''
+        UPDATE students SET class_name = ?, version = version + 1
+        WHERE id IN (SELECT value FROM json_each(?))
+        RETURNING id, name, email, class_name, phone, version
+    ''', (class_name, _id_list(params['ids']))).fetchall()
+    _enqueue(session, 'change_class', ids=params['ids'], class_name=class_name)
+    return rows
+
+
+def delete_students(session, student_ids, versions=None):
+    _check_versions(session.db, 'students', student_ids, versions)
+    ids = _id_list(student_ids)
+    grade_ids = [row[0] for row in session.db.execute(
+        'DELETE FROM grades WHERE student_id IN (SELECT value FROM json_each(?)) RETURNING id', (ids,))]
+    deleted = session.db.execute(
+        'DELETE FROM students WHERE id IN (SELECT value FROM json_each(?)) RETURNING id, version',
+        (ids,)).fetchall()
+    _enqueue(session, 'delete_students', ids=[row[0] for row in deleted],
+             versions=[row[1] for row in deleted])
+    return [row[0] for row in deleted], grade_ids
+
+
+def create_grade(session, grade):
+    params = repository.grade_params(grade)
+    if session.db.execute('SELECT 1 FROM students WHERE id = ?', (params['student_id'],)).fetchone() is None:
+        raise ValidationError("Student does not exist")
+    grade_id = _temp_id(session.db)
+    session.db.execute('''
+        INSERT INTO grades (id, student_id, subject, grade, max_marks) VALUES (?, ?, ?, ?, ?)
+    ''', (grade_id, params['student_id'], params['subject'], params['grade'], params['max_marks']))
+    _enqueue(session, 'create_grade', id=grade_id, grade=params)
+    return grade_id
+
+
+def create_grades(session, grades):
+    return [create_grade(session, grade) for grade in grades]
+
+
+def update_grade(session, grade_id, grade, version=None):
+    params = repository.grade_params(grade)
+    found = session.db.execute('SELECT version FROM grades WHERE id = ?', (grade_id,)).fetchone()
+    _check_version(session.db, 'grades', grade_id, found, version)
+    if found is None:
+        return []
+    session.db.execute('''
+        UPDATE grades SET student_id = ?, subject = ?, grade = ?, max_marks = ?, version = version + 1
+        WHERE id = ?
+    ''', (params['student_id'], params['subject'], params['grade'], params['max_marks'], grade_id))
+    _enqueue(session, 'update_grade', id=grade_id, version=found[0], grade=params)
+    return [grade_id]
+
+
+def delete_grades(session, grade_ids, versions=None):
+    _check_versions(session.db, 'grades', grade_ids, versions)
+    deleted = session.db.execute(
+        'DELETE FROM grades WHERE id IN (SELECT value FROM json_each(?)) RETURNING id, version',
+        (_id_list(grade_ids),)).fetchall()
+    _enqueue(session, 'delete_grades', ids=[row[0] for row in deleted],
+             versions=[row[1] for row in deleted])
+    return [row[0] for row in deleted]
+
+
+def curve_grades(session, subject=None, grade_ids=None, points=0, factor=1):
+    params = repository.curve_params(subject, grade_ids, points, factor)
+    ids = _id_list(params['ids']) if params['ids'] is not None else None
+    curved = [row[0] for row in session.db.execute('''
+        UPDATE grades
+        SET grade = MIN(max_marks, MAX(0, ROUND(grade * :factor + :points, 2))), version = version + 1
+        WHERE (:subject IS NULL OR subject = :subject)
+          AND (:ids IS NULL OR id IN (SELECT value FROM json_each(:ids)))
+        RETURNING id
+    ''', dict(params, ids=ids))]
+    _enqueue(session, 'curve_grades', **params)
+    return curved
+
+
+def student_choices(session):
+    return session.db.execute('SELECT id, name FROM students ORDER BY name').fetchall()
+
+
+# Replaying the outbox on Postgres
+def _real_id(id_map, table, row_id):
+    if row_id >= 0:
+        return row_id
+    if (table, row_id) not in id_map:
+        raise Conflict(f"Refers to a {table[:-1]} that was never saved on the server")
+    return id_map[(table, row_id)]
+
+
+def _known_ids(id_map, table, ids):
+    """Server ids for ids, leaving out offline rows that were never saved"""
+    return [row_id if row_id >= 0 else id_map[(table, row_id)] for row_id in ids
+            if row_id >= 0 or (table, row_id) in id_map]
+
+
+def _known_versions(id_map, table, ids, versions):
+    """_known_ids, with the versions that go with the ids kept
+
+    versions is None for entries queued before deletes carried them.
+    """
+    if versions is None:
+        return _known_ids(id_map, table, ids), None
+    pairs = [(row_id, version) for row_id, version in zip(ids, versions)
+             if row_id >= 0 or (table, row_id) in id_map]
+    return _known_ids(id_map, table, [pair[0] for pair in pairs]), [pair[1] for pair in pairs]
+
+
+def _push_create_student(conn, payload, id_map):
+    id_map[('students', payload['id'])] = repository.create_student(conn, payload['student'])[0]
+
+
+def _push_update_student(conn, payload, id_map):
+    student_id = _real_id(id_map, 'students', payload['id'])
+    repository.update_student(conn, student_id, payload['student'], payload['version'])
+
+
+def _push_delete_students(conn, payload, id_map):
+    repository.delete_students(conn, *_known_versions(id_map, 'students', payload['ids'],
+                                                      payload.get('versions')))
+
+
+def _push_change_class(conn, payload, id_map):
+    repository.change_class(conn, _known_ids(id_map, 'students', payload['ids']), payload['class_name'])
+
+
+def _push_create_grade(conn, payload, id_map):
+    grade = dict(payload['grade'], student_id=_real_id(id_map, 'students', payload['grade']['student_id']))
+    id_map[('grades', payload['id'])] = repository.create_grade(conn, grade)
+
+
+def _push_update_grade(conn, payload, id_map):
+    grade_id = _real_id(id_map, 'grades', payload['id'])
+    grade = dict(payload['grade'], student_id=_real_id(id_map, 'students', payload['grade']['student_id']))
+    repository.update_grade(conn, grade_id, grade, payload['version'])
+
+
+def _push_delete_grades(conn, payload, id_map):
+    repository.delete_grades(conn, *_known_versions(id_map, 'grades', payload['ids'],
+                                                    payload.get('versions')))
+
+
+def _push_curve_grades(conn, payload, id_map):
+    ids = payload['ids']
+    if ids is not None:
+        ids = _known_ids(id_map, 'grades', ids)
+    repository.curve_grades(conn, payload['subject'], ids, payload['points'], payload['factor'])
+
+
+PUSHERS = {
+    'create_student': _push_create_student,
+    'update_student': _push_update_student,
+    'delete_students': _push_delete_students,
+    'change_class': _push_change_class,
+    'create_grade': _push_create_grade,
+    'update_grade': _push_update_grade,
+    'delete_grades': _push_delete_grades,
+    'curve_grades': _push_curve_grades,
+}
+
+# Errors that reject one outbox entry rather than the whole sync
+REJECTED = (Conflict, repository.ConflictError, ValidationError, DuplicateError, psycopg2.IntegrityError, psycopg2.DataError)
+
+
+class SyncThread(threading.Thread):
+    """Pushes the mirror's outbox to Postgres and pulls the server's changes
+
+    Runs every interval seconds, and soon after every local write. on_sync
+    is called from this thread after each attempt with a dict: online,
+    pending (outbox entries left), conflicts (recorded so far) and changed
+    (tables whose local copy changed).
+    """
+
+    def __init__(self, mirror, on_sync=None, interval=SYNC_INTERVAL):
+        super().__init__(name='mirror-sync', daemon=True)
+        self.mirror = mirror
+        self.on_sync = on_sync
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def wake(self):
+        """Sync now rather than at the next interval"""
+        self.mirror.dirty.set()
+
+    def stop(self):
+        self._stopping.set()
+        self.mirror.dirty.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            self.sync()
+            self.mirror.dirty.wait(self.interval)
+            self.mirror.dirty.clear()
+
+    def sync(self):
+        """Push, then pull; returns the status passed to on_sync"""
+        changed = set()
+        try:
+            with instrumentation.operation('mirror sync'), self.mirror.session() as session:
+                changed |= self._push(session)
+                changed |= self._pull(session)
+            online = True
+        except psycopg2.Error:
+            # The server is unreachable; whatever was not committed is retried
+            online = False
+        pending, conflicts = self.mirror.status()
+        status = {'online': online, 'pending': pending, 'conflicts': conflicts, 'changed': changed}
+        if self.on_sync:
+            self.on_sync(status)
+        return status
+
+    def _push(self, session):
+        db = session.db
+        entries = db.execute('SELECT id, op, payload FROM outbox ORDER BY id LIMIT ?',
+                             (PUSH_BATCH,)).fetchall()
+        if not entries:
+            return set()
+        id_map = {(table, temp_id): real_id for table, temp_id, real_id
+                  in db.execute('SELECT table_name, temp_id, real_id FROM id_map')}
+        known = set(id_map)
+        rejected = []
+        # One server transaction for the batch; a rejected entry only rolls
+        # back to its savepoint
+        with db_config.connect() as conn:
+            cursor = conn.cursor()
+            for entry_id, op, payload in entries:
+                cursor.execute('SAVEPOINT outbox_entry')
+                try:
+                    PUSHERS[op](conn, json.loads(payload), id_map)
+                    cursor.execute('RELEASE SAVEPOINT outbox_entry')
+                except REJECTED as e:
+                    cursor.execute('ROLLBACK TO SAVEPOINT outbox_entry')
+                    rejected.append((op, payload, str(e)))
+            server = self._rejected_rows(cursor, rejected, id_map)
+
+        # The server has committed; settle the local side
+        for (table, temp_id), real_id in id_map.items():
+            if (table, temp_id) in known:
+                continue
+            db.execute(f'DELETE FROM {table} WHERE id = ?', (real_id,))
+            db.execute(f'UPDATE {table} SET id = ? WHERE id = ?', (real_id, temp_id))
+            if table == 'students':
+                db.execute('UPDATE grades SET student_id = ? WHERE student_id = ?', (real_id, temp_id))
+            db.execute('INSERT OR REPLACE INTO id_map (table_name, temp_id, real_id) VALUES (?, ?, ?)',
+                       (table, temp_id, real_id))
+        for op, payload, reason in rejected:
+            db.execute('INSERT INTO sync_conflicts (op, payload, reason) VALUES (?, ?, ?)',
+                       (op, payload, reason))
+            if op in ('create_student', 'create_grade'):
+                # Never saved on the server, so drop the offline row
+                temp_id = json.loads(payload)['id']
+                db.execute(f'DELETE FROM {OP_TABLES[op]} WHERE id = ?', (temp_id,))
+                if op == 'create_student':
+                    db.execute('DELETE FROM grades WHERE student_id = ?', (temp_id,))
+        db.execute('DELETE FROM outbox WHERE id <= ?', (entries[-1][0],))
+        # Undo the rejected changes with the server's copy of their rows,
+        # unless a later entry changes the row again
+        pending = self._pending_rows(db)
+        for table, (ids, rows) in server.items():
+            found = {row[0] for row in rows}
+            db.executemany(_upsert_sql(table), [row for row in rows if (table, row[0]) not in pending])
+            gone = [row_id for row_id in ids if row_id not in found and (table, row_id) not in pending]
+            db.execute(f'DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))', (_id_list(gone),))
+        db.commit()
+        return {OP_TABLES[op] for _, op, _ in entries} | ({'students'} & {OP_TABLES[op] for op, _, _ in rejected}) | set(server)
+
+    def _rejected_rows(self, cursor, rejected, id_map):
+        """{table: (ids, server rows)} for the rows rejected entries changed
+
+        The mirror applied those changes when they were queued, so its copy
+        of the rows has to be read back from the server.
+        """
+        refetch = {'students': set(), 'grades': set()}
+        for op, payload, _ in rejected:
+            if op in ('create_student', 'create_grade'):
+                continue
+            payload = json.loads(payload)
+            table = OP_TABLES[op]
+            ids = payload['ids'] if 'ids' in payload else [payload['id']]
+            if ids is None:
+                # A curve of a whole subject
+                cursor.execute('SELECT id FROM grades WHERE subject = %s', (payload['subject'],))
+                ids = [row[0] for row in cursor.fetchall()]
+            ids = _known_ids(id_map, table, ids)
+            refetch[table].update(ids)
+            if op == 'delete_students':
+                # Their grades were deleted locally with them
+                cursor.execute('SELECT id FROM grades WHERE student_id = ANY(%s)', (ids,))
+                refetch['grades'].update(row[0] for row in cursor.fetchall())
+        server = {}
+        for table, ids in refetch.items():
+            if ids:
+                cursor.execute(f'SELECT {PULLED[table]} FROM {table} WHERE id = ANY(%s)', (sorted(ids),))
+                server[table] = (ids, [tuple(map(_sqlite_value, row)) for row in cursor.fetchall()])
+        return server
+
+    def _pending_rows(self, db):
+        """(table, id) of rows with changes still waiting in the outbox"""
+        rows = set()
+        for op, payload in db.execute('SELECT op, payload FROM outbox'):
+            payload = json.loads(payload)
+            ids = list(payload.get('ids') or [])
+            if 'id' in payload:
+                ids.append(payload['id'])
+            rows.update((OP_TABLES[op], row_id) for row_id in ids)
+        return rows
+
+    def _pull(self, session):
+        db = session.db
+        found = db.execute("SELECT value FROM sync_state WHERE key = 'pulled_at'").fetchone()
+        since = datetime.datetime.fromisoformat(found[0]) - SYNC_OVERLAP if found else None
+        pending = self._pending_rows(db)
+        changed = set()
+        with db_config.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT LOCALTIMESTAMP')
+            pulled_at = cursor.fetchone()[0]
+            for table, columns in PULLED.items():
+                if since is None:
+                    # First sync: the server's copy replaces everything but offline rows
+                    db.execute(f'DELETE FROM {table} WHERE id >= 0')
+                    changed.add(table)
+                upsert = _upsert_sql(table)
+                named = conn.cursor(name=f'mirror_pull_{table}')
+                named.itersize = PULL_BATCH
+                if since is None:
+                    named.execute(f'SELECT {columns} FROM {table}')
+                else:
+                    named.execute(f'SELECT {columns} FROM {table} WHERE updated_at > %s', (since,))
+                while True:
+                    rows = named.fetchmany(PULL_BATCH)
+                    if not rows:
+                        break
+                    rows = [tuple(map(_sqlite_value, row)) for row in rows if (table, row[0]) not in pending]
+                    if rows:
+                        db.executemany(upsert, rows)
+                        db.commit()
+                        changed.add(table)
+                named.close()
+
+            if since is not None:
+                cursor.execute('SELECT table_name, row_id FROM deleted_rows WHERE deleted_at > %s', (since,))
+                for table, row_id in cursor.fetchall():
+                    if table in PULLED and (table, row_id) not in pending:
+                        if db.execute(f'DELETE FROM {table} WHERE id = ?', (row_id,)).rowcount:
+                            changed.add(table)
+
+        db.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('pulled_at', ?)",
+                   (pulled_at.isoformat(),))
+        db.commit()
+        return changed
@@ -1,61 +1,235 @@
 
+import bisect
+import os
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
-import psycopg2
-from db_config import connect
+from tkinter import ttk, messagebox, filedialog, simpledialog
+from db_config import connect, close_pool
+from virtual_table import VirtualTable, QuerySource, ListSource
+from row_store import RowStore
+from student_picker import StudentIndex, StudentPicker
+from query_executor import QueryExecutor
+from migrations import migrate
+from validation import student_error, grade_error
+from importer import IMPORTERS
+from exporter import export_query, format_for
+import live_search
+import query_cache
+import queries
+import analytics
+import audit
+import dedup
+import report_cards
+import repository
+import api_client
+import local_mirror
+import instrumentation
 
 class StudentManagementSystem:
+    SEARCH_COLUMNS = (('Student', 150), ('Email', 180), ('Class', 100), ('Subject', 120),
+                      ('Grade', 80), ('Percentage', 80))
+    SUMMARY_COLUMNS = (('Student', 150), ('Email', 180), ('Class', 100), ('Subjects', 70),
+                       ('Total Marks', 90), ('Average %', 80), ('Last Exam', 90))
+    
+    # Seconds from start to the first tab showing its data
+    STARTUP_BUDGET = 1.0
+    
     def __init__(self, root):
+        self.started_at = time.perf_counter()
+        self.startup_seconds = None
         self.root = root
         self.root.title("Student Management System")
         self.root.geometry("1000x700")
         self.root.configure(bg='#f0f0f0')
-        
-        # Initialize database
-        self.init_database()
-        
-        # Create UI
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # With STUDENT_API_URL set, students and grades go through the HTTP API
+        # (api_server.py) instead of a direct database connection. With
+        # STUDENT_OFFLINE_MIRROR set instead, they are read from and written to
+        # a local SQLite file that syncs with the database in the background.
+        self.api_url = os.environ.get('STUDENT_API_URL')
+        mirror_path = os.environ.get('STUDENT_OFFLINE_MIRROR')
+        self.mirror = local_mirror.LocalMirror(mirror_path) if mirror_path and not self.api_url else None
+        self.sync_thread = None
+        if self.api_url:
+            self.backend, self.backend_session = api_client, api_client.session
+        elif self.mirror:
+            self.backend, self.backend_session = local_mirror, self.mirror.session
+        else:
+            self.backend, self.backend_session = repository, connect
+        # Search, analytics, imports and duplicate detection query the
+        # database directly, which neither the API nor the mirror can serve
+        self.direct_database = not self.api_url and not self.mirror
+        
+        # Background query executor
+        self.executor = QueryExecutor(self.root, on_busy=self.set_busy,
+                                      on_error=lambda e: self.show_error("Database error", e),
+                                      session=self.backend_session)
+        
+        # Live name search state
+        self.search_cache = live_search.SearchCache()
+        self.search_after_id = None
+        
+        # Students offered in the grade form's picker
+        self.student_index = StudentIndex()
+        
+        # Every class / subject, and the filter comboboxes offering them; the
+        # combos in optional_combos also offer '' for no filter
+        self.class_options = []
+        self.subject_options = []
+        self.class_combos = []
+        self.subject_combos = []
+        self.optional_combos = set()
+        
+        # Tabs by title, and the ones built so far
+        self.tabs = {}
+        self.built_tabs = set()
+        self.database_ready = False
+        
+        # Invalidate cached queries when other clients write
+        self.change_listener = None
+        if not self.api_url:
+            self.change_listener = query_cache.ChangeListener(
+                on_change=lambda table: self.executor.post(self.on_remote_change, table))
+            self.change_listener.start()
+        
+        # Create UI; only the first tab is built, and nothing waits on the database
         self.create_widgets()
         
-        # Load initial data
-        self.load_students()
+        # With STUDENT_METRICS_PORT set, publish the diagnostics counters for scraping
+        metrics_port = os.environ.get('STUDENT_METRICS_PORT')
+        self.metrics_server = instrumentation.serve(int(metrics_port)) if metrics_port else None
+        
+        # Connect and check the schema in the background, then load data
+        self.init_database()
         
     def init_database(self):
-        """Initialize database tables"""
-        try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            # Create students table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS students (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    email VARCHAR(100) UNIQUE NOT NULL,
-                    class_name VARCHAR(50) NOT NULL,
-                    phone VARCHAR(20),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create grades table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS grades (
-                    id SERIAL PRIMARY KEY,
-                    student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
-                    subject VARCHAR(100) NOT NULL,
-                    grade DECIMAL(5,2) NOT NULL,
-                    max_marks DECIMAL(5,2) DEFAULT 100,
-                    exam_date DATE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            ''')
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Database Error", f"Error initializing database: {str(e)}")
+        """Bring the database schema up to date off the Tk thread, then load data
+        
+        When the recorded schema version is current, migrate() is a single
+        catalog lookup and a version query.
+        """
+        if self.api_url:
+            # The API server owns the database
+            api_client.configure(self.api_url)
+            self.on_database_ready()
+            return
+        if self.mirror:
+            # The mirror serves data whether or not the database is reachable
+            self.on_database_ready()
+        
+        def done(applied):
+            if self.mirror:
+                self.start_sync()
+            else:
+                self.on_database_ready()
+        
+        def failed(e):
+            if self.mirror:
+                # Work offline; the sync thread retries the connection
+                self.start_sync()
+            else:
+                messagebox.showerror("Database Error", f"Error initializing database: {str(e)}")
+        
+        def prepare(conn):
+            applied = migrate(conn)
+            # Creating partitions runs DDL under a lock, so only when one is due
+            if applied or audit.partitions_missing(conn):
+                audit.ensure_partitions(conn)
+            return applied
+        
+        self.run_query(prepare, done, on_error=failed, session=connect)
+    
+    def on_database_ready(self):
+        """Load the data of every tab built so far"""
+        self.database_ready = True
+        for text in self.built_tabs:
+            self.tabs[text][2]()
+    
+    def start_sync(self):
+        """Keep the offline mirror in step with the database"""
+        self.sync_thread = local_mirror.SyncThread(
+            self.mirror, on_sync=lambda status: self.executor.post(self.on_sync, status))
+        self.sync_thread.start()
+    
+    def on_close(self):
+        """Release pooled connections and close the window"""
+        if self.change_listener:
+            self.change_listener.stop()
+        if self.sync_thread:
+            self.sync_thread.stop()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        self.executor.shutdown()
+        close_pool()
+        self.root.destroy()
+    
+    def run_query(self, work, on_success=None, error_message="Database error", on_error=None,
+                  channel=None, session=None):
+        """Run work(conn) off the Tk thread; failures are shown in a messagebox"""
+        if on_error is None:
+            on_error = lambda e: self.show_error(error_message, e)
+        return self.executor.submit(work, on_success, on_error, channel, session)
+    
+    def run_backend(self, work, on_success=None, error_message="Database error", on_error=None,
+                    channel=None):
+        """run_query for student and grade work, given a session of the current backend"""
+        return self.run_query(work, on_success, error_message, on_error, channel, self.backend_session)
+    
+    def show_error(self, message, error):
+        """Show a database error"""
+        messagebox.showerror("Error", f"{message}: {str(error)}")
+    
+    def data_changed(self, *tables):
+        """Forget cached query results that read from the changed tables"""
+        query_cache.cache.invalidate(*tables)
+        self.search_cache.clear()
+    
+    def on_remote_change(self, table):
+        """Another client changed a table; the query cache is already invalidated"""
+        self.search_cache.clear()
+        if self.sync_thread:
+            self.sync_thread.wake()
+    
+    def on_sync(self, status):
+        """Show the mirror's sync state and redraw tables the sync changed"""
+        text = "Online" if status['online'] else "Offline"
+        if status['pending']:
+            text += f", {status['pending']} change(s) to sync"
+        if status['conflicts']:
+            text += f", {status['conflicts']} conflict(s)"
+        self.sync_label.config(text=text)
+        changed = status['changed']
+        if changed:
+            self.data_changed(*changed)
+            if 'students' in changed and self.tab_built("Students"):
+                self.students_tree.refresh()
+            if 'students' in changed:
+                self.load_students_combo()
+            if 'grades' in changed and self.tab_built("Grades"):
+                self.grades_tree.refresh()
+    
+    def set_busy(self, busy):
+        """Reflect outstanding background queries in the status bar"""
+        if busy:
+            self.status_label.config(text="Working...")
+            self.progress.start(10)
+            self.root.config(cursor='watch')
+        else:
+            self.status_label.config(text="Ready")
+            self.progress.stop()
+            self.root.config(cursor='')
+            if self.startup_seconds is None and self.database_ready:
+                self.startup_finished()
+    
+    def startup_finished(self):
+        """Record time to interactive: the first tab has its data"""
+        self.startup_seconds = time.perf_counter() - self.started_at
+        instrumentation.metrics.record('startup', self.startup_seconds, operation='time to interactive')
+        text = f"Ready (started in {self.startup_seconds:.2f} s)"
+        if self.startup_seconds > self.STARTUP_BUDGET:
+            text += f", over the {self.STARTUP_BUDGET:.1f} s budget"
+        self.status_label.config(text=text)
     
     def create_widgets(self):
         """Create the main UI components"""
@@ -64,19 +238,64 @@ class StudentManagementSystem:
                               font=("Arial", 20, "bold"), bg='#f0f0f0', fg='#333')
         title_label.pack(pady=10)
         
+        # Status bar
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side='bottom', fill='x', padx=10, pady=(0, 5))
+        self.status_label = ttk.Label(status_frame, text="Ready")
+        self.status_label.pack(side='left')
+        if self.mirror:
+            self.sync_label = ttk.Label(status_frame, text="Syncing...")
+            self.sync_label.pack(side='left', padx=20)
+            ttk.Label(status_frame, text="Offline mirror: search, analytics, imports and history "
+                                         "need a direct database connection").pack(side='left', padx=20)
+        self.progress = ttk.Progressbar(status_frame, mode='indeterminate', length=120)
+        self.progress.pack(side='right')
+        
         # Create notebook for tabs
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(fill='both', expand=True, padx=10, pady=5)
         
-        # Create tabs
-        self.create_students_tab()
-        self.create_grades_tab()
-        self.create_search_tab()
-        
-    def create_students_tab(self):
+        # Tabs are built, and their data loaded, when first shown
+        self.add_tab("Students", self.create_students_tab, self.load_students)
+        self.add_tab("Grades", self.create_grades_tab, self.load_grades_tab)
+        if self.direct_database:
+            # These tabs query the database directly
+            self.add_tab("Search & Filter", self.create_search_tab, self.load_filter_options)
+            self.add_tab("Analytics", self.create_analytics_tab, self.load_filter_options)
+            self.add_tab("Leaderboard", self.create_leaderboard_tab, self.load_leaderboard_tab)
+        self.add_tab("Diagnostics", self.create_diagnostics_tab, self.load_diagnostics, refresh=True)
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        self.show_tab(self.notebook.tab(self.notebook.select(), 'text'))
+    
+    def add_tab(self, text, build, load, refresh=False):
+        """Add a tab whose widgets are built by build(frame) when first shown
+        
+        load() fetches the tab's data once the database is ready: after the
+        tab is built, or every time it is shown if refresh is set.
+        """
+        frame = ttk.Frame(self.notebook)
+        self.notebook.add(frame, text=text)
+        self.tabs[text] = (frame, build, load, refresh)
+    
+    def tab_built(self, text):
+        return text in self.built_tabs
+    
+    def on_tab_changed(self, event):
+        """Build the newly selected tab if this is its first showing"""
+        self.show_tab(self.notebook.tab(self.notebook.select(), 'text'))
+    
+    def show_tab(self, text):
+        frame, build, load, refresh = self.tabs[text]
+        if text not in self.built_tabs:
+            build(frame)
+            self.built_tabs.add(text)
+        elif not refresh:
+            return
+        if self.database_ready:
+            load()
+    
+    def create_students_tab(self, students_frame):
         """Create students management tab"""
-        students_frame = ttk.Frame(self.notebook)
-        self.notebook.add(students_frame, text="Students")
         
         # Input frame
         input_frame = ttk.LabelFrame(students_frame, text="Student Information", padding=10)
@@ -106,41 +325,30 @@ class StudentManagementSystem:
         ttk.Button(buttons_frame, text="Add Student", command=self.add_student).pack(side='left', padx=5)
         ttk.Button(buttons_frame, text="Update Student", command=self.update_student).pack(side='left', padx=5)
         ttk.Button(buttons_frame, text="Delete Student", command=self.delete_student).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Change Class...", command=self.change_student_class).pack(side='left', padx=5)
+        if not self.mirror:
+            ttk.Button(buttons_frame, text="History...", command=lambda: self.show_history('students')).pack(side='left', padx=5)
         ttk.Button(buttons_frame, text="Clear Fields", command=self.clear_student_fields).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Reload", command=self.reload_students).pack(side='left', padx=5)
+        if self.direct_database:
+            ttk.Button(buttons_frame, text="Import CSV", command=lambda: self.import_file('students')).pack(side='left', padx=5)
+            ttk.Button(buttons_frame, text="Find Duplicates...", command=self.find_duplicates).pack(side='left', padx=5)
         
         # Students list frame
         list_frame = ttk.LabelFrame(students_frame, text="Students List", padding=10)
         list_frame.pack(fill='both', expand=True, padx=10, pady=5)
         
-        # Treeview for students
-        self.students_tree = ttk.Treeview(list_frame, columns=('ID', 'Name', 'Email', 'Class', 'Phone'), show='headings')
-        self.students_tree.heading('ID', text='ID')
-        self.students_tree.heading('Name', text='Name')
-        self.students_tree.heading('Email', text='Email')
-        self.students_tree.heading('Class', text='Class')
-        self.students_tree.heading('Phone', text='Phone')
-        
-        # Configure column widths
-        self.students_tree.column('ID', width=50)
-        self.students_tree.column('Name', width=150)
-        self.students_tree.column('Email', width=200)
-        self.students_tree.column('Class', width=100)
-        self.students_tree.column('Phone', width=120)
+        # Virtual table for students
+        self.students_tree = VirtualTable(list_frame, executor=self.executor, name='students', columns=(
+            ('ID', 50), ('Name', 150), ('Email', 200), ('Class', 100), ('Phone', 120)))
         
         # Bind selection event
-        self.students_tree.bind('<<TreeviewSelect>>', self.on_student_select)
+        self.students_tree.bind('<<TableSelect>>', self.on_student_select)
         
-        # Scrollbar for students tree
-        students_scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.students_tree.yview)
-        self.students_tree.configure(yscrollcommand=students_scrollbar.set)
+        self.students_tree.pack(fill='both', expand=True)
         
-        self.students_tree.pack(side='left', fill='both', expand=True)
-        students_scrollbar.pack(side='right', fill='y')
-        
-    def create_grades_tab(self):
+    def create_grades_tab(self, grades_frame):
         """Create grades management tab"""
-        grades_frame = ttk.Frame(self.notebook)
-        self.notebook.add(grades_frame, text="Grades")
         
         # Input frame
         input_frame = ttk.LabelFrame(grades_frame, text="Grade Information", padding=10)
@@ -148,8 +356,8 @@ class StudentManagementSystem:
         
         # Student selection
         ttk.Label(input_frame, text="Student:").grid(row=0, column=0, sticky='w', pady=2)
-        self.student_combo = ttk.Combobox(input_frame, width=30, state='readonly')
-        self.student_combo.grid(row=0, column=1, padx=5, pady=2)
+        self.student_picker = StudentPicker(input_frame, self.student_index, width=30)
+        self.student_picker.grid(row=0, column=1, padx=5, pady=2)
         
         ttk.Label(input_frame, text="Subject:").grid(row=0, column=2, sticky='w', pady=2)
         self.subject_entry = ttk.Entry(input_frame, width=30)
@@ -171,102 +379,216 @@ class StudentManagementSystem:
         ttk.Button(buttons_frame, text="Add Grade", command=self.add_grade).pack(side='left', padx=5)
         ttk.Button(buttons_frame, text="Update Grade", command=self.update_grade).pack(side='left', padx=5)
         ttk.Button(buttons_frame, text="Delete Grade", command=self.delete_grade).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Curve...", command=self.open_curve_dialog).pack(side='left', padx=5)
+        if not self.mirror:
+            ttk.Button(buttons_frame, text="History...", command=lambda: self.show_history('grades')).pack(side='left', padx=5)
         ttk.Button(buttons_frame, text="Clear Fields", command=self.clear_grade_fields).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Reload", command=self.load_grades).pack(side='left', padx=5)
+        if self.direct_database:
+            ttk.Button(buttons_frame, text="Import CSV", command=lambda: self.import_file('grades')).pack(side='left', padx=5)
         
         # Grades list frame
         list_frame = ttk.LabelFrame(grades_frame, text="Grades List", padding=10)
         list_frame.pack(fill='both', expand=True, padx=10, pady=5)
         
-        # Treeview for grades
-        self.grades_tree = ttk.Treeview(list_frame, columns=('ID', 'Student', 'Subject', 'Grade', 'Max Marks', 'Percentage'), show='headings')
-        self.grades_tree.heading('ID', text='ID')
-        self.grades_tree.heading('Student', text='Student')
-        self.grades_tree.heading('Subject', text='Subject')
-        self.grades_tree.heading('Grade', text='Grade')
-        self.grades_tree.heading('Max Marks', text='Max Marks')
-        self.grades_tree.heading('Percentage', text='Percentage')
-        
-        # Configure column widths
-        self.grades_tree.column('ID', width=50)
-        self.grades_tree.column('Student', width=150)
-        self.grades_tree.column('Subject', width=120)
-        self.grades_tree.column('Grade', width=80)
-        self.grades_tree.column('Max Marks', width=80)
-        self.grades_tree.column('Percentage', width=80)
+        # Virtual table for grades
+        self.grades_tree = VirtualTable(list_frame, executor=self.executor, name='grades', columns=(
+            ('ID', 50), ('Student', 150), ('Subject', 120), ('Grade', 80),
+            ('Max Marks', 80), ('Percentage', 80)))
         
         # Bind selection event
-        self.grades_tree.bind('<<TreeviewSelect>>', self.on_grade_select)
-        
-        # Scrollbar for grades tree
-        grades_scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.grades_tree.yview)
-        self.grades_tree.configure(yscrollcommand=grades_scrollbar.set)
-        
-        self.grades_tree.pack(side='left', fill='both', expand=True)
-        grades_scrollbar.pack(side='right', fill='y')
-        
-        # Load students for combobox
-        self.load_students_combo()
+        self.grades_tree.bind('<<TableSelect>>', self.on_grade_select)
         
-    def create_search_tab(self):
+        self.grades_tree.pack(fill='both', expand=True)
+    
+    def create_search_tab(self, search_frame):
         """Create search and filter tab"""
-        search_frame = ttk.Frame(self.notebook)
-        self.notebook.add(search_frame, text="Search & Filter")
         
         # Search frame
         search_input_frame = ttk.LabelFrame(search_frame, text="Search Options", padding=10)
         search_input_frame.pack(fill='x', padx=10, pady=5)
         
-        # Search by student name
+        # Every criterion applies together; Search, Filter and Enter all apply them
         ttk.Label(search_input_frame, text="Search by Name:").grid(row=0, column=0, sticky='w', pady=2)
         self.search_name_entry = ttk.Entry(search_input_frame, width=30)
         self.search_name_entry.grid(row=0, column=1, padx=5, pady=2)
-        ttk.Button(search_input_frame, text="Search", command=self.search_by_name).grid(row=0, column=2, padx=5)
+        self.search_name_entry.bind('<KeyRelease>', self.on_search_key)
+        ttk.Button(search_input_frame, text="Search", command=self.apply_filters).grid(row=0, column=2, padx=5)
         
         # Filter by class
         ttk.Label(search_input_frame, text="Filter by Class:").grid(row=1, column=0, sticky='w', pady=2)
         self.filter_class_combo = ttk.Combobox(search_input_frame, width=30)
         self.filter_class_combo.grid(row=1, column=1, padx=5, pady=2)
-        ttk.Button(search_input_frame, text="Filter", command=self.filter_by_class).grid(row=1, column=2, padx=5)
+        self.register_filter(self.class_combos, self.filter_class_combo, optional=True)
+        self.filter_class_combo.bind('<<ComboboxSelected>>', lambda e: self.apply_filters())
+        ttk.Button(search_input_frame, text="Filter", command=self.apply_filters).grid(row=1, column=2, padx=5)
         
         # Filter by subject
         ttk.Label(search_input_frame, text="Filter by Subject:").grid(row=2, column=0, sticky='w', pady=2)
         self.filter_subject_combo = ttk.Combobox(search_input_frame, width=30)
         self.filter_subject_combo.grid(row=2, column=1, padx=5, pady=2)
-        ttk.Button(search_input_frame, text="Filter", command=self.filter_by_subject).grid(row=2, column=2, padx=5)
+        self.register_filter(self.subject_combos, self.filter_subject_combo, optional=True)
+        self.filter_subject_combo.bind('<<ComboboxSelected>>', lambda e: self.apply_filters())
+        ttk.Button(search_input_frame, text="Filter", command=self.apply_filters).grid(row=2, column=2, padx=5)
+        
+        # Filter by percentage range
+        ttk.Label(search_input_frame, text="Percentage:").grid(row=3, column=0, sticky='w', pady=2)
+        range_frame = ttk.Frame(search_input_frame)
+        range_frame.grid(row=3, column=1, sticky='w', padx=5, pady=2)
+        self.filter_low_entry = ttk.Entry(range_frame, width=8)
+        self.filter_low_entry.pack(side='left')
+        ttk.Label(range_frame, text=" to ").pack(side='left')
+        self.filter_high_entry = ttk.Entry(range_frame, width=8)
+        self.filter_high_entry.pack(side='left')
+        for entry in (self.filter_class_combo, self.filter_subject_combo,
+                      self.filter_low_entry, self.filter_high_entry):
+            entry.bind('<Return>', lambda e: self.apply_filters())
+        ttk.Button(search_input_frame, text="Filter", command=self.apply_filters).grid(row=3, column=2, padx=5)
         
         # Reset button
-        ttk.Button(search_input_frame, text="Reset All", command=self.reset_filters).grid(row=3, column=1, pady=10)
+        ttk.Button(search_input_frame, text="Reset All", command=self.reset_filters).grid(row=4, column=1, pady=10)
+        ttk.Button(search_input_frame, text="Export...", command=self.export_results).grid(row=4, column=2, pady=10)
+        self.search_summary_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_input_frame, text="One row per student (summary)",
+                        variable=self.search_summary_var,
+                        command=self.toggle_search_summary).grid(row=4, column=0, sticky='w')
         
         # Results frame
         results_frame = ttk.LabelFrame(search_frame, text="Search Results", padding=10)
         results_frame.pack(fill='both', expand=True, padx=10, pady=5)
         
-        # Treeview for search results
-        self.search_tree = ttk.Treeview(results_frame, columns=('Student', 'Email', 'Class', 'Subject', 'Grade', 'Percentage'), show='headings')
-        self.search_tree.heading('Student', text='Student')
-        self.search_tree.heading('Email', text='Email')
-        self.search_tree.heading('Class', text='Class')
-        self.search_tree.heading('Subject', text='Subject')
-        self.search_tree.heading('Grade', text='Grade')
-        self.search_tree.heading('Percentage', text='Percentage')
-        
-        # Configure column widths
-        self.search_tree.column('Student', width=150)
-        self.search_tree.column('Email', width=180)
-        self.search_tree.column('Class', width=100)
-        self.search_tree.column('Subject', width=120)
-        self.search_tree.column('Grade', width=80)
-        self.search_tree.column('Percentage', width=80)
-        
-        # Scrollbar for search tree
-        search_scrollbar = ttk.Scrollbar(results_frame, orient='vertical', command=self.search_tree.yview)
-        self.search_tree.configure(yscrollcommand=search_scrollbar.set)
-        
-        self.search_tree.pack(side='left', fill='both', expand=True)
-        search_scrollbar.pack(side='right', fill='y')
-        
-        # Load filter options
-        self.load_filter_options()
+        # Virtual table for search results
+        self.search_tree = VirtualTable(results_frame, executor=self.executor, name='search',
+                                        columns=self.SEARCH_COLUMNS)
+        
+        self.search_tree.pack(fill='both', expand=True)
+    
+    def create_analytics_tab(self, analytics_frame):
+        """Create grade analytics tab"""
+        
+        # Report options
+        options_frame = ttk.LabelFrame(analytics_frame, text="Report Options", padding=10)
+        options_frame.pack(fill='x', padx=10, pady=5)
+        
+        ttk.Label(options_frame, text="Group by:").grid(row=0, column=0, sticky='w', pady=2)
+        self.analytics_group_combo = ttk.Combobox(options_frame, width=15, state='readonly',
+                                                  values=list(analytics.GROUPS))
+        self.analytics_group_combo.set('class')
+        self.analytics_group_combo.grid(row=0, column=1, padx=5, pady=2)
+        
+        ttk.Label(options_frame, text="Class:").grid(row=0, column=2, sticky='w', pady=2)
+        self.analytics_class_combo = ttk.Combobox(options_frame, width=15)
+        self.analytics_class_combo.grid(row=0, column=3, padx=5, pady=2)
+        self.register_filter(self.class_combos, self.analytics_class_combo, optional=True)
+        
+        ttk.Label(options_frame, text="Subject:").grid(row=0, column=4, sticky='w', pady=2)
+        self.analytics_subject_combo = ttk.Combobox(options_frame, width=15)
+        self.analytics_subject_combo.grid(row=0, column=5, padx=5, pady=2)
+        self.register_filter(self.subject_combos, self.analytics_subject_combo, optional=True)
+        
+        ttk.Button(options_frame, text="Run Report", command=self.run_analytics).grid(row=0, column=6, padx=5)
+        ttk.Button(options_frame, text="Report Cards...",
+                   command=self.generate_report_cards).grid(row=0, column=7, padx=5)
+        
+        # Overall summary and histogram of percentages
+        summary_frame = ttk.LabelFrame(analytics_frame, text="Distribution", padding=10)
+        summary_frame.pack(fill='x', padx=10, pady=5)
+        self.analytics_summary_label = ttk.Label(summary_frame, text="Run a report to see statistics")
+        self.analytics_summary_label.pack(anchor='w')
+        self.histogram_canvas = tk.Canvas(summary_frame, height=140, bg='white', highlightthickness=0)
+        self.histogram_canvas.pack(fill='x', pady=5)
+        
+        # Grouped statistics
+        results_frame = ttk.LabelFrame(analytics_frame, text="Statistics", padding=10)
+        results_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        self.analytics_tree = VirtualTable(results_frame, executor=self.executor, name='analytics', columns=(
+            (('Group', 200),) + tuple((name, 70) for name in analytics.STAT_COLUMNS)))
+        self.analytics_tree.pack(fill='both', expand=True)
+    
+    def create_leaderboard_tab(self, leaderboard_frame):
+        """Create student leaderboard tab"""
+        
+        options_frame = ttk.Frame(leaderboard_frame, padding=10)
+        options_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(options_frame, text="Class:").pack(side='left')
+        self.leaderboard_class_combo = ttk.Combobox(options_frame, width=20)
+        self.leaderboard_class_combo.pack(side='left', padx=5)
+        self.register_filter(self.class_combos, self.leaderboard_class_combo, optional=True)
+        ttk.Button(options_frame, text="Show", command=self.load_leaderboard).pack(side='left', padx=5)
+        
+        results_frame = ttk.LabelFrame(leaderboard_frame, text="Ranked by Average Percentage", padding=10)
+        results_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        self.leaderboard_tree = VirtualTable(results_frame, executor=self.executor, name='leaderboard', columns=(
+            ('Rank', 60), ('Student', 180), ('Class', 100), ('Subjects', 70),
+            ('Average %', 80), ('Total Marks', 90), ('Last Exam', 90)))
+        self.leaderboard_tree.pack(fill='both', expand=True)
+    
+    def create_diagnostics_tab(self, diagnostics_frame):
+        """Create query timing and slow query tab"""
+        
+        buttons_frame = ttk.Frame(diagnostics_frame, padding=10)
+        buttons_frame.pack(fill='x', padx=10)
+        ttk.Button(buttons_frame, text="Refresh", command=self.load_diagnostics).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Reset", command=self.reset_diagnostics).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Save JSON", command=self.save_diagnostics).pack(side='left', padx=5)
+        ttk.Label(buttons_frame, text=f"Queries over {instrumentation.SLOW_QUERY_MS} ms are "
+                                      "logged with their plan").pack(side='left', padx=15)
+        
+        stats_frame = ttk.LabelFrame(diagnostics_frame, text="Operations", padding=10)
+        stats_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        self.diagnostics_tree = VirtualTable(stats_frame, executor=self.executor, name='diagnostics', columns=(
+            ('Operation', 300), ('Kind', 80), ('Count', 70), ('Total ms', 90), ('Avg ms', 80),
+            ('Max ms', 80), ('Rows', 80)))
+        self.diagnostics_tree.pack(fill='both', expand=True)
+        
+        slow_frame = ttk.LabelFrame(diagnostics_frame, text="Slow Queries", padding=10)
+        slow_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        self.slow_tree = VirtualTable(slow_frame, executor=self.executor, name='slow_queries', columns=(
+            ('#', 40), ('At', 140), ('Operation', 220), ('ms', 70), ('Rows', 70), ('SQL', 400)))
+        self.slow_tree.pack(side='left', fill='both', expand=True)
+        self.slow_tree.bind('<<TableSelect>>', self.on_slow_query_select)
+        self.plan_text = tk.Text(slow_frame, width=60, height=10, wrap='none', font=('Courier', 9))
+        self.plan_text.pack(side='right', fill='both', padx=(10, 0))
+        
+        self.slow_queries = []
+    
+    def load_diagnostics(self):
+        """Show the current counters and slow queries"""
+        self.diagnostics_tree.set_source(ListSource(
+            (stat['operation'], stat['kind'], stat['count'], stat['total_ms'], stat['avg_ms'],
+             stat['max_ms'], stat['rows']) for stat in instrumentation.metrics.stats()))
+        self.slow_queries = instrumentation.metrics.slow_queries()
+        self.slow_tree.set_source(ListSource(
+            (number, query['at'], query['operation'], query['ms'], query['rows'], ' '.join(query['sql'].split()))
+            for number, query in enumerate(self.slow_queries)))
+        self.plan_text.delete('1.0', tk.END)
+    
+    def on_slow_query_select(self, event):
+        """Show the statement and plan of the selected slow query"""
+        selected = self.slow_tree.selected_rows()
+        if not selected:
+            return
+        query = self.slow_queries[selected[0][0]]
+        self.plan_text.delete('1.0', tk.END)
+        self.plan_text.insert('1.0', query['sql'].strip() + "\n\n" + (query['plan'] or "No plan captured"))
+    
+    def reset_diagnostics(self):
+        """Start measuring from zero"""
+        instrumentation.metrics.reset()
+        self.load_diagnostics()
+    
+    def save_diagnostics(self):
+        """Write the counters and slow queries to a JSON file"""
+        path = filedialog.asksaveasfilename(title="Save diagnostics", defaultextension=".json",
+                                            filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        try:
+            with open(path, 'w') as f:
+                f.write(instrumentation.metrics.to_json())
+            
+        except OSError as e:
+            messagebox.showerror("Error", f"Error saving diagnostics: {str(e)}")
     
     # Student operations
     def add_student(self):
@@ -274,32 +596,33 @@ class StudentManagementSystem:
         if not self.validate_student_input():
             return
         
-        try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO students (name, email, class_name, phone)
-                VALUES (%s, %s, %s, %s)
-            ''', (self.name_entry.get(), self.email_entry.get(), 
-                  self.class_entry.get(), self.phone_entry.get()))
-            
-            conn.commit()
-            conn.close()
-            
+        student = self.student_form()
+        source = self.students_tree.source
+        
+        def insert(session):
+            student_id = self.backend.create_student(session, student)[0]
+            return source.fetch_rows(session, [student_id]) if source else []
+        
+        def done(rows):
             messagebox.showinfo("Success", "Student added successfully!")
+            self.data_changed('students')
             self.clear_student_fields()
-            self.load_students()
-            self.load_students_combo()
-            
-        except psycopg2.IntegrityError:
-            messagebox.showerror("Error", "Email already exists!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error adding student: {str(e)}")
+            for key, student in rows:
+                self.students_tree.insert_row(key)
+                self.set_student_choice(student[0], student[1])
+                self.add_class_option(student[3])
+        
+        def failed(e):
+            if isinstance(e, repository.DuplicateError):
+                messagebox.showerror("Error", "Email already exists!")
+            else:
+                self.show_error("Error adding student", e)
+        
+        self.run_backend(insert, done, on_error=failed)
     
     def update_student(self):
         """Update selected student"""
-        selected_item = self.students_tree.selection()
+        selected_item = self.students_tree.selected_rows()
         if not selected_item:
             messagebox.showwarning("Warning", "Please select a student to update")
             return
@@ -307,66 +630,112 @@ class StudentManagementSystem:
         if not self.validate_student_input():
             return
         
-        try:
-            student_id = self.students_tree.item(selected_item[0])['values'][0]
-            
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE students SET name=%s, email=%s, class_name=%s, phone=%s
-                WHERE id=%s
-            ''', (self.name_entry.get(), self.email_entry.get(), 
-                  self.class_entry.get(), self.phone_entry.get(), student_id))
-            
-            conn.commit()
-            conn.close()
-            
+        self.save_student(selected_item[0], self.student_form())
+    
+    def save_student(self, original, student):
+        """Write student over the row read as original, unless someone changed it since"""
+        student_id = original[0]
+        version = original[repository.VERSION_COLUMNS['students']]
+        
+        def update(session):
+            return self.backend.update_student(session, student_id, student, version)
+        
+        def done(student):
             messagebox.showinfo("Success", "Student updated successfully!")
+            self.data_changed('students')
             self.clear_student_fields()
-            self.load_students()
-            self.load_students_combo()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error updating student: {str(e)}")
+            if student:
+                self.students_tree.update_row(student)
+                self.set_student_choice(student[0], student[1])
+                self.add_class_option(student[3])
+        
+        def failed(e):
+            if isinstance(e, repository.ConflictError):
+                self.resolve_conflict('students', original, student, e, self.save_student)
+            else:
+                self.show_error("Error updating student", e)
+        
+        self.run_backend(update, done, on_error=failed)
     
     def delete_student(self):
-        """Delete selected student"""
-        selected_item = self.students_tree.selection()
+        """Delete the selected students and their grades in one transaction"""
+        selected_item = self.students_tree.selected_rows()
         if not selected_item:
             messagebox.showwarning("Warning", "Please select a student to delete")
             return
         
-        if messagebox.askyesno("Confirm", "Are you sure you want to delete this student?"):
-            try:
-                student_id = self.students_tree.item(selected_item[0])['values'][0]
-                
-                conn = connect()
-                cursor = conn.cursor()
-                
-                cursor.execute('DELETE FROM students WHERE id=%s', (student_id,))
-                
-                conn.commit()
-                conn.close()
-                
-                messagebox.showinfo("Success", "Student deleted successfully!")
+        if len(selected_item) == 1:
+            prompt = "Are you sure you want to delete this student?"
+        else:
+            prompt = f"Are you sure you want to delete these {len(selected_item)} students?"
+        if messagebox.askyesno("Confirm", prompt):
+            selected_ids = [values[0] for values in selected_item]
+            versions = [values[repository.VERSION_COLUMNS['students']] for values in selected_item]
+            
+            def delete(session):
+                return self.backend.delete_students(session, selected_ids, versions)
+            
+            def done(result):
+                student_ids, grade_ids = result
+                if len(student_ids) == 1:
+                    messagebox.showinfo("Success", "Student deleted successfully!")
+                else:
+                    messagebox.showinfo("Success", f"{len(student_ids)} students deleted successfully!")
+                self.data_changed('students', 'grades')
                 self.clear_student_fields()
-                self.load_students()
-                self.load_students_combo()
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"Error deleting student: {str(e)}")
+                self.students_tree.remove_rows(student_ids)
+                if self.tab_built("Grades"):
+                    self.grades_tree.remove_rows(grade_ids)
+                self.set_student_choices({deleted_id: None for deleted_id in student_ids})
+            
+            def failed(e):
+                if isinstance(e, repository.ConflictError):
+                    messagebox.showwarning("Conflict", str(e))
+                    self.data_changed('students')
+                    self.students_tree.refresh()
+                else:
+                    self.show_error("Error deleting student", e)
+            
+            self.run_backend(delete, done, on_error=failed)
+    
+    def change_student_class(self):
+        """Move every selected student to another class in one statement"""
+        selected_item = self.students_tree.selected_rows()
+        if not selected_item:
+            messagebox.showwarning("Warning", "Please select the students to move")
+            return
+        
+        class_name = simpledialog.askstring(
+            "Change Class", f"New class for {len(selected_item)} selected student(s):", parent=self.root)
+        if class_name is None:
+            return
+        student_ids = [values[0] for values in selected_item]
+        try:
+            repository.class_params(student_ids, class_name)
+        except repository.ValidationError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        def done(students):
+            messagebox.showinfo("Success", f"Moved {len(students)} students to {class_name}")
+            self.data_changed('students')
+            self.students_tree.update_rows(students)
+            self.add_class_option(class_name)
+        
+        self.run_backend(lambda session: self.backend.change_class(session, student_ids, class_name),
+                         done, "Error changing class")
+    
+    def student_form(self):
+        """The student form's values as a repository record"""
+        return {'name': self.name_entry.get(), 'email': self.email_entry.get(),
+                'class_name': self.class_entry.get(), 'phone': self.phone_entry.get()}
     
     def validate_student_input(self):
         """Validate student input fields"""
-        if not self.name_entry.get().strip():
-            messagebox.showerror("Error", "Name is required")
-            return False
-        if not self.email_entry.get().strip():
-            messagebox.showerror("Error", "Email is required")
-            return False
-        if not self.class_entry.get().strip():
-            messagebox.showerror("Error", "Class is required")
+        error = student_error(self.name_entry.get(), self.email_entry.get(),
+                              self.class_entry.get(), self.phone_entry.get())
+        if error:
+            messagebox.showerror("Error", error)
             return False
         return True
     
@@ -379,9 +748,9 @@ class StudentManagementSystem:
     
     def on_student_select(self, event):
         """Handle student selection"""
-        selected_item = self.students_tree.selection()
+        selected_item = self.students_tree.selected_rows()
         if selected_item:
-            values = self.students_tree.item(selected_item[0])['values']
+            values = selected_item[0]
             self.name_entry.delete(0, tk.END)
             self.name_entry.insert(0, values[1])
             self.email_entry.delete(0, tk.END)
@@ -392,56 +761,44 @@ class StudentManagementSystem:
             self.phone_entry.insert(0, values[4] if values[4] else "")
     
     def load_students(self):
-        """Load students into the treeview"""
-        for item in self.students_tree.get_children():
-            self.students_tree.delete(item)
-        
+        """Load students into the virtual table"""
         try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id, name, email, class_name, phone FROM students ORDER BY name')
-            students = cursor.fetchall()
-            
-            for student in students:
-                self.students_tree.insert('', 'end', values=student)
-            
-            conn.close()
+            self.students_tree.set_source(self.listing_source('students'))
             
         except Exception as e:
             messagebox.showerror("Error", f"Error loading students: {str(e)}")
     
+    def reload_students(self):
+        """Explicit full reload of the students table and combobox"""
+        self.load_students()
+        self.load_students_combo()
+    
     # Grade operations
     def add_grade(self):
         """Add a new grade"""
         if not self.validate_grade_input():
             return
         
-        try:
-            student_id = self.student_combo.get().split(' - ')[0]
-            
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO grades (student_id, subject, grade, max_marks)
-                VALUES (%s, %s, %s, %s)
-            ''', (student_id, self.subject_entry.get(), 
-                  float(self.grade_entry.get()), float(self.max_marks_entry.get())))
-            
-            conn.commit()
-            conn.close()
-            
+        grade = self.grade_form()
+        source = self.grades_tree.source
+        
+        def insert(session):
+            grade_id = self.backend.create_grade(session, grade)
+            return source.fetch_rows(session, [grade_id]) if source else []
+        
+        def done(rows):
             messagebox.showinfo("Success", "Grade added successfully!")
+            self.data_changed('grades')
             self.clear_grade_fields()
-            self.load_grades()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error adding grade: {str(e)}")
+            self.add_subject_option(grade['subject'])
+            for key, values in rows:
+                self.grades_tree.insert_row(key)
+        
+        self.run_backend(insert, done, "Error adding grade")
     
     def update_grade(self):
         """Update selected grade"""
-        selected_item = self.grades_tree.selection()
+        selected_item = self.grades_tree.selected_rows()
         if not selected_item:
             messagebox.showwarning("Warning", "Please select a grade to update")
             return
@@ -449,77 +806,347 @@ class StudentManagementSystem:
         if not self.validate_grade_input():
             return
         
-        try:
-            grade_id = self.grades_tree.item(selected_item[0])['values'][0]
-            student_id = self.student_combo.get().split(' - ')[0]
-            
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE grades SET student_id=%s, subject=%s, grade=%s, max_marks=%s
-                WHERE id=%s
-            ''', (student_id, self.subject_entry.get(), 
-                  float(self.grade_entry.get()), float(self.max_marks_entry.get()), grade_id))
-            
-            conn.commit()
-            conn.close()
-            
+        self.save_grade(selected_item[0], self.grade_form())
+    
+    def save_grade(self, original, grade):
+        """Write grade over the row read as original, unless someone changed it since"""
+        grade_id = original[0]
+        version = original[repository.VERSION_COLUMNS['grades']]
+        source = self.grades_tree.source
+        
+        def update(session):
+            updated = self.backend.update_grade(session, grade_id, grade, version)
+            return source.fetch_rows(session, updated) if source and updated else []
+        
+        def done(rows):
             messagebox.showinfo("Success", "Grade updated successfully!")
+            self.data_changed('grades')
             self.clear_grade_fields()
-            self.load_grades()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error updating grade: {str(e)}")
+            self.add_subject_option(grade['subject'])
+            for key, values in rows:
+                self.grades_tree.update_row(values)
+        
+        def failed(e):
+            if isinstance(e, repository.ConflictError):
+                self.resolve_conflict('grades', original, grade, e, self.save_grade)
+            else:
+                self.show_error("Error updating grade", e)
+        
+        self.run_backend(update, done, on_error=failed)
     
     def delete_grade(self):
-        """Delete selected grade"""
-        selected_item = self.grades_tree.selection()
+        """Delete the selected grades in one statement"""
+        selected_item = self.grades_tree.selected_rows()
         if not selected_item:
             messagebox.showwarning("Warning", "Please select a grade to delete")
             return
         
-        if messagebox.askyesno("Confirm", "Are you sure you want to delete this grade?"):
-            try:
-                grade_id = self.grades_tree.item(selected_item[0])['values'][0]
+        if len(selected_item) == 1:
+            prompt = "Are you sure you want to delete this grade?"
+        else:
+            prompt = f"Are you sure you want to delete these {len(selected_item)} grades?"
+        if messagebox.askyesno("Confirm", prompt):
+            selected_ids = [values[0] for values in selected_item]
+            versions = [values[repository.VERSION_COLUMNS['grades']] for values in selected_item]
+            
+            def delete(session):
+                return self.backend.delete_grades(session, selected_ids, versions)
+            
+            def done(grade_ids):
+                if len(grade_ids) == 1:
+                    messagebox.showinfo("Success", "Grade deleted successfully!")
+                else:
+                    messagebox.showinfo("Success", f"{len(grade_ids)} grades deleted successfully!")
+                self.data_changed('grades')
+                self.clear_grade_fields()
+                self.grades_tree.remove_rows(grade_ids)
+            
+            def failed(e):
+                if isinstance(e, repository.ConflictError):
+                    messagebox.showwarning("Conflict", str(e))
+                    self.data_changed('grades')
+                    self.grades_tree.refresh()
+                else:
+                    self.show_error("Error deleting grade", e)
+            
+            self.run_backend(delete, done, on_error=failed)
+    
+    # Change history
+    def show_history(self, table):
+        """Show every recorded change to the selected student or grade, newest first"""
+        tree = self.students_tree if table == 'students' else self.grades_tree
+        selected_item = tree.selected_rows()
+        if not selected_item:
+            messagebox.showwarning("Warning", f"Please select a {table[:-1]} to see its history")
+            return
+        row_id = selected_item[0][0]
+        record_history = api_client.record_history if self.api_url else audit.record_history
+        
+        def done(rows):
+            dialog = tk.Toplevel(self.root)
+            dialog.title(f"History of {table[:-1]} {row_id}")
+            dialog.transient(self.root)
+            frame = ttk.Frame(dialog, padding=10)
+            frame.pack(fill='both', expand=True)
+            
+            history_tree = ttk.Treeview(frame, columns=('When', 'Action', 'By', 'Changes'),
+                                        show='headings', height=15)
+            for column, width in (('When', 140), ('Action', 60), ('By', 100), ('Changes', 500)):
+                history_tree.heading(column, text=column)
+                history_tree.column(column, width=width, stretch=column == 'Changes')
+            for changed_at, action, actor, old_row, new_row in rows:
+                history_tree.insert('', 'end', values=(changed_at.strftime('%Y-%m-%d %H:%M:%S'), action, actor,
+                                                       audit.describe(action, old_row, new_row)))
+            scrollbar = ttk.Scrollbar(frame, orient='vertical', command=history_tree.yview)
+            history_tree.configure(yscrollcommand=scrollbar.set)
+            history_tree.pack(side='left', fill='both', expand=True)
+            scrollbar.pack(side='right', fill='y')
+            if not rows:
+                history_tree.insert('', 'end', values=('', '', '', "No changes recorded"))
+        
+        self.run_query(lambda conn: record_history(conn, table, row_id), done, "Error loading history")
+    
+    # Duplicate students
+    def find_duplicates(self):
+        """Suggest students entered more than once and merge the ones picked"""
+        
+        def done(suggestions):
+            if not suggestions:
+                messagebox.showinfo("Find Duplicates", "No likely duplicate students found")
+                return
+            dialog = tk.Toplevel(self.root)
+            dialog.title(f"Possible Duplicates ({len(suggestions)})")
+            dialog.transient(self.root)
+            frame = ttk.Frame(dialog, padding=10)
+            frame.pack(fill='both', expand=True)
+            
+            list_frame = ttk.Frame(frame)
+            list_frame.pack(fill='both', expand=True)
+            duplicates_tree = ttk.Treeview(list_frame, columns=('Score', 'Keep', 'Merge'),
+                                           show='headings', height=15)
+            for column, width in (('Score', 60), ('Keep', 350), ('Merge', 450)):
+                duplicates_tree.heading(column, text=column)
+                duplicates_tree.column(column, width=width, stretch=column != 'Score')
+            by_item = {}
+            for suggestion in suggestions:
+                item = duplicates_tree.insert('', 'end', values=(
+                    f"{suggestion.score:.2f}", suggestion.keep.label(),
+                    '; '.join(student.label() for student in suggestion.duplicates)))
+                by_item[item] = suggestion
+            scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=duplicates_tree.yview)
+            duplicates_tree.configure(yscrollcommand=scrollbar.set)
+            duplicates_tree.pack(side='left', fill='both', expand=True)
+            scrollbar.pack(side='right', fill='y')
+            
+            def merge():
+                items = duplicates_tree.selection()
+                if not items:
+                    messagebox.showwarning("Warning", "Please select the suggestions to merge", parent=dialog)
+                    return
+                chosen = [by_item[item] for item in items]
+                count = sum(len(suggestion.duplicates) for suggestion in chosen)
+                if not messagebox.askyesno(
+                        "Confirm", f"Merge {count} student(s) into the ones kept, moving their grades?",
+                        parent=dialog):
+                    return
                 
-                conn = connect()
-                cursor = conn.cursor()
+                # One transaction: a conflict on any suggestion merges none
+                def work(conn):
+                    return [suggestion.merge(conn) for suggestion in chosen]
                 
-                cursor.execute('DELETE FROM grades WHERE id=%s', (grade_id,))
+                def merged(results):
+                    duplicates_tree.delete(*items)
+                    deleted = [student_id for _, student_ids in results for student_id in student_ids]
+                    moved = sum(len(grade_ids) for grade_ids, _ in results)
+                    self.data_changed('students', 'grades')
+                    self.students_tree.refresh()
+                    if self.tab_built("Grades"):
+                        self.grades_tree.refresh()
+                    self.set_student_choices({student_id: None for student_id in deleted})
+                    messagebox.showinfo("Success", f"{len(deleted)} student(s) merged, {moved} grade(s) moved",
+                                        parent=dialog)
                 
-                conn.commit()
-                conn.close()
+                def failed(e):
+                    if isinstance(e, repository.ConflictError):
+                        messagebox.showwarning("Conflict", f"{e}. Nothing was merged; find duplicates again "
+                                               "to see the current records.", parent=dialog)
+                    else:
+                        self.show_error("Error merging students", e)
                 
-                messagebox.showinfo("Success", "Grade deleted successfully!")
-                self.clear_grade_fields()
-                self.load_grades()
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"Error deleting grade: {str(e)}")
+                self.run_query(work, merged, on_error=failed)
+            
+            buttons_frame = ttk.Frame(frame)
+            buttons_frame.pack(pady=(10, 0))
+            ttk.Button(buttons_frame, text="Merge Selected", command=merge).pack(side='left', padx=5)
+            ttk.Button(buttons_frame, text="Close", command=dialog.destroy).pack(side='left', padx=5)
+        
+        self.run_query(dedup.find_duplicates, done, "Error finding duplicates")
+    
+    # Edit conflicts
+    def resolve_conflict(self, table, original, mine, error, retry):
+        """Someone else changed or deleted the row being saved; let the user choose
+        
+        original is the row as it was loaded, mine the edited record and
+        error.current the row as it is now. retry(row, record) saves record
+        over row's version.
+        """
+        tree = self.students_tree if table == 'students' else self.grades_tree
+        current = error.current
+        if current is None:
+            messagebox.showwarning("Conflict", str(error))
+            if table == 'students':
+                self.data_changed('students', 'grades')
+                self.set_student_choices({original[0]: None})
+                if self.tab_built("Grades"):
+                    self.grades_tree.refresh()
+            else:
+                self.data_changed('grades')
+            tree.remove_rows([original[0]])
+            return
+        
+        base = repository.listing_record(table, original)
+        theirs = repository.listing_record(table, current)
+        mine = repository.record_params(table, mine)
+        # Three-way merge: take whichever side changed a field; both changing
+        # it differently is a clash only the user can settle
+        merged, clashes = {}, set()
+        for field in repository.RECORD_COLUMNS[table]:
+            if mine[field] in (base[field], theirs[field]):
+                merged[field] = theirs[field]
+            else:
+                merged[field] = mine[field]
+                if theirs[field] != base[field]:
+                    clashes.add(field)
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Edit Conflict")
+        dialog.transient(self.root)
+        frame = ttk.Frame(dialog, padding=10)
+        frame.pack(fill='both', expand=True)
+        
+        ttk.Label(frame, text=str(error)).grid(row=0, column=0, columnspan=4, sticky='w', pady=(0, 5))
+        for column, heading in enumerate(("Field", "When loaded", "Yours", "Theirs")):
+            ttk.Label(frame, text=heading, font=('TkDefaultFont', 9, 'bold')).grid(
+                row=1, column=column, sticky='w', padx=5)
+        for row, field in enumerate(repository.RECORD_COLUMNS[table], 2):
+            color = 'red' if field in clashes else ''
+            ttk.Label(frame, text=field.replace('_', ' ').title(), foreground=color).grid(
+                row=row, column=0, sticky='w', padx=5)
+            for column, record in enumerate((base, mine, theirs), 1):
+                ttk.Label(frame, text=self.conflict_text(field, record[field]), foreground=color).grid(
+                    row=row, column=column, sticky='w', padx=5)
+        note = ("Fields in red were changed by both of you" if clashes
+                else "Merge keeps your changes and theirs")
+        ttk.Label(frame, text=note).grid(row=len(merged) + 2, column=0, columnspan=4, sticky='w', pady=5)
+        
+        def save(record):
+            dialog.destroy()
+            retry(current, record)
+        
+        def use_theirs():
+            dialog.destroy()
+            self.data_changed(table)
+            tree.update_row(current)
+            if table == 'students':
+                self.set_student_choice(current[0], current[1])
+                self.on_student_select(None)
+            else:
+                self.on_grade_select(None)
+        
+        buttons_frame = ttk.Frame(frame)
+        buttons_frame.grid(row=len(merged) + 3, column=0, columnspan=4, pady=5)
+        ttk.Button(buttons_frame, text="Keep Mine", command=lambda: save(mine)).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Merge", command=lambda: save(merged),
+                   state='disabled' if clashes else 'normal').pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Use Theirs", command=use_theirs).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Cancel", command=dialog.destroy).pack(side='left', padx=5)
+        dialog.grab_set()
+    
+    def conflict_text(self, field, value):
+        """How the conflict dialog shows a field's value"""
+        if field == 'student_id' and value in self.student_index:
+            return self.student_index.label(value)
+        return '' if value is None else str(value)
+    
+    def open_curve_dialog(self):
+        """Curve a subject's grades, or just the selected ones, in one statement"""
+        selected_item = self.grades_tree.selected_rows()
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Curve Grades")
+        dialog.transient(self.root)
+        frame = ttk.Frame(dialog, padding=10)
+        frame.pack(fill='both', expand=True)
+        
+        ttk.Label(frame, text="Subject:").grid(row=0, column=0, sticky='w', pady=2)
+        subject_combo = ttk.Combobox(frame, width=25, values=self.subject_options)
+        subject_combo.set(selected_item[0][2] if selected_item else self.subject_entry.get())
+        subject_combo.grid(row=0, column=1, padx=5, pady=2)
+        
+        ttk.Label(frame, text="Multiply by:").grid(row=1, column=0, sticky='w', pady=2)
+        factor_entry = ttk.Entry(frame, width=10)
+        factor_entry.insert(0, "1")
+        factor_entry.grid(row=1, column=1, sticky='w', padx=5, pady=2)
+        
+        ttk.Label(frame, text="Then add points:").grid(row=2, column=0, sticky='w', pady=2)
+        points_entry = ttk.Entry(frame, width=10)
+        points_entry.insert(0, "0")
+        points_entry.grid(row=2, column=1, sticky='w', padx=5, pady=2)
+        
+        only_selected = tk.BooleanVar(value=len(selected_item) > 1)
+        ttk.Checkbutton(frame, text=f"Only the {len(selected_item)} selected grades",
+                        variable=only_selected,
+                        state='normal' if selected_item else 'disabled').grid(
+            row=3, column=0, columnspan=2, sticky='w', pady=2)
+        ttk.Label(frame, text="Curved grades stay between 0 and their max marks").grid(
+            row=4, column=0, columnspan=2, sticky='w', pady=5)
+        
+        def apply():
+            if only_selected.get():
+                subject, grade_ids = None, [values[0] for values in selected_item]
+            else:
+                subject, grade_ids = subject_combo.get().strip(), None
+            points, factor = points_entry.get(), factor_entry.get()
+            try:
+                repository.curve_params(subject, grade_ids, points, factor)
+            except repository.ValidationError as e:
+                messagebox.showerror("Error", str(e), parent=dialog)
+                return
+            dialog.destroy()
+            
+            def done(curved_ids):
+                messagebox.showinfo("Success", f"Curved {len(curved_ids)} grades")
+                self.data_changed('grades')
+                self.grades_tree.refresh()
+            
+            self.run_backend(lambda session: self.backend.curve_grades(
+                session, subject, grade_ids, float(points), float(factor)), done, "Error curving grades")
+        
+        buttons_frame = ttk.Frame(frame)
+        buttons_frame.grid(row=5, column=0, columnspan=2, pady=5)
+        ttk.Button(buttons_frame, text="Apply", command=apply).pack(side='left', padx=5)
+        ttk.Button(buttons_frame, text="Cancel", command=dialog.destroy).pack(side='left', padx=5)
+        dialog.grab_set()
+    
+    def grade_form(self):
+        """The grade form's values as a repository record"""
+        return {'student_id': self.student_picker.student_id(),
+                'subject': self.subject_entry.get(),
+                'grade': float(self.grade_entry.get()),
+                'max_marks': float(self.max_marks_entry.get())}
     
     def validate_grade_input(self):
         """Validate grade input fields"""
-        if not self.student_combo.get():
-            messagebox.showerror("Error", "Please select a student")
-            return False
-        if not self.subject_entry.get().strip():
-            messagebox.showerror("Error", "Subject is required")
-            return False
-        try:
-            grade = float(self.grade_entry.get())
-            max_marks = float(self.max_marks_entry.get())
-            if grade < 0 or max_marks <= 0:
-                messagebox.showerror("Error", "Grade and max marks must be positive numbers")
-                return False
-        except ValueError:
-            messagebox.showerror("Error", "Grade and max marks must be valid numbers")
+        error = grade_error(self.student_picker.student_id(), self.subject_entry.get(),
+                            self.grade_entry.get(), self.max_marks_entry.get())
+        if error:
+            messagebox.showerror("Error", error)
             return False
         return True
     
     def clear_grade_fields(self):
         """Clear all grade input fields"""
-        self.student_combo.set('')
+        self.student_picker.set('')
         self.subject_entry.delete(0, tk.END)
         self.grade_entry.delete(0, tk.END)
         self.max_marks_entry.delete(0, tk.END)
@@ -527,14 +1154,11 @@ class StudentManagementSystem:
     
     def on_grade_select(self, event):
         """Handle grade selection"""
-        selected_item = self.grades_tree.selection()
+        selected_item = self.grades_tree.selected_rows()
         if selected_item:
-            values = self.grades_tree.item(selected_item[0])['values']
-            # Find and set the student in combo
-            for i, value in enumerate(self.student_combo['values']):
-                if value.startswith(str(values[0])):
-                    self.student_combo.current(i)
-                    break
+            values = selected_item[0]
+            # Grade rows end with the student id
+            self.student_picker.select(values[6])
             self.subject_entry.delete(0, tk.END)
             self.subject_entry.insert(0, values[2])
             self.grade_entry.delete(0, tk.END)
@@ -543,200 +1167,340 @@ class StudentManagementSystem:
             self.max_marks_entry.insert(0, values[4])
     
     def load_students_combo(self):
-        """Load students into the combobox"""
-        try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id, name FROM students ORDER BY name')
-            students = cursor.fetchall()
-            
-            student_list = [f"{student[0]} - {student[1]}" for student in students]
-            self.student_combo['values'] = student_list
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error loading students: {str(e)}")
+        """Index every student for the grade form's picker"""
+        if not self.tab_built("Grades"):
+            # Loaded when the Grades tab is first shown
+            return
+        def build(session):
+            return StudentIndex(self.backend.student_choices(session))
+        
+        def done(index):
+            self.student_index = self.student_picker.index = index
+        
+        self.run_backend(build, done, "Error loading students", channel='students-combo')
+    
+    def set_student_choice(self, student_id, name):
+        """Add, rename or (with name None) remove one student in the picker"""
+        self.set_student_choices({student_id: name})
+    
+    def set_student_choices(self, names):
+        """Apply several {student_id: name or None} changes to the picker"""
+        if not self.tab_built("Grades"):
+            # load_students_combo() reads them all when the tab is built
+            return
+        for student_id, name in names.items():
+            self.student_index.set(student_id, name)
+    
+    def register_filter(self, combos, combo, optional=False):
+        """Add a class or subject filter combobox, filled with the options known so far"""
+        combos.append(combo)
+        if optional:
+            self.optional_combos.add(combo)
+        self.fill_filter(combo, self.class_options if combos is self.class_combos else self.subject_options)
+    
+    def fill_filter(self, combo, values):
+        combo['values'] = ([''] if combo in self.optional_combos else []) + values
+    
+    def add_class_option(self, class_name):
+        """Offer a new class in every class filter"""
+        if class_name and class_name not in self.class_options:
+            bisect.insort(self.class_options, class_name)
+        for combo in self.class_combos:
+            self.add_filter_option(combo, class_name)
+    
+    def add_subject_option(self, subject):
+        """Offer a new subject in every subject filter"""
+        if subject and subject not in self.subject_options:
+            bisect.insort(self.subject_options, subject)
+        for combo in self.subject_combos:
+            self.add_filter_option(combo, subject)
+    
+    def add_filter_option(self, combo, value):
+        """Insert a new value into a filter combobox, keeping it sorted"""
+        values = list(combo['values'])
+        if value and value not in values:
+            bisect.insort(values, value)
+            combo['values'] = values
+    
+    def listing_source(self, table):
+        """Source for the students or grades table, from the API, the mirror or the database"""
+        if self.api_url:
+            return api_client.ApiSource(table)
+        if self.mirror:
+            return local_mirror.MirrorSource(self.mirror, table)
+        columns, from_clause, order_by, id_column = repository.LISTINGS[table]
+        tables = ('students',) if table == 'students' else ('grades', 'students')
+        return QuerySource(columns, from_clause, order_by=order_by, id_column=id_column,
+                           tables=tables, sort_keys=repository.LISTING_SORT_KEYS[table], name=table)
+    
+    def load_grades_tab(self):
+        """Load the grades list and the students offered in the grade form"""
+        self.load_grades()
+        self.load_students_combo()
+    
+    def load_leaderboard_tab(self):
+        """Load the leaderboard and its class filter"""
+        self.load_leaderboard()
+        self.load_filter_options()
     
     def load_grades(self):
-        """Load grades into the treeview"""
-        for item in self.grades_tree.get_children():
-            self.grades_tree.delete(item)
-        
+        """Load grades into the virtual table"""
         try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT g.id, s.name, g.subject, g.grade, g.max_marks,
-                       ROUND((g.grade / g.max_marks) * 100, 2) as percentage
-                FROM grades g
-                JOIN students s ON g.student_id = s.id
-                ORDER BY s.name, g.subject
-            ''')
-            grades = cursor.fetchall()
-            
-            for grade in grades:
-                self.grades_tree.insert('', 'end', values=grade)
-            
-            conn.close()
+            self.grades_tree.set_source(self.listing_source('grades'))
             
         except Exception as e:
             messagebox.showerror("Error", f"Error loading grades: {str(e)}")
     
-    # Search and filter operations
-    def search_by_name(self):
-        """Search students by name"""
-        search_term = self.search_name_entry.get().strip()
-        if not search_term:
-            messagebox.showwarning("Warning", "Please enter a name to search")
+    # Bulk import
+    def import_file(self, kind):
+        """Bulk-load students or grades from a CSV/XLSX file"""
+        path = filedialog.askopenfilename(
+            title=f"Import {kind}",
+            filetypes=[("CSV files", "*.csv"), ("Excel files", "*.xlsx"), ("All files", "*.*")])
+        if not path:
             return
         
-        for item in self.search_tree.get_children():
-            self.search_tree.delete(item)
+        def done(result):
+            messagebox.showinfo("Import Complete", result.summary())
+            self.data_changed(kind)
+            if kind == 'students':
+                self.reload_students()
+            else:
+                self.load_grades()
+            self.load_filter_options()
         
-        try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT s.name, s.email, s.class_name, g.subject, g.grade,
-                       ROUND((g.grade / g.max_marks) * 100, 2) as percentage
-                FROM students s
-                LEFT JOIN grades g ON s.id = g.student_id
-                WHERE s.name ILIKE %s
-                ORDER BY s.name, g.subject
-            ''', (f'%{search_term}%',))
-            
-            results = cursor.fetchall()
-            
-            for result in results:
-                self.search_tree.insert('', 'end', values=result)
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error searching: {str(e)}")
+        self.run_query(lambda conn: IMPORTERS[kind](conn, path), done, f"Error importing {kind}")
+    
+    # Search and filter operations
+    def current_filter(self):
+        """The search tab's criteria as a SearchFilter; ValueError for a bad percentage"""
+        bounds = []
+        for entry in (self.filter_low_entry, self.filter_high_entry):
+            text = entry.get().strip()
+            try:
+                bounds.append(float(text) if text else None)
+            except ValueError:
+                raise ValueError(f"Percentage must be a number: {text}")
+        return live_search.SearchFilter(
+            name=self.search_name_entry.get().strip(), class_name=self.filter_class_combo.get(),
+            subject=self.filter_subject_combo.get(), low=bounds[0], high=bounds[1],
+            summary=self.search_summary_var.get())
     
-    def filter_by_class(self):
-        """Filter students by class"""
-        class_name = self.filter_class_combo.get()
-        if not class_name:
-            messagebox.showwarning("Warning", "Please select a class to filter")
+    def apply_filters(self):
+        """Show the rows matching every criterion of the search tab"""
+        try:
+            search_filter = self.current_filter()
+        except ValueError as e:
+            messagebox.showwarning("Warning", str(e))
             return
-        
-        for item in self.search_tree.get_children():
-            self.search_tree.delete(item)
-        
+        self.run_search(search_filter)
+    
+    def on_search_key(self, event):
+        """Search as the user types, once typing pauses"""
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(live_search.DEBOUNCE_MS, self.live_search)
+    
+    def live_search(self):
+        """Run the debounced search for the current criteria"""
+        self.search_after_id = None
         try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT s.name, s.email, s.class_name, g.subject, g.grade,
-                       ROUND((g.grade / g.max_marks) * 100, 2) as percentage
-                FROM students s
-                LEFT JOIN grades g ON s.id = g.student_id
-                WHERE s.class_name = %s
-                ORDER BY s.name, g.subject
-            ''', (class_name,))
-            
-            results = cursor.fetchall()
-            
-            for result in results:
-                self.search_tree.insert('', 'end', values=result)
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error filtering: {str(e)}")
+            search_filter = self.current_filter()
+        except ValueError:
+            return
+        self.run_search(search_filter)
     
-    def filter_by_subject(self):
-        """Filter grades by subject"""
-        subject = self.filter_subject_combo.get()
-        if not subject:
-            messagebox.showwarning("Warning", "Please select a subject to filter")
+    def run_search(self, search_filter):
+        """Show the rows search_filter matches
+        
+        A filter covered by an earlier complete result (a longer name, an added
+        class or subject, a narrower range) is answered in memory. Otherwise
+        one query compiled from every criterion replaces (and cancels) any
+        search still in flight; results too large to keep are paged instead.
+        """
+        self.executor.cancel('name-search')
+        source = self.search_source(*search_filter.sql())
+        sql, params = source.query()
+        
+        rows = self.search_cache.get(search_filter)
+        if rows is not None:
+            self.search_tree.set_source(ListSource(rows, (sql, params)))
             return
         
-        for item in self.search_tree.get_children():
-            self.search_tree.delete(item)
+        def fetch(conn):
+            cursor = queries.execute(conn.cursor(), sql + ' LIMIT %s', params + (live_search.RESULT_LIMIT + 1,),
+                                     f'{source.name}.results')
+            return RowStore.from_cursor(cursor)
         
-        try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT s.name, s.email, s.class_name, g.subject, g.grade,
-                       ROUND((g.grade / g.max_marks) * 100, 2) as percentage
-                FROM students s
-                JOIN grades g ON s.id = g.student_id
-                WHERE g.subject = %s
-                ORDER BY s.name
-            ''', (subject,))
-            
-            results = cursor.fetchall()
-            
-            for result in results:
-                self.search_tree.insert('', 'end', values=result)
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error filtering: {str(e)}")
+        def done(rows):
+            if len(rows) > live_search.RESULT_LIMIT:
+                self.search_tree.set_source(source)
+            else:
+                self.search_cache.put(search_filter, rows)
+                self.search_tree.set_source(ListSource(rows, (sql, params)))
+        
+        self.run_query(fetch, done, "Error searching", channel='name-search')
     
     def reset_filters(self):
         """Reset all filters and show all data"""
         self.search_name_entry.delete(0, tk.END)
         self.filter_class_combo.set('')
         self.filter_subject_combo.set('')
+        self.filter_low_entry.delete(0, tk.END)
+        self.filter_high_entry.delete(0, tk.END)
+        self.run_search(self.current_filter())
+    
+    def search_source(self, where=None, params=(), join='LEFT JOIN'):
+        """Students joined with their grades, as shown in the search table
+        
+        In summary mode each student is one row read from student_summary,
+        and join is ignored.
+        """
+        if self.search_summary_var.get():
+            name, (columns, from_clause, order_by, sort_keys) = 'search_summary', queries.SEARCH_SUMMARY
+        else:
+            name, (columns, from_clause, order_by, sort_keys) = 'search', queries.SEARCH
+            from_clause = from_clause.format(join=join)
+        return QuerySource(columns, from_clause, order_by=order_by, where=where, params=params,
+                           tables=queries.SEARCH_TABLES, sort_keys=sort_keys, name=name)
+    
+    def toggle_search_summary(self):
+        """Switch the search table between grade rows and per-student summaries"""
+        self.executor.cancel('name-search')
+        self.search_cache.clear()
+        if self.search_summary_var.get():
+            self.search_tree.set_columns(self.SUMMARY_COLUMNS)
+        else:
+            self.search_tree.set_columns(self.SEARCH_COLUMNS)
+        
+        self.live_search()
+    
+    def export_results(self):
+        """Stream the current search results to a CSV, JSON Lines or Parquet file"""
+        source = self.search_tree.source
+        if source is None:
+            messagebox.showwarning("Warning", "Run a search or filter first")
+            return
         
-        for item in self.search_tree.get_children():
-            self.search_tree.delete(item)
-        
-        # Show all students and grades
+        path = filedialog.asksaveasfilename(
+            title="Export results", defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("Parquet", "*.parquet")])
+        if not path:
+            return
         try:
-            conn = connect()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT s.name, s.email, s.class_name, g.subject, g.grade,
-                       ROUND((g.grade / g.max_marks) * 100, 2) as percentage
-                FROM students s
-                LEFT JOIN grades g ON s.id = g.student_id
-                ORDER BY s.name, g.subject
-            ''')
-            
-            results = cursor.fetchall()
-            
-            for result in results:
-                self.search_tree.insert('', 'end', values=result)
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error loading data: {str(e)}")
+            format_for(path)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        query = source.query()
+        if query is None:
+            messagebox.showwarning("Warning", "These results cannot be exported")
+            return
+        sql, params = query
+        
+        def done(count):
+            messagebox.showinfo("Export Complete", f"Exported {count} rows to {path}")
+        
+        self.run_query(lambda conn: export_query(conn, sql, params, path), done,
+                       "Error exporting results")
+    
+    def load_leaderboard(self):
+        """Rank students, optionally within one class, from student_summary"""
+        class_name = self.leaderboard_class_combo.get().strip()
+        condition, params = ('WHERE s.class_name = %s', (class_name,)) if class_name else ('', ())
+        # Rank over the whole (filtered) summary before paging, so every page
+        # shows absolute ranks
+        self.leaderboard_tree.set_source(QuerySource(
+            'rank, name, class_name, subject_count, average_percentage, total_marks, last_exam_date',
+            f'''(SELECT s.id, s.name, s.class_name, ss.subject_count, ss.average_percentage,
+                       ss.total_marks, ss.last_exam_date,
+                       RANK() OVER (ORDER BY ss.average_percentage DESC NULLS LAST) AS rank
+                FROM student_summary ss JOIN students s ON s.id = ss.student_id
+                {condition}) ranked''',
+            order_by=('rank', 'id'), params=params, tables=('students', 'grades'), name='leaderboard'))
+    
+    def run_analytics(self):
+        """Compute grouped statistics and the percentage distribution"""
+        group_by = self.analytics_group_combo.get()
+        class_name = self.analytics_class_combo.get().strip() or None
+        subject = self.analytics_subject_combo.get().strip() or None
+        
+        def done(result):
+            rows, summary = result
+            self.analytics_tree.set_source(ListSource(rows))
+            self.show_distribution(summary)
+        
+        self.run_query(lambda conn: analytics.report(conn, group_by, class_name, subject), done,
+                       "Error computing analytics", channel='analytics')
+    
+    def generate_report_cards(self):
+        """Write a PDF report card per student of the selected class, or of every class"""
+        directory = filedialog.askdirectory(title="Folder for report cards")
+        if not directory:
+            return
+        class_name = self.analytics_class_combo.get().strip() or None
+        
+        def progress(done, total):
+            # Called on the worker thread running the job
+            self.executor.post(lambda: self.status_label.config(text=f"Report cards: {done}/{total}"))
+        
+        def generate(conn):
+            return report_cards.generate(conn, directory, [class_name] if class_name else None,
+                                         progress=progress)
+        
+        self.run_query(generate, lambda result: messagebox.showinfo("Report Cards", result.summary()),
+                       "Error generating report cards", channel='report-cards')
+    
+    def show_distribution(self, summary):
+        """Show summary statistics and draw the percentage histogram"""
+        canvas = self.histogram_canvas
+        canvas.delete('all')
+        if not summary['count']:
+            self.analytics_summary_label.config(text="No grades match the selected filters")
+            return
+        self.analytics_summary_label.config(text=(
+            f"{summary['count']} grades   mean {summary['mean']:.2f}%   median {summary['median']:.2f}%   "
+            f"P25 {summary['p25']:.2f}%   P75 {summary['p75']:.2f}%   P90 {summary['p90']:.2f}%   "
+            f"std dev {summary['std']:.2f}   min {summary['min']:.2f}%   max {summary['max']:.2f}%"))
+        
+        counts, edges = summary['histogram']
+        canvas.update_idletasks()
+        width = max(canvas.winfo_width(), 400)
+        height = int(canvas['height'])
+        bar_width = width / len(counts)
+        tallest = max(int(counts.max()), 1)
+        for i, count in enumerate(counts):
+            bar_height = (height - 30) * int(count) / tallest
+            x0, x1 = i * bar_width + 2, (i + 1) * bar_width - 2
+            canvas.create_rectangle(x0, height - 15 - bar_height, x1, height - 15, fill='#4a90d9', outline='')
+            canvas.create_text((x0 + x1) / 2, height - 20 - bar_height, text=str(count), anchor='s')
+            canvas.create_text((x0 + x1) / 2, height - 7, text=f"{edges[i]:.0f}-{edges[i + 1]:.0f}%")
     
     def load_filter_options(self):
         """Load options for filter comboboxes"""
-        try:
-            conn = connect()
-            cursor = conn.cursor()
-            
+        def fetch(conn):
             # Load classes
-            cursor.execute('SELECT DISTINCT class_name FROM students ORDER BY class_name')
-            classes = cursor.fetchall()
-            self.filter_class_combo['values'] = [class_name[0] for class_name in classes]
+            classes = query_cache.fetchall(
+                conn, 'SELECT DISTINCT class_name FROM students ORDER BY class_name',
+                tables=('students',))
             
             # Load subjects
-            cursor.execute('SELECT DISTINCT subject FROM grades ORDER BY subject')
-            subjects = cursor.fetchall()
-            self.filter_subject_combo['values'] = [subject[0] for subject in subjects]
-            
-            conn.close()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error loading filter options: {str(e)}")
+            subjects = query_cache.fetchall(
+                conn, 'SELECT DISTINCT subject FROM grades ORDER BY subject',
+                tables=('grades',))
+            return classes, subjects
+        
+        def done(result):
+            classes, subjects = result
+            self.class_options = [class_name[0] for class_name in classes]
+            self.subject_options = [subject[0] for subject in subjects]
+            for combo in self.class_combos:
+                self.fill_filter(combo, self.class_options)
+            for combo in self.subject_combos:
+                self.fill_filter(combo, self.subject_options)
+        
+        self.run_query(fetch, done, "Error loading filter options", channel='filter-options')
 
 
 def main():
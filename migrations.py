@@ -0,0 +1,432 @@
+# migrations.py
+
+from db_config import connect
+
+# Arbitrary key for the advisory lock that serializes concurrent migrators
+MIGRATION_LOCK_ID = 4200
+
+# (version, description, statements) applied in order, each in one transaction
+MIGRATIONS = [
+    (1, "create students and grades tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS students (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            class_name VARCHAR(50) NOT NULL,
+            phone VARCHAR(20),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS grades (
+            id SERIAL PRIMARY KEY,
+            student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+            subject VARCHAR(100) NOT NULL,
+            grade DECIMAL(5,2) NOT NULL,
+            max_marks DECIMAL(5,2) DEFAULT 100,
+            exam_date DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, "b-tree indexes for joins, filters and keyset paging", [
+        'CREATE INDEX IF NOT EXISTS grades_student_id_idx ON grades (student_id)',
+        'CREATE INDEX IF NOT EXISTS grades_subject_idx ON grades (subject)',
+        'CREATE INDEX IF NOT EXISTS students_class_name_idx ON students (class_name)',
+        'CREATE INDEX IF NOT EXISTS students_name_id_idx ON students (name, id)',
+    ]),
+    (3, "trigram index for substring name search", [
+        # pg_trgm ships with contrib; skip the index where it is unavailable
+        '''
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                CREATE INDEX IF NOT EXISTS students_name_trgm_idx
+                    ON students USING gin (name gin_trgm_ops);
+            ELSE
+                RAISE NOTICE 'pg_trgm is not available; name search stays unindexed';
+            END IF;
+        END
+        $$
+        ''',
+    ]),
+    (4, "notify listeners when students or grades change", [
+        '''
+        CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('table_changed', TG_TABLE_NAME);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS students_notify_change ON students',
+        '''
+        CREATE TRIGGER students_notify_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON students
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change()
+        ''',
+        'DROP TRIGGER IF EXISTS grades_notify_change ON grades',
+        '''
+        CREATE TRIGGER grades_notify_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON grades
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change()
+        ''',
+    ]),
+    (5, "per-student grade summary kept current by triggers", [
+        '''
+        CREATE TABLE IF NOT EXISTS student_summary (
+            student_id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+            grade_count INTEGER NOT NULL,
+            subject_count INTEGER NOT NULL,
+            total_marks DECIMAL(12,2) NOT NULL,
+            total_max_marks DECIMAL(12,2) NOT NULL,
+            average_percentage DECIMAL(6,2),
+            last_exam_date DATE
+        )
+        ''',
+        # Recompute the rows of the given students from their grades; students
+        # left without grades lose their summary row
+        '''
+        CREATE OR REPLACE FUNCTION refresh_student_summary(ids INTEGER[]) RETURNS void AS $$
+        BEGIN
+            DELETE FROM student_summary ss
+            WHERE ss.student_id = ANY(ids)
+              AND NOT EXISTS (SELECT 1 FROM grades g WHERE g.student_id = ss.student_id);
+
+            INSERT INTO student_summary AS ss
+                (student_id, grade_count, subject_count, total_marks, total_max_marks,
+                 average_percentage, last_exam_date)
+            SELECT g.student_id, COUNT(*), COUNT(DISTINCT g.subject), SUM(g.grade),
+                   SUM(g.max_marks), ROUND(AVG(g.grade / g.max_marks * 100), 2), MAX(g.exam_date)
+            FROM grades g
+            WHERE g.student_id = ANY(ids)
+              AND EXISTS (SELECT 1 FROM students s WHERE s.id = g.student_id)
+            GROUP BY g.student_id
+            ON CONFLICT (student_id) DO UPDATE SET
+                grade_count = EXCLUDED.grade_count,
+                subject_count = EXCLUDED.subject_count,
+                total_marks = EXCLUDED.total_marks,
+                total_max_marks = EXCLUDED.total_max_marks,
+                average_percentage = EXCLUDED.average_percentage,
+                last_exam_date = EXCLUDED.last_exam_date;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        # Statement-level triggers with transition tables, so a bulk import
+        # refreshes each affected student once rather than once per grade
+        '''
+        CREATE OR REPLACE FUNCTION grades_refresh_summary() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM refresh_student_summary(
+                    ARRAY(SELECT DISTINCT student_id FROM new_grades WHERE student_id IS NOT NULL));
+            ELSIF TG_OP = 'UPDATE' THEN
+                PERFORM refresh_student_summary(ARRAY(
+                    SELECT student_id FROM old_grades WHERE student_id IS NOT NULL
+                    UNION
+                    SELECT student_id FROM new_grades WHERE student_id IS NOT NULL));
+            ELSE
+                PERFORM refresh_student_summary(
+                    ARRAY(SELECT DISTINCT student_id FROM old_grades WHERE student_id IS NOT NULL));
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS grades_summary_insert ON grades',
+        '''
+        CREATE TRIGGER grades_summary_insert
+            AFTER INSERT ON grades REFERENCING NEW TABLE AS new_grades
+            FOR EACH STATEMENT EXECUTE FUNCTION grades_refresh_summary()
+        ''',
+        'DROP TRIGGER IF EXISTS grades_summary_update ON grades',
+        '''
+        CREATE TRIGGER grades_summary_update
+            AFTER UPDATE ON grades REFERENCING OLD TABLE AS old_grades NEW TABLE AS new_grades
+            FOR EACH STATEMENT EXECUTE FUNCTION grades_refresh_summary()
+        ''',
+        'DROP TRIGGER IF EXISTS grades_summary_delete ON grades',
+        '''
+        CREATE TRIGGER grades_summary_delete
+            AFTER DELETE ON grades REFERENCING OLD TABLE AS old_grades
+            FOR EACH STATEMENT EXECUTE FUNCTION grades_refresh_summary()
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION grades_truncate_summary() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM student_summary;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS grades_summary_truncate ON grades',
+        '''
+        CREATE TRIGGER grades_summary_truncate
+            AFTER TRUNCATE ON grades
+            FOR EACH STATEMENT EXECUTE FUNCTION grades_truncate_summary()
+        ''',
+        # Backfill from the grades already recorded
+        'TRUNCATE student_summary',
+        '''
+        INSERT INTO student_summary
+            (student_id, grade_count, subject_count, total_marks, total_max_marks,
+             average_percentage, last_exam_date)
+        SELECT student_id, COUNT(*), COUNT(DISTINCT subject), SUM(grade), SUM(max_marks),
+               ROUND(AVG(grade / max_marks * 100), 2), MAX(exam_date)
+        FROM grades
+        WHERE student_id IS NOT NULL
+        GROUP BY student_id
+        ''',
+        'CREATE INDEX IF NOT EXISTS student_summary_average_idx ON student_summary (average_percentage)',
+    ]),
+    (6, "row versions, update times and delete tombstones for offline sync", [
+        'ALTER TABLE students ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE students ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP',
+        'ALTER TABLE grades ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE grades ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP',
+        'CREATE INDEX IF NOT EXISTS students_updated_at_idx ON students (updated_at)',
+        'CREATE INDEX IF NOT EXISTS grades_updated_at_idx ON grades (updated_at)',
+        '''
+        CREATE OR REPLACE FUNCTION bump_row_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := OLD.version + 1;
+            NEW.updated_at := CURRENT_TIMESTAMP;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS students_bump_version ON students',
+        '''
+        CREATE TRIGGER students_bump_version
+            BEFORE UPDATE ON students
+            FOR EACH ROW EXECUTE FUNCTION bump_row_version()
+        ''',
+        'DROP TRIGGER IF EXISTS grades_bump_version ON grades',
+        '''
+        CREATE TRIGGER grades_bump_version
+            BEFORE UPDATE ON grades
+            FOR EACH ROW EXECUTE FUNCTION bump_row_version()
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS deleted_rows (
+            table_name VARCHAR(50) NOT NULL,
+            row_id INTEGER NOT NULL,
+            deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS deleted_rows_deleted_at_idx ON deleted_rows (deleted_at)',
+        '''
+        CREATE OR REPLACE FUNCTION record_deleted_rows() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO deleted_rows (table_name, row_id) SELECT TG_TABLE_NAME, id FROM old_rows;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS students_record_delete ON students',
+        '''
+        CREATE TRIGGER students_record_delete
+            AFTER DELETE ON students REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows()
+        ''',
+        'DROP TRIGGER IF EXISTS grades_record_delete ON grades',
+        '''
+        CREATE TRIGGER grades_record_delete
+            AFTER DELETE ON grades REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows()
+        ''',
+    ]),
+    (7, "append-only audit log of student and grade changes, partitioned by month", [
+        '''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id BIGSERIAL,
+            changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            table_name VARCHAR(50) NOT NULL,
+            row_id INTEGER NOT NULL,
+            action VARCHAR(10) NOT NULL,
+            actor TEXT NOT NULL,
+            old_row JSONB,
+            new_row JSONB
+        ) PARTITION BY RANGE (changed_at)
+        ''',
+        'CREATE TABLE IF NOT EXISTS audit_log_default PARTITION OF audit_log DEFAULT',
+        'CREATE INDEX IF NOT EXISTS audit_log_row_idx ON audit_log (table_name, row_id, changed_at, id)',
+        # One partition per month from this one to months_ahead months on;
+        # a month whose rows already went to the default partition is skipped
+        '''
+        CREATE OR REPLACE FUNCTION create_audit_partitions(months_ahead INTEGER) RETURNS INTEGER AS $$
+        DECLARE
+            month DATE := date_trunc('month', CURRENT_DATE);
+            partition TEXT;
+            created INTEGER := 0;
+        BEGIN
+            FOR i IN 0..months_ahead LOOP
+                partition := 'audit_log_' || to_char(month, 'YYYY_MM');
+                IF to_regclass(partition) IS NULL THEN
+                    BEGIN
+                        EXECUTE format('CREATE TABLE %I PARTITION OF audit_log FOR VALUES FROM (%L) TO (%L)',
+                                       partition, month, (month + INTERVAL '1 month')::date);
+                        created := created + 1;
+                    EXCEPTION WHEN check_violation THEN
+                        RAISE NOTICE 'audit_log_default holds rows for %; % not created', month, partition;
+                    END;
+                END IF;
+                month := month + INTERVAL '1 month';
+            END LOOP;
+            RETURN created;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'SELECT create_audit_partitions(3)',
+        # Rows are only ever added; old months go by dropping their partition
+        '''
+        CREATE OR REPLACE FUNCTION reject_audit_change() RETURNS trigger AS $$
+        BEGIN
+            RAISE EXCEPTION 'audit_log is append-only';
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS audit_log_append_only ON audit_log',
+        '''
+        CREATE TRIGGER audit_log_append_only
+            AFTER UPDATE OR DELETE ON audit_log
+            FOR EACH ROW EXECUTE FUNCTION reject_audit_change()
+        ''',
+        'DROP TRIGGER IF EXISTS audit_log_no_truncate ON audit_log',
+        '''
+        CREATE TRIGGER audit_log_no_truncate
+            BEFORE TRUNCATE ON audit_log
+            FOR EACH STATEMENT EXECUTE FUNCTION reject_audit_change()
+        ''',
+        # Statement triggers reading transition tables: one INSERT ... SELECT
+        # per statement however many rows it changed
+        '''
+        CREATE OR REPLACE FUNCTION audit_changes() RETURNS trigger AS $$
+        DECLARE
+            who TEXT := COALESCE(NULLIF(current_setting('audit.actor', true), ''), session_user);
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO audit_log (table_name, row_id, action, actor, new_row)
+                SELECT TG_TABLE_NAME, n.id, 'insert', who, to_jsonb(n) FROM new_rows n;
+            ELSIF TG_OP = 'UPDATE' THEN
+                -- Planned per statement: a cached plan from a one-row update
+                -- would nested-loop join a bulk update's rows
+                EXECUTE 'INSERT INTO audit_log (table_name, row_id, action, actor, old_row, new_row)
+                         SELECT $1, n.id, ''update'', $2, to_jsonb(o), to_jsonb(n)
+                         FROM old_rows o JOIN new_rows n ON n.id = o.id'
+                    USING TG_TABLE_NAME, who;
+            ELSE
+                INSERT INTO audit_log (table_name, row_id, action, actor, old_row)
+                SELECT TG_TABLE_NAME, o.id, 'delete', who, to_jsonb(o) FROM old_rows o;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS students_audit_insert ON students',
+        '''
+        CREATE TRIGGER students_audit_insert
+            AFTER INSERT ON students REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_changes()
+        ''',
+        'DROP TRIGGER IF EXISTS students_audit_update ON students',
+        '''
+        CREATE TRIGGER students_audit_update
+            AFTER UPDATE ON students REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_changes()
+        ''',
+        'DROP TRIGGER IF EXISTS students_audit_delete ON students',
+        '''
+        CREATE TRIGGER students_audit_delete
+            AFTER DELETE ON students REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_changes()
+        ''',
+        'DROP TRIGGER IF EXISTS grades_audit_insert ON grades',
+        '''
+        CREATE TRIGGER grades_audit_insert
+            AFTER INSERT ON grades REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_changes()
+        ''',
+        'DROP TRIGGER IF EXISTS grades_audit_update ON grades',
+        '''
+        CREATE TRIGGER grades_audit_update
+            AFTER UPDATE ON grades REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_changes()
+        ''',
+        'DROP TRIGGER IF EXISTS grades_audit_delete ON grades',
+        '''
+        CREATE TRIGGER grades_audit_delete
+            AFTER DELETE ON grades REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION audit_changes()
+        ''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Return the recorded schema version, 0 for an unmigrated database"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('schema_migrations')")
+    if cursor.fetchone()[0] is None:
+        return 0
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    return cursor.fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations and return the versions that were applied
+
+    A database that is already current costs two catalog lookups and no DDL.
+    """
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+
+    cursor = conn.cursor()
+    cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+
+        applied = []
+        # Re-read under the lock in case another client migrated meanwhile
+        version = current_version(conn)
+        for number, description, statements in MIGRATIONS:
+            if number <= version:
+                continue
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute('INSERT INTO schema_migrations (version, description) VALUES (%s, %s)',
+                           (number, description))
+            conn.commit()
+            applied.append(number)
+        return applied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+
+def main():
+    """Bring the configured database up to the latest schema version"""
+    with connect() as conn:
+        applied = migrate(conn)
+    if applied:
+        print(f"Applied migrations: {', '.join(map(str, applied))}")
+    else:
+        print(f"Schema is current (version {LATEST_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# queries.py
+#
+# The query catalog: statements and query fragments defined once, and
+# execute(), through which the app runs them.
+#
+# Statements entered with define() - repository's reads and writes by id -
+# run as server-side prepared statements, unless defined with
+# prepare=False. A pooled connection (see PreparingConnection) PREPAREs one
+# the first time it runs it and EXECUTEs it from then on, so Postgres
+# parses and plans it once per connection rather than on every call.
+# Prepared statements outlive transactions and are dropped with their
+# connection.
+#
+# SQL composed at run time - the search and the keyset pages built from
+# SEARCH and the listings - runs as it is. Its best plan depends on the
+# values: after a few runs Postgres would switch a prepared search to a
+# generic plan that cannot see how selective the name pattern is, which
+# measured slower than planning each search afresh.
+#
+# Every execution is reported to the hooks registered with add_hook(); the
+# default one records it in instrumentation under the query's name, so the
+# Diagnostics tab lists the time spent in each query. The API server needs
+# none of this: asyncpg prepares and caches its statements itself.
+
+import re
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import instrumentation
+
+# A grade as a percentage of its max marks
+PERCENTAGE = 'ROUND((g.grade / g.max_marks) * 100, 2)'
+
+# The search tab, as (columns, from clause, order, sort keys) like
+# repository's listings. SEARCH lists a row per grade, with students that
+# have none when the from clause's {join} is LEFT JOIN; SEARCH_SUMMARY lists
+# a row per student from student_summary.
+SEARCH = (
+    f's.name, s.email, s.class_name, g.subject, g.grade, {PERCENTAGE} AS percentage',
+    'students s {join} grades g ON s.id = g.student_id',
+    ('s.name', "COALESCE(g.subject, '')", 's.id', 'COALESCE(g.id, 0)'),
+    ('s.name', 's.email', 's.class_name', "COALESCE(g.subject, '')",
+     'COALESCE(g.grade, -1)', f'COALESCE({PERCENTAGE}, -1)'),
+)
+SEARCH_SUMMARY = (
+    '''s.name, s.email, s.class_name, COALESCE(ss.subject_count, 0),
+       ss.total_marks, ss.average_percentage, ss.last_exam_date''',
+    'students s LEFT JOIN student_summary ss ON ss.student_id = s.id',
+    ('s.name', 's.id'),
+    ('s.name', 's.email', 's.class_name', 'COALESCE(ss.subject_count, 0)',
+     'COALESCE(ss.total_marks, -1)', 'COALESCE(ss.average_percentage, -1)',
+     "COALESCE(ss.last_exam_date, DATE '0001-01-01')"),
+)
+# What the search reads (student_summary is derived from grades)
+SEARCH_TABLES = ('students', 'grades')
+
+_catalog = {}
+_hooks = []
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+
+
+def define(name, sql, prepare=True):
+    """Enter sql in the catalog under name and return it
+
+    prepare=False runs it as it is, for a statement whose best plan
+    depends on its parameters.
+    """
+    _catalog[sql] = (name, prepare)
+    return sql
+
+
+def name_of(sql):
+    """The catalog name of sql, else its text shortened, to label its timings"""
+    name, _ = _catalog.get(sql, (None, False))
+    if name is None:
+        text = ' '.join(sql.split())
+        name = text if len(text) <= 80 else text[:77] + '...'
+    return name
+
+
+def add_hook(hook):
+    """Call hook(name, seconds, rows) after each statement run by execute()"""
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def _record(name, seconds, rows):
+    instrumentation.metrics.record('statement', seconds, rows, operation=name)
+
+
+add_hook(_record)
+
+
+def positional(sql):
+    """Rewrite %(name)s or %s placeholders to $1.. for PREPARE
+
+    Returns (sql, names); names lists the parameter names in order, or is
+    None for %s placeholders.
+    """
+    names = []
+    count = 0
+
+    def placeholder(match):
+        nonlocal count
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(1) is None:
+            count += 1
+            return f'${count}'
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f'${names.index(match.group(1)) + 1}'
+
+    text = _PLACEHOLDER.sub(placeholder, sql)
+    if names and count:
+        raise ValueError("Cannot mix %s and %(name)s placeholders")
+    return text, names if names else None
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """A connection that remembers the statements it has prepared
+
+    db_config's pool opens these; execute() runs plain SQL on any other
+    connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = {}
+        # Server-side name -> the SQL it runs, for the slow query log
+        self.sources = {}
+        self._counter = 0
+
+    def statement(self, sql):
+        """(server-side name, parameter names) of sql, preparing it if needed
+
+        The name is None if Postgres cannot prepare sql (it cannot infer a
+        parameter's type, say); such SQL is then always run as it is.
+        """
+        entry = self.prepared.get(sql)
+        if entry is not None:
+            return entry
+        text, names = positional(sql)
+        self._counter += 1
+        name = f'q{self._counter}'
+        # A plain cursor, so the bookkeeping is not timed as queries; and a
+        # savepoint, so SQL that cannot be prepared leaves the caller's
+        # transaction usable
+        plain = self.cursor(cursor_factory=psycopg2.extensions.cursor)
+        guarded = not self.autocommit
+        try:
+            if guarded:
+                plain.execute('SAVEPOINT prepare_statement')
+            try:
+                plain.execute(f'PREPARE {name} AS {text}')
+                self.sources[name] = sql
+            except psycopg2.Error:
+                if not guarded:
+                    raise
+                plain.execute('ROLLBACK TO SAVEPOINT prepare_statement')
+                name = None
+            if guarded:
+                plain.execute('RELEASE SAVEPOINT prepare_statement')
+            entry = self.prepared[sql] = (name, names)
+        finally:
+            plain.close()
+        return entry
+
+
+def execute(cursor, sql, params=None, name=None):
+    """cursor.execute(sql, params), prepared if the catalog says so
+
+    name labels the timings of SQL not in the catalog. Returns the cursor,
+    ready to fetch from.
+    """
+    start = time.perf_counter()
+    conn = cursor.connection
+    _, prepare = _catalog.get(sql, (None, False))
+    if params is None or not prepare or not isinstance(conn, PreparingConnection):
+        cursor.execute(sql, params)
+    else:
+        statement, names = conn.statement(sql)
+        if statement is None:
+            cursor.execute(sql, params)
+        else:
+            args = [params[field] for field in names] if names is not None else list(params)
+            if args:
+                cursor.execute(f'EXECUTE {statement} ({", ".join(["%s"] * len(args))})', args)
+            else:
+                cursor.execute(f'EXECUTE {statement}')
+    seconds = time.perf_counter() - start
+    rows = max(cursor.rowcount, 0)
+    for hook in _hooks:
+        hook(name or name_of(sql), seconds, rows)
+    return cursor
@@ -0,0 +1,137 @@
+# query_cache.py
+
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+import db_config
+import instrumentation
+import queries
+
+# Channel the notify_table_change() trigger publishes table names on
+CHANGE_CHANNEL = 'table_changed'
+
+
+class QueryCache:
+    """LRU cache of query results keyed by SQL text and parameters
+
+    Entries expire after ttl seconds and are dropped as soon as one of the
+    tables they read from is invalidated. Safe to use from several threads.
+    """
+
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def versions(self, tables):
+        """Snapshot of the tables' invalidation counters, taken before a query"""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def get(self, sql, params):
+        """Return (True, rows) on a hit, (False, None) otherwise"""
+        key = (sql, tuple(params))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, tables, rows = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, rows
+
+    def put(self, sql, params, tables, rows, versions):
+        """Store rows unless one of the tables changed since versions was taken"""
+        with self._lock:
+            if tuple(self._versions.get(table, 0) for table in tables) != versions:
+                return
+            self._entries[(sql, tuple(params))] = (time.monotonic() + self.ttl, tuple(tables), rows)
+            self._entries.move_to_end((sql, tuple(params)))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tables):
+        """Drop every entry that read from any of the tables"""
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            stale = [key for key, (_, entry_tables, _) in self._entries.items()
+                     if any(table in entry_tables for table in tables)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = QueryCache()
+
+
+def fetchall(conn, sql, params=(), tables=(), name=None):
+    """cursor.fetchall() through the shared cache; tables are what sql reads
+
+    sql runs through queries.execute(), with name labelling its timings.
+    """
+    hit, rows = cache.get(sql, params)
+    if hit:
+        instrumentation.metrics.record('cache hit', 0, len(rows))
+        return rows
+    versions = cache.versions(tables)
+    rows = queries.execute(conn.cursor(), sql, params, name).fetchall()
+    cache.put(sql, params, tables, rows, versions)
+    return rows
+
+
+class ChangeListener(threading.Thread):
+    """Invalidates the cache when other clients write, via LISTEN/NOTIFY
+
+    Uses its own connection outside the pool, since it stays in LISTEN for
+    the life of the application. on_change(table) is called from this thread.
+    """
+
+    RECONNECT_DELAY = 5
+
+    def __init__(self, on_change=None):
+        super().__init__(name='change-listener', daemon=True)
+        self.on_change = on_change
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+            except psycopg2.Error:
+                # Whatever changed while we were disconnected is unknown
+                cache.clear()
+                self._stopping.wait(self.RECONNECT_DELAY)
+
+    def _listen(self):
+        conn = psycopg2.connect(**db_config.DB_SETTINGS)
+        try:
+            conn.autocommit = True
+            conn.cursor().execute(f'LISTEN {CHANGE_CHANNEL}')
+            while not self._stopping.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                tables = {notify.payload for notify in conn.notifies}
+                conn.notifies.clear()
+                if tables:
+                    cache.invalidate(*tables)
+                    if self.on_change:
+                        for table in tables:
+                            self.on_change(table)
+        finally:
+            conn.close()
@@ -0,0 +1,163 @@
+# query_executor.py
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db_config import connect
+import instrumentation
+
+
+class Job:
+    """A submitted query job; cancelling it interrupts the server-side query"""
+
+    def __init__(self, work, on_success, on_error, channel, session, operation):
+        self.work = work
+        self.session = session
+        self.operation = operation
+        self.on_success = on_success
+        self.on_error = on_error
+        self.channel = channel
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def attach(self, conn):
+        """Record the connection the job runs on; False if already cancelled"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._conn = conn
+            return True
+
+    def detach(self):
+        with self._lock:
+            self._conn = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None and not self._conn.closed:
+                self._conn.cancel()
+
+
+class QueryExecutor:
+    """Runs database work on worker threads and hands results to the Tk thread
+
+    A job is a callable taking a pooled connection. Its result (or exception)
+    is delivered to on_success / on_error from the Tk mainloop, so callbacks
+    may touch widgets. Jobs submitted on a channel can be cancelled together:
+    queued ones are skipped, running ones are cancelled on the server, and
+    neither delivers a result. on_busy(True/False) is called when work starts
+    and when the last outstanding job finishes.
+
+    session is the context manager jobs get their connection from:
+    db_config.connect by default. A job can name its own, such as
+    api_client.session to work over HTTP or a LocalMirror's session.
+    """
+
+    POLL_INTERVAL = 30
+
+    def __init__(self, root, workers=4, on_error=None, on_busy=None, session=connect):
+        self.root = root
+        self.session = session
+        self.on_error = on_error
+        self.on_busy = on_busy
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query')
+        self._results = queue.Queue()
+        self._channels = {}
+        self._channels_lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+        self.root.after(self.POLL_INTERVAL, self._poll)
+
+    def submit(self, work, on_success=None, on_error=None, channel=None, session=None,
+               operation=None):
+        """Queue work(conn) and return its Job; conn comes from session if given
+
+        operation names the job in instrumentation metrics; by default the
+        channel, or else the name of work.
+        """
+        operation = operation or channel or instrumentation.operation_name(work)
+        job = Job(work, on_success, on_error or self.on_error, channel, session or self.session,
+                  operation)
+        if channel is not None:
+            with self._channels_lock:
+                self._channels.setdefault(channel, set()).add(job)
+        self._pending += 1
+        if self._pending == 1 and self.on_busy:
+            self.on_busy(True)
+        self._workers.submit(self._run, job)
+        return job
+
+    def post(self, callback, *args):
+        """Run callback(*args) on the Tk thread; safe to call from any thread"""
+        self._results.put((None, (callback, args), None))
+
+    def cancel(self, channel):
+        """Cancel every outstanding job submitted on channel"""
+        with self._channels_lock:
+            jobs = self._channels.pop(channel, set())
+        for job in jobs:
+            job.cancel()
+
+    def shutdown(self):
+        """Cancel outstanding work and stop the worker threads"""
+        self._closed = True
+        with self._channels_lock:
+            channels = list(self._channels)
+        for channel in channels:
+            self.cancel(channel)
+        self._workers.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job):
+        result, error = None, None
+        if not job.cancelled:
+            try:
+                with instrumentation.operation(job.operation), instrumentation.timed('job'):
+                    with job.session() as conn:
+                        if job.attach(conn):
+                            try:
+                                result = job.work(conn)
+                            finally:
+                                job.detach()
+            except Exception as e:
+                error = e
+        self._results.put((job, result, error))
+
+    def _poll(self):
+        try:
+            while True:
+                try:
+                    job, result, error = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    callback, args = result
+                    callback(*args)
+                else:
+                    self._finish(job, result, error)
+        finally:
+            if not self._closed:
+                self.root.after(self.POLL_INTERVAL, self._poll)
+
+    def _finish(self, job, result, error):
+        if job.channel is not None:
+            with self._channels_lock:
+                jobs = self._channels.get(job.channel)
+                if jobs is not None:
+                    jobs.discard(job)
+                    if not jobs:
+                        del self._channels[job.channel]
+        self._pending -= 1
+        try:
+            if job.cancelled:
+                return
+            if error is None:
+                if job.on_success:
+                    job.on_success(result)
+            elif job.on_error:
+                job.on_error(error)
+        finally:
+            if self._pending == 0 and self.on_busy:
+                self.on_busy(False)
@@ -0,0 +1,299 @@
+# report_cards.py
+#
+# Term-end report cards: one PDF per student, written under a directory with
+# one folder per class:
+#
+#     python report_cards.py reports/ [--class 10A ...] [--workers 8] [--overwrite]
+#
+# Each class is read with a single query that also ranks the students and
+# averages every subject, and its cards are rendered by a pool of worker
+# processes, in chunks, while the next class is read. Workers write each file
+# under a temporary name and rename it when complete, so a run that stops
+# part way can simply be started again: students whose card exists are
+# skipped unless --overwrite is given.
+#
+# The PDFs are written directly (no PDF library needed) in the standard
+# Helvetica fonts, which cover Latin-1 text; other characters print as '?'.
+
+import argparse
+import datetime
+import os
+import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+from db_config import connect
+
+# Cards rendered per task handed to a worker process
+CHUNK_SIZE = 100
+
+CLASS_QUERY = '''
+    WITH ranked AS (
+        SELECT s.id, s.name, s.email, s.class_name,
+               ROUND(AVG(g.grade / g.max_marks * 100), 2) AS average,
+               RANK() OVER (ORDER BY AVG(g.grade / g.max_marks * 100) DESC NULLS LAST) AS rank,
+               COUNT(*) OVER () AS class_size
+        FROM students s
+        LEFT JOIN grades g ON g.student_id = s.id
+        WHERE s.class_name = %s
+        GROUP BY s.id
+    )
+    SELECT r.id, r.name, r.email, r.class_name, r.average, r.rank, r.class_size,
+           g.subject, g.grade, g.max_marks, ROUND((g.grade / g.max_marks) * 100, 2), g.exam_date,
+           ROUND(AVG(g.grade / g.max_marks * 100) OVER (PARTITION BY g.subject), 2)
+    FROM ranked r
+    LEFT JOIN grades g ON g.student_id = r.id
+    ORDER BY r.id, g.subject, g.exam_date, g.id
+'''
+
+
+class ReportCard:
+    """One student's card: their details, class standing and grades
+
+    grades holds (subject, grade, max_marks, percentage, exam_date,
+    class_average) tuples, where class_average is the class's mean
+    percentage in that subject.
+    """
+
+    def __init__(self, student_id, name, email, class_name, average, rank, class_size):
+        self.student_id = student_id
+        self.name = name
+        self.email = email
+        self.class_name = class_name
+        self.average = average
+        self.rank = rank
+        self.class_size = class_size
+        self.grades = []
+
+    def filename(self):
+        return f"{self.student_id}_{_slug(self.name)}.pdf"
+
+
+class RunResult:
+    """Counts from one report card run"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.total = 0
+        self.written = 0
+        self.skipped = 0
+
+    def summary(self):
+        return (f"{self.written} report cards written, {self.skipped} already present "
+                f"({self.total} students) in {self.directory}")
+
+
+def _slug(text):
+    return re.sub(r'[^A-Za-z0-9]+', '_', text).strip('_') or 'student'
+
+
+def class_names(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT DISTINCT class_name FROM students ORDER BY class_name')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def fetch_class(conn, class_name):
+    """The report cards of one class, in student id order"""
+    cursor = conn.cursor()
+    cursor.execute(CLASS_QUERY, (class_name,))
+    cards = []
+    for row in cursor.fetchall():
+        if not cards or cards[-1].student_id != row[0]:
+            cards.append(ReportCard(*row[:7]))
+        if row[7] is not None:
+            cards[-1].grades.append(row[7:])
+    return cards
+
+
+# PDF output
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+ROW_HEIGHT = 16
+
+# Table columns: (heading, x position, right-aligned)
+COLUMNS = (('Subject', MARGIN, False), ('Grade', 270, True), ('Max', 320, True),
+           ('%', 370, True), ('Class avg %', 450, True), ('Exam date', 470, False))
+
+
+def _text(value):
+    if value is None:
+        return b''
+    encoded = str(value).encode('latin-1', errors='replace')
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class _Page:
+    def __init__(self):
+        self.ops = []
+
+    def text(self, x, y, value, size=10, bold=False, right=False):
+        data = _text(value)
+        if right:
+            # Helvetica digits are 0.556 em wide; good enough for numbers
+            x -= len(data) * size * 0.556
+        font = b'/F2' if bold else b'/F1'
+        self.ops.append(b'BT %s %d Tf %.1f %.1f Td (%s) Tj ET' % (font, size, x, y, data))
+
+    def line(self, x1, y1, x2, y2):
+        self.ops.append(b'%.1f %.1f m %.1f %.1f l S' % (x1, y1, x2, y2))
+
+    def content(self):
+        return b'0.5 w\n' + b'\n'.join(self.ops)
+
+
+def pdf_document(pages):
+    """A PDF file (bytes) of pages, each a content stream"""
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>']
+    kids = []
+    for content in pages:
+        kids.append(len(objects) + 1)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                       b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                       % (PAGE_WIDTH, PAGE_HEIGHT, len(objects) + 2))
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % kid for kid in kids), len(kids))
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def render(card, issued=None):
+    """The card as PDF bytes; grades continue on further pages as needed"""
+    issued = issued or datetime.date.today()
+    pages = [_Page()]
+    page = pages[0]
+    y = PAGE_HEIGHT - MARGIN
+    page.text(MARGIN, y, "Report Card", size=18, bold=True)
+    page.text(PAGE_WIDTH - MARGIN, y, issued.isoformat(), right=True)
+    y -= 30
+    for label, value in (("Student", card.name), ("Email", card.email), ("Class", card.class_name)):
+        page.text(MARGIN, y, label, bold=True)
+        page.text(MARGIN + 60, y, value)
+        y -= ROW_HEIGHT
+    y -= 10
+
+    def heading(page, y):
+        for title, x, right in COLUMNS:
+            page.text(x, y, title, bold=True, right=right)
+        page.line(MARGIN, y - 5, PAGE_WIDTH - MARGIN, y - 5)
+        return y - ROW_HEIGHT - 4
+
+    y = heading(page, y)
+    for subject, grade, max_marks, percentage, exam_date, class_average in card.grades:
+        if y < MARGIN + 3 * ROW_HEIGHT:
+            page = _Page()
+            pages.append(page)
+            y = heading(page, PAGE_HEIGHT - MARGIN)
+        for (_, x, right), value in zip(COLUMNS, (subject, grade, max_marks, percentage,
+                                                  class_average, exam_date)):
+            page.text(x, y, value, right=right)
+        y -= ROW_HEIGHT
+    if not card.grades:
+        page.text(MARGIN, y, "No grades recorded")
+        y -= ROW_HEIGHT
+
+    page.line(MARGIN, y + 6, PAGE_WIDTH - MARGIN, y + 6)
+    y -= 10
+    page.text(MARGIN, y, "Overall average", bold=True)
+    page.text(MARGIN + 120, y, f"{card.average}%" if card.average is not None else "-")
+    y -= ROW_HEIGHT
+    page.text(MARGIN, y, "Class rank", bold=True)
+    page.text(MARGIN + 120, y, f"{card.rank} of {card.class_size}" if card.average is not None else "-")
+    return pdf_document([page.content() for page in pages])
+
+
+def _render_chunk(directory, cards, issued):
+    """Worker process: write each card's PDF; returns how many were written"""
+    for card in cards:
+        path = os.path.join(directory, card.filename())
+        partial = path + '.part'
+        with open(partial, 'wb') as f:
+            f.write(render(card, issued))
+        os.replace(partial, path)
+    return len(cards)
+
+
+def generate(conn, directory, classes=None, workers=None, overwrite=False, progress=None):
+    """Write the report cards of the given classes (default: all) under directory
+
+    progress(done, total) is called as cards are finished, from this thread.
+    Returns a RunResult.
+    """
+    classes = classes or class_names(conn)
+    workers = workers or os.cpu_count() or 1
+    issued = datetime.date.today()
+    result = RunResult(directory)
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM students WHERE class_name = ANY(%s)', (list(classes),))
+    result.total = cursor.fetchone()[0]
+
+    def report():
+        if progress:
+            progress(result.written + result.skipped, result.total)
+
+    def collect(pending, limit):
+        while len(pending) > limit:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                result.written += future.result()
+            report()
+
+    # spawn: forking a process that runs Tk and database threads is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        pending = set()
+        for class_name in classes:
+            class_directory = os.path.join(directory, _slug(class_name))
+            os.makedirs(class_directory, exist_ok=True)
+            existing = set() if overwrite else set(os.listdir(class_directory))
+            cards = []
+            for card in fetch_class(conn, class_name):
+                if card.filename() in existing:
+                    result.skipped += 1
+                else:
+                    cards.append(card)
+            report()
+            for start in range(0, len(cards), CHUNK_SIZE):
+                pending.add(pool.submit(_render_chunk, class_directory, cards[start:start + CHUNK_SIZE],
+                                        issued))
+                # Keep the workers busy without queueing a whole school's cards
+                collect(pending, workers * 2)
+        collect(pending, 0)
+    return result
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Write one PDF report card per student")
+    parser.add_argument('directory')
+    parser.add_argument('--class', dest='classes', action='append', metavar='CLASS',
+                        help="only this class; may be repeated")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="rewrite cards that already exist instead of resuming")
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} report cards", end='', file=sys.stderr, flush=True)
+
+    with connect() as conn:
+        result = generate(conn, args.directory, args.classes, args.workers, args.overwrite, progress)
+    print(file=sys.stderr)
+    print(result.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+# repository.py
+#
+# Student and grade queries shared by the desktop app, scripts and the HTTP
+# API (api_server.py). Statements use named %(name)s placeholders and are
+# entered in the query catalog (queries.py), which runs them as prepared
+# statements; numbered() rewrites them to $n for asyncpg.
+# The functions here take a psycopg2 connection and run inside its
+# transaction; api_client.py offers the same functions over HTTP.
+
+from psycopg2 import errors
+
+import queries
+import query_cache
+from validation import student_error, grade_error, class_error, curve_error, round_marks
+
+
+class ValidationError(ValueError):
+    """A record failed validation; the message is meant for the user"""
+
+
+class DuplicateError(Exception):
+    """A write would duplicate a unique value (a student's email)"""
+
+
+class ConflictError(Exception):
+    """A row changed or was deleted since the version the caller read
+
+    current is the row as it is now, in its listing's form, or None if it
+    was deleted or several rows conflicted.
+    """
+
+    def __init__(self, message, current=None):
+        super().__init__(message)
+        self.current = current
+
+
+# Listings as shown in the app: (select list, from clause, keyset order,
+# id column). The order ends in the id so every row has a distinct key.
+# Rows end with columns that are not displayed: the row version (for
+# optimistic concurrency) and, for grades, the student id before it.
+STUDENT_LIST = ('id, name, email, class_name, phone, version', 'students', ('name', 'id'), 'id')
+GRADE_LIST = (
+    f'''g.id, s.name, g.subject, g.grade, g.max_marks,
+       {queries.PERCENTAGE} AS percentage, g.student_id, g.version''',
+    'grades g JOIN students s ON g.student_id = s.id',
+    ('s.name', 'g.subject', 'g.id'),
+    'g.id',
+)
+LISTINGS = {'students': STUDENT_LIST, 'grades': GRADE_LIST}
+
+# Where a listing row holds each field of a record, and its version
+RECORD_COLUMNS = {
+    'students': {'name': 1, 'email': 2, 'class_name': 3, 'phone': 4},
+    'grades': {'student_id': 6, 'subject': 2, 'grade': 3, 'max_marks': 4},
+}
+VERSION_COLUMNS = {'students': 5, 'grades': 7}
+
+# A non-null sort expression per listed column, for sorting by a column
+LISTING_SORT_KEYS = {
+    'students': ('id', 'name', 'email', 'class_name', "COALESCE(phone, '')"),
+    'grades': ('g.id', 's.name', 'g.subject', 'g.grade', 'COALESCE(g.max_marks, 0)',
+               f'COALESCE({queries.PERCENTAGE}, -1)'),
+}
+
+STUDENT_FIELDS = ('name', 'email', 'class_name', 'phone')
+GRADE_FIELDS = ('student_id', 'subject', 'grade', 'max_marks')
+
+INSERT_STUDENT = queries.define('insert_student', '''
+    INSERT INTO students (name, email, class_name, phone)
+    VALUES (%(name)s, %(email)s, %(class_name)s, %(phone)s)
+    RETURNING id, name, email, class_name, phone, version
+''')
+
+INSERT_STUDENTS = queries.define('insert_students', '''
+    INSERT INTO students (name, email, class_name, phone)
+    SELECT * FROM unnest(%(name)s::varchar[], %(email)s::varchar[],
+                         %(class_name)s::varchar[], %(phone)s::varchar[])
+    RETURNING id, name, email, class_name, phone, version
+''')
+
+# Updates and deletes take the version the caller read, or NULL to skip the
+# check; a row whose version moved on is left alone
+UPDATE_STUDENT = queries.define('update_student', '''
+    UPDATE students SET name=%(name)s, email=%(email)s, class_name=%(class_name)s, phone=%(phone)s
+    WHERE id=%(id)s AND (%(version)s::int IS NULL OR version = %(version)s::int)
+    RETURNING id, name, email, class_name, phone, version
+''')
+
+CHANGE_CLASS = queries.define('change_class', '''
+    UPDATE students SET class_name=%(class_name)s
+    WHERE id = ANY(%(ids)s::int[])
+    RETURNING id, name, email, class_name, phone, version
+''')
+
+# Grades are deleted explicitly (rather than via the cascade) to learn their ids
+DELETE_STUDENT_GRADES = queries.define(
+    'delete_student_grades', 'DELETE FROM grades WHERE student_id = ANY(%(ids)s::int[]) RETURNING id')
+DELETE_STUDENTS = queries.define('delete_students', '''
+    DELETE FROM students s USING unnest(%(ids)s::int[], %(versions)s::int[]) AS v(id, version)
+    WHERE s.id = v.id AND (v.version IS NULL OR s.version = v.version)
+    RETURNING s.id
+''')
+
+INSERT_GRADE = queries.define('insert_grade', '''
+    INSERT INTO grades (student_id, subject, grade, max_marks)
+    VALUES (%(student_id)s, %(subject)s, %(grade)s, %(max_marks)s)
+    RETURNING id
+''')
+
+INSERT_GRADES = queries.define('insert_grades', '''
+    INSERT INTO grades (student_id, subject, grade, max_marks)
+    SELECT * FROM unnest(%(student_id)s::int[], %(subject)s::varchar[],
+                         %(grade)s::numeric[], %(max_marks)s::numeric[])
+    RETURNING id
+''')
+
+UPDATE_GRADE = queries.define('update_grade', '''
+    UPDATE grades SET student_id=%(student_id)s, subject=%(subject)s, grade=%(grade)s,
+                      max_marks=%(max_marks)s
+    WHERE id=%(id)s AND (%(version)s::int IS NULL OR version = %(version)s::int)
+    RETURNING id
+''')
+
+DELETE_GRADES = queries.define('delete_grades', '''
+    DELETE FROM grades g USING unnest(%(ids)s::int[], %(versions)s::int[]) AS v(id, version)
+    WHERE g.id = v.id AND (v.version IS NULL OR g.version = v.version)
+    RETURNING g.id
+''')
+
+# Merging duplicate students: their grades move to the student kept
+LOCK_STUDENT = queries.define('lock_student', 'SELECT version FROM students WHERE id = %(keep)s FOR UPDATE')
+
+MERGE_STUDENT_GRADES = queries.define('merge_student_grades', '''
+    UPDATE grades SET student_id = %(keep)s
+    WHERE student_id = ANY(%(ids)s::int[])
+    RETURNING id
+''')
+
+# Which of the given rows still exist, after a versioned delete
+REMAINING = {table: queries.define(f'remaining_{table}',
+                                   f'SELECT id FROM {table} WHERE id = ANY(%(ids)s::int[])')
+             for table in ('students', 'grades')}
+
+# grade * factor + points, kept between 0 and the grade's max marks. Applies
+# to a subject, to specific grades, or to specific grades of a subject; not
+# prepared, as a generic plan cannot tell which of those it is.
+CURVE_GRADES = queries.define('curve_grades', '''
+    UPDATE grades
+    SET grade = LEAST(max_marks, GREATEST(0, ROUND(grade * %(factor)s + %(points)s, 2)))
+    WHERE (%(subject)s::varchar IS NULL OR subject = %(subject)s::varchar)
+      AND (%(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[]))
+    RETURNING id
+''', prepare=False)
+
+STUDENT_CHOICES = queries.define('student_choices', 'SELECT id, name FROM students ORDER BY name')
+
+def numbered(sql, params):
+    """Rewrite %(name)s placeholders to $1.. and return (sql, args) for asyncpg"""
+    sql, names = queries.positional(sql)
+    return sql, [params[name] for name in names or ()]
+
+
+def student_params(student):
+    """Validated statement parameters for a student mapping"""
+    params = {field: student.get(field) or '' for field in STUDENT_FIELDS}
+    error = student_error(params['name'], params['email'], params['class_name'], params['phone'])
+    if error:
+        raise ValidationError(error)
+    return params
+
+
+def grade_params(grade):
+    """Validated statement parameters for a grade mapping"""
+    error = grade_error(grade.get('student_id'), grade.get('subject') or '',
+                        grade.get('grade'), grade.get('max_marks', 100))
+    if error:
+        raise ValidationError(error)
+    return {
+        'student_id': int(grade['student_id']),
+        'subject': grade['subject'],
+        'grade': float(round_marks(grade['grade'])),
+        'max_marks': float(round_marks(grade.get('max_marks', 100))),
+    }
+
+
+def class_params(student_ids, class_name):
+    """Validated parameters for moving students to another class"""
+    error = class_error(class_name or '')
+    if error:
+        raise ValidationError(error)
+    return {'ids': [int(i) for i in student_ids], 'class_name': class_name}
+
+
+def curve_params(subject=None, grade_ids=None, points=0, factor=1):
+    """Validated parameters for curving a subject's grades and/or specific grades"""
+    if not subject and grade_ids is None:
+        raise ValidationError("Choose a subject or grades to curve")
+    error = curve_error(points, factor)
+    if error:
+        raise ValidationError(error)
+    return {'subject': subject or None,
+            'ids': [int(i) for i in grade_ids] if grade_ids is not None else None,
+            'points': float(points), 'factor': float(factor)}
+
+
+def batch_params(rows, params, fields):
+    """Validate every row and transpose them into one array per field"""
+    checked = []
+    for number, row in enumerate(rows, 1):
+        try:
+            checked.append(params(row))
+        except ValidationError as e:
+            raise ValidationError(f"Row {number}: {e}")
+    return {field: [row[field] for row in checked] for field in fields}
+
+
+def page_query(listing, after=None, offset=0, limit=100, ids=None):
+    """(sql, params) for one keyset page of a listing, key columns last
+
+    Without after the page starts at offset; ids restricts the page to
+    specific rows instead.
+    """
+    columns, from_clause, order_by, id_column = listing
+    keys = ', '.join(order_by)
+    conditions, params = [], {'limit': limit}
+    if after is not None:
+        placeholders = ', '.join(f'%(after_{i})s' for i in range(len(after)))
+        conditions.append(f'({keys}) > ({placeholders})')
+        params.update((f'after_{i}', value) for i, value in enumerate(after))
+    if ids is not None:
+        conditions.append(f'{id_column} = ANY(%(ids)s::int[])')
+        params['ids'] = list(ids)
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    sql = f'SELECT {columns}, {keys} FROM {from_clause} {where} ORDER BY {keys} LIMIT %(limit)s'
+    if after is None and offset:
+        sql += ' OFFSET %(offset)s'
+        params['offset'] = offset
+    return sql, params
+
+
+def delete_params(row_ids, versions=None):
+    """Parameters for a versioned delete; versions line up with row_ids"""
+    row_ids = [int(i) for i in row_ids]
+    return {'ids': row_ids, 'versions': list(versions) if versions is not None else [None] * len(row_ids)}
+
+
+def record_params(table, record):
+    """A student or grade record normalized as the writes store it"""
+    try:
+        return student_params(record) if table == 'students' else grade_params(record)
+    except ValidationError:
+        # Rows saved before a validation rule was added
+        return dict(record)
+
+
+def listing_record(table, row):
+    """The record a listing row shows, as record_params gives it"""
+    return record_params(table, {field: row[position] for field, position in RECORD_COLUMNS[table].items()})
+
+
+def conflict(table, row_id, current):
+    """The ConflictError for a versioned write to row_id that matched no row"""
+    record = table[:-1]
+    if current is None:
+        return ConflictError(f"This {record} was deleted by someone else", None)
+    return ConflictError(f"This {record} was changed by someone else since it was loaded", current)
+
+
+def delete_conflict(table, remaining):
+    return ConflictError(f"{len(remaining)} of the selected {table} changed since they were loaded, "
+                         "so nothing was deleted")
+
+
+def count_query(listing):
+    return f'SELECT COUNT(*) FROM {listing[1]}'
+
+
+def split_keys(listing, rows):
+    """Split page rows into (key, values) pairs"""
+    split = len(rows[0]) - len(listing[2]) if rows else 0
+    return [(tuple(row[split:]), tuple(row[:split])) for row in rows]
+
+
+def _execute(conn, sql, params):
+    return queries.execute(conn.cursor(), sql, params)
+
+
+def create_student(conn, student):
+    """Insert one student and return its (id, name, email, class_name, phone, version) row"""
+    try:
+        return _execute(conn, INSERT_STUDENT, student_params(student)).fetchone()
+    except errors.UniqueViolation:
+        raise DuplicateError("Email already exists!")
+
+
+def create_students(conn, students):
+    """Insert many students in one statement and return their rows"""
+    try:
+        params = batch_params(students, student_params, STUDENT_FIELDS)
+        return _execute(conn, INSERT_STUDENTS, params).fetchall()
+    except errors.UniqueViolation:
+        raise DuplicateError("Email already exists!")
+
+
+def current_row(conn, table, row_id):
+    """A row as its listing shows it, or None if it does not exist"""
+    sql, params = page_query(LISTINGS[table], ids=[row_id])
+    pairs = split_keys(LISTINGS[table], _execute(conn, sql, params).fetchall())
+    return pairs[0][1] if pairs else None
+
+
+def update_student(conn, student_id, student, version=None):
+    """Update a student; returns its new row, or None if it does not exist
+
+    With the version the caller read, the update only applies if nobody has
+    changed the student since; otherwise it raises ConflictError.
+    """
+    try:
+        row = _execute(conn, UPDATE_STUDENT,
+                       dict(student_params(student), id=student_id, version=version)).fetchone()
+    except errors.UniqueViolation:
+        raise DuplicateError("Email already exists!")
+    if row is None and version is not None:
+        raise conflict('students', student_id, current_row(conn, 'students', student_id))
+    return row
+
+
+def change_class(conn, student_ids, class_name):
+    """Move students to class_name in one statement; returns their new rows"""
+    return _execute(conn, CHANGE_CLASS, class_params(student_ids, class_name)).fetchall()
+
+
+def delete_students(conn, student_ids, versions=None):
+    """Delete students and their grades; returns (student ids, grade ids)
+
+    versions, if given, are the versions the caller read; if any student
+    changed since, nothing is deleted and ConflictError is raised.
+    """
+    params = delete_params(student_ids, versions)
+    grade_ids = [row[0] for row in _execute(conn, DELETE_STUDENT_GRADES, params)]
+    deleted = [row[0] for row in _execute(conn, DELETE_STUDENTS, params)]
+    if versions is not None and len(deleted) < len(params['ids']):
+        remaining = _execute(conn, REMAINING['students'], params).fetchall()
+        if remaining:
+            # Raising rolls the grade deletes back with the rest of the transaction
+            raise delete_conflict('students', remaining)
+    return deleted, grade_ids
+
+
+def merge_students(conn, keep_id, student_ids, keep_version=None, versions=None):
+    """Move the grades of student_ids to keep_id and delete those students
+
+    Returns (moved grade ids, deleted student ids). With the versions the
+    caller read, nothing is merged if any of the students changed since;
+    ConflictError is raised instead.
+    """
+    student_ids = [int(i) for i in student_ids]
+    if int(keep_id) in student_ids:
+        raise ValidationError("Cannot merge a student into itself")
+    keep = _execute(conn, LOCK_STUDENT, {'keep': keep_id}).fetchone()
+    if keep is None or (keep_version is not None and keep[0] != keep_version):
+        raise conflict('students', keep_id, current_row(conn, 'students', keep_id))
+    params = dict(delete_params(student_ids, versions), keep=keep_id)
+    # Grades first: deleting the students would cascade to them
+    grade_ids = [row[0] for row in _execute(conn, MERGE_STUDENT_GRADES, params)]
+    deleted = [row[0] for row in _execute(conn, DELETE_STUDENTS, params)]
+    if versions is not None and len(deleted) < len(student_ids):
+        remaining = _execute(conn, REMAINING['students'], params).fetchall()
+        if remaining:
+            raise delete_conflict('students', remaining)
+    return grade_ids, deleted
+
+
+def create_grade(conn, grade):
+    """Insert one grade and return its id"""
+    return _execute(conn, INSERT_GRADE, grade_params(grade)).fetchone()[0]
+
+
+def create_grades(conn, grades):
+    """Insert many grades in one statement and return their ids"""
+    params = batch_params(grades, grade_params, GRADE_FIELDS)
+    return [row[0] for row in _execute(conn, INSERT_GRADES, params)]
+
+
+def update_grade(conn, grade_id, grade, version=None):
+    """Update a grade; returns the updated ids (empty if it does not exist)
+
+    version works as in update_student.
+    """
+    params = dict(grade_params(grade), id=grade_id, version=version)
+    updated = [row[0] for row in _execute(conn, UPDATE_GRADE, params)]
+    if not updated and version is not None:
+        raise conflict('grades', grade_id, current_row(conn, 'grades', grade_id))
+    return updated
+
+
+def delete_grades(conn, grade_ids, versions=None):
+    """Delete grades; returns the ids that existed
+
+    versions works as in delete_students.
+    """
+    params = delete_params(grade_ids, versions)
+    deleted = [row[0] for row in _execute(conn, DELETE_GRADES, params)]
+    if versions is not None and len(deleted) < len(params['ids']):
+        remaining = _execute(conn, REMAINING['grades'], params).fetchall()
+        if remaining:
+            raise delete_conflict('grades', remaining)
+    return deleted
+
+
+def curve_grades(conn, subject=None, grade_ids=None, points=0, factor=1):
+    """Apply grade * factor + points in one statement; returns the curved ids"""
+    params = curve_params(subject, grade_ids, points, factor)
+    return [row[0] for row in _execute(conn, CURVE_GRADES, params)]
+
+
+def student_choices(conn):
+    """(id, name) of every student, ordered by name"""
+    return query_cache.fetchall(conn, STUDENT_CHOICES, tables=('students',))
@@ -0,0 +1,315 @@
+# row_store.py
+#
+# Columnar storage for result sets the app keeps whole in memory (search
+# results and the live search cache). psycopg2 returns one tuple per row, with
+# a Decimal for every numeric value and a new str for every text value; a
+# RowStore keeps one typed array per column instead:
+#
+#   integer and date columns   array('i'); dates as ordinals
+#   numeric columns            array('i') of value * 100 while every value has
+#                              at most two decimals, array('d') otherwise
+#   float columns              array('d')
+#   text columns               array('i') of codes into the column's
+#                              dictionary of distinct values
+#
+# Rows are decoded back into tuples only when asked for, so a VirtualTable
+# materializes just the rows on screen. Sorting and filtering work on the
+# arrays (through NumPy) and return views that share them; fill a store
+# before sorting or filtering it.
+
+import datetime
+import math
+from array import array
+from decimal import Decimal
+
+import numpy as np
+
+INT, NUMERIC, FLOAT, DATE, TEXT = 'int', 'numeric', 'float', 'date', 'text'
+
+# Stands for NULL in integer arrays
+NULL = -2 ** 31
+
+# Numeric values are stored as integer hundredths while they fit
+SCALE = 100
+_EXPONENT = -2
+
+# psycopg2 type codes (Postgres type OIDs) by kind; anything else is text
+_TYPE_KINDS = {20: INT, 21: INT, 23: INT, 1700: NUMERIC, 700: FLOAT, 701: FLOAT, 1082: DATE}
+
+
+def kind_for(type_code):
+    return _TYPE_KINDS.get(type_code, TEXT)
+
+
+def _ints(data):
+    return np.frombuffer(data, dtype=data.typecode).astype(np.int64) if len(data) else np.zeros(0, np.int64)
+
+
+def _float_key(values):
+    """Floats as a sort key, NULL (NaN) lowest as in the other columns"""
+    return np.where(np.isnan(values), -np.inf, values)
+
+
+class _IntColumn:
+    def __init__(self):
+        self.data = array('i')
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, value):
+        value = NULL if value is None else self._encode(value)
+        try:
+            self.data.append(value)
+        except OverflowError:
+            self.data = array('q', self.data)
+            self.data.append(value)
+
+    def _encode(self, value):
+        return value
+
+    def get(self, number):
+        value = self.data[number]
+        return None if value == NULL else self._decode(value)
+
+    def _decode(self, value):
+        return value
+
+    def sort_key(self):
+        return _ints(self.data)
+
+    def floats(self):
+        values = _ints(self.data).astype(np.float64)
+        values[values == NULL] = np.nan
+        return values
+
+    def nbytes(self):
+        return len(self.data) * self.data.itemsize
+
+
+class _DateColumn(_IntColumn):
+    def _encode(self, value):
+        return value.toordinal()
+
+    def _decode(self, value):
+        return datetime.date.fromordinal(value)
+
+
+class _FloatColumn:
+    def __init__(self, data=None):
+        self.data = data if data is not None else array('d')
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, value):
+        self.data.append(math.nan if value is None else float(value))
+
+    def get(self, number):
+        value = self.data[number]
+        return None if math.isnan(value) else value
+
+    def sort_key(self):
+        return _float_key(self.floats())
+
+    def floats(self):
+        return np.array(self.data, dtype=np.float64)
+
+    def nbytes(self):
+        return len(self.data) * self.data.itemsize
+
+
+class _NumericColumn(_IntColumn):
+    """Hundredths in array('i'); switches to array('d') for other values"""
+
+    def append(self, value):
+        if self.data.typecode == 'd':
+            self.data.append(math.nan if value is None else float(value))
+            return
+        if value is not None:
+            scaled = (value if isinstance(value, Decimal) else Decimal(str(value))).scaleb(2)
+            if scaled != scaled.to_integral_value() or not NULL < scaled < -NULL:
+                self.data = array('d', (math.nan if stored == NULL else stored / SCALE
+                                        for stored in self.data))
+                self.data.append(float(value))
+                return
+            value = int(scaled)
+        self.data.append(NULL if value is None else value)
+
+    def get(self, number):
+        value = self.data[number]
+        if self.data.typecode == 'd':
+            return None if math.isnan(value) else value
+        return None if value == NULL else Decimal(value).scaleb(_EXPONENT)
+
+    def sort_key(self):
+        return _float_key(self.floats()) if self.data.typecode == 'd' else _ints(self.data)
+
+    def floats(self):
+        if self.data.typecode == 'd':
+            return np.array(self.data, dtype=np.float64)
+        return super().floats() / SCALE
+
+
+class _TextColumn:
+    """Codes into a dictionary of distinct values; code 0 is NULL"""
+
+    def __init__(self):
+        self.codes = array('i')
+        self.values = [None]
+        self._codes = {None: 0}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def get(self, number):
+        return self.values[self.codes[number]]
+
+    def sort_key(self):
+        # Rank the distinct values once, then sort rows by their value's rank
+        order = sorted(range(len(self.values)),
+                       key=lambda code: (self.values[code] is not None,
+                                         (self.values[code] or '').casefold(), self.values[code] or ''))
+        ranks = np.empty(len(self.values), dtype=np.int64)
+        ranks[order] = np.arange(len(self.values))
+        return ranks[_ints(self.codes)]
+
+    def mask(self, predicate):
+        """Rows whose value satisfies predicate, evaluated once per distinct value"""
+        matches = np.array([value is not None and bool(predicate(value)) for value in self.values])
+        return matches[_ints(self.codes)]
+
+    def floats(self):
+        raise TypeError("Text column has no numeric values")
+
+    def nbytes(self):
+        return (len(self.codes) * self.codes.itemsize
+                + sum(len(value) for value in self.values if value is not None))
+
+
+_COLUMNS = {INT: _IntColumn, NUMERIC: _NumericColumn, FLOAT: _FloatColumn, DATE: _DateColumn,
+            TEXT: _TextColumn}
+
+
+class RowStore:
+    """A result set stored by column, or a sorted/filtered view of one
+
+    Supports len(), indexing and slicing (which decode rows into tuples), so
+    it can stand in for a list of rows, e.g. in a virtual_table.ListSource.
+    """
+
+    def __init__(self, kinds, columns=None, index=None):
+        self.kinds = tuple(kinds)
+        self.columns = columns if columns is not None else [_COLUMNS[kind]() for kind in self.kinds]
+        self.index = index
+
+    @classmethod
+    def from_cursor(cls, cursor, batch_size=10000):
+        """Fetch every remaining row of an executed cursor"""
+        store = cls(kind_for(column.type_code) for column in cursor.description)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return store
+            store.extend(rows)
+
+    @classmethod
+    def from_rows(cls, kinds, rows):
+        store = cls(kinds)
+        store.extend(rows)
+        return store
+
+    def append(self, row):
+        if self.index is not None:
+            raise TypeError("Cannot append to a view of a RowStore")
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        if self.index is not None:
+            return len(self.index)
+        return len(self.columns[0]) if self.columns else 0
+
+    def row(self, position):
+        number = int(self.index[position]) if self.index is not None else position
+        return tuple(column.get(number) for column in self.columns)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.row(position) for position in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("RowStore index out of range")
+        return self.row(item)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.row(position)
+
+    def _numbers(self):
+        return self.index if self.index is not None else np.arange(len(self), dtype=np.int64)
+
+    def _view(self, numbers):
+        return RowStore(self.kinds, self.columns, numbers)
+
+    def where(self, column, predicate):
+        """View of the rows whose value in column satisfies predicate(value)"""
+        numbers = self._numbers()
+        store_column = self.columns[column]
+        if isinstance(store_column, _TextColumn):
+            return self._view(numbers[store_column.mask(predicate)[numbers]])
+        keep = np.fromiter((predicate(store_column.get(int(number))) for number in numbers),
+                           dtype=bool, count=len(numbers))
+        return self._view(numbers[keep])
+
+    def between(self, column, low=None, high=None):
+        """View of the rows whose numeric value lies in [low, high]; NULLs never do"""
+        values = self.floats(column)
+        keep = ~np.isnan(values)
+        if low is not None:
+            keep &= values >= low
+        if high is not None:
+            keep &= values <= high
+        return self._view(self._numbers()[keep])
+
+    def sorted(self, columns, reverse=False):
+        """View ordered by the given column positions, first one most significant
+
+        reverse is one flag for every column or a flag per column. NULLs sort
+        first, text ignores case, and ties keep their current order.
+        """
+        if isinstance(reverse, bool):
+            reverse = [reverse] * len(columns)
+        numbers = self._numbers()
+        keys = []
+        for column, descending in zip(columns, reverse):
+            key = self.columns[column].sort_key()[numbers]
+            keys.append(-key if descending else key)
+        # lexsort treats its last key as the most significant
+        return self._view(numbers[np.lexsort(keys[::-1])]) if keys else self
+
+    def floats(self, column):
+        """A column's values as a float64 array (NaN for NULL), in view order"""
+        return self.columns[column].floats()[self._numbers()]
+
+    def percentages(self, grade_column, max_column):
+        """grade / max_marks * 100 per row, rounded to two decimals"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.round(self.floats(grade_column) / self.floats(max_column) * 100, 2)
+
+    def nbytes(self):
+        """Approximate memory held by the columns (shared with any views)"""
+        index = self.index.nbytes if self.index is not None else 0
+        return sum(column.nbytes() for column in self.columns) + index
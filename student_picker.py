@@ -0,0 +1,167 @@
+# student_picker.py
+#
+# Choosing a student in the grade form. A readonly Combobox holding every
+# student as "id - name" takes seconds to fill with tens of thousands of
+# students and cannot be searched. StudentPicker is an editable Combobox
+# whose dropdown only offers the students matching what has been typed, found
+# through a StudentIndex, and whose labels carry the id, so resolving the
+# chosen student is a dictionary lookup.
+
+import bisect
+import re
+from tkinter import ttk
+
+# Most students offered in the dropdown at once
+MAX_CHOICES = 50
+
+_LABEL_ID = re.compile(r'\(#(-?\d+)\)\s*$')
+
+
+def _fold(text):
+    return ' '.join(text.casefold().split())
+
+
+class StudentIndex:
+    """Students by id, searchable by name
+
+    A term matches the start of the name first, then the start of any later
+    word in it (a surname), then anywhere in it. The first two are ranges of
+    sorted lists; substrings are looked up through a trigram index. Building
+    one for many students takes a while, so do it off the Tk thread.
+    """
+
+    def __init__(self, students=()):
+        self.load(students)
+
+    def load(self, students):
+        """Replace the index with (id, name) pairs"""
+        self.names = dict(students)
+        self._by_name = sorted((_fold(name), student_id) for student_id, name in self.names.items())
+        self._by_word = sorted(entry for student_id, name in self.names.items()
+                               for entry in self._word_entries(student_id, name))
+        self._trigrams = {}
+        for student_id, name in self.names.items():
+            for gram in self._grams(_fold(name)):
+                self._trigrams.setdefault(gram, set()).add(student_id)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, student_id):
+        return student_id in self.names
+
+    @staticmethod
+    def _word_entries(student_id, name):
+        words = _fold(name).split(' ')
+        return [(' '.join(words[start:]), student_id) for start in range(1, len(words))]
+
+    @staticmethod
+    def _grams(folded):
+        return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+    def set(self, student_id, name):
+        """Add or rename a student, or remove one with name None"""
+        old_name = self.names.pop(student_id, None)
+        if old_name is not None:
+            self._remove(self._by_name, (_fold(old_name), student_id))
+            for entry in self._word_entries(student_id, old_name):
+                self._remove(self._by_word, entry)
+            for gram in self._grams(_fold(old_name)):
+                self._trigrams[gram].discard(student_id)
+        if name is not None:
+            self.names[student_id] = name
+            bisect.insort(self._by_name, (_fold(name), student_id))
+            for entry in self._word_entries(student_id, name):
+                bisect.insort(self._by_word, entry)
+            for gram in self._grams(_fold(name)):
+                self._trigrams.setdefault(gram, set()).add(student_id)
+
+    @staticmethod
+    def _remove(entries, entry):
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+
+    def label(self, student_id):
+        return f"{self.names[student_id]} (#{student_id})"
+
+    def resolve(self, text):
+        """The id a picker's text stands for, or None
+
+        That is the id in a label, a bare id, or a name that only one
+        student has.
+        """
+        text = text.strip()
+        match = _LABEL_ID.search(text)
+        if match:
+            student_id = int(match.group(1))
+        elif re.fullmatch(r'-?\d+', text):
+            student_id = int(text)
+        else:
+            folded = _fold(text)
+            position = bisect.bisect_left(self._by_name, (folded,))
+            same = [student_id for name, student_id in self._by_name[position:position + 2]
+                    if name == folded]
+            student_id = same[0] if len(same) == 1 else None
+        return student_id if student_id in self.names else None
+
+    def search(self, term, limit=MAX_CHOICES):
+        """Ids of up to limit students matching term, best matches first"""
+        folded = _fold(term)
+        found = []
+        seen = set()
+
+        def add(student_id):
+            if student_id not in seen:
+                seen.add(student_id)
+                found.append(student_id)
+
+        if re.fullmatch(r'-?\d+', folded) and int(folded) in self.names:
+            add(int(folded))
+        for entries in (self._by_name, self._by_word):
+            position = bisect.bisect_left(entries, (folded,))
+            while position < len(entries) and len(found) < limit:
+                text, student_id = entries[position]
+                if not text.startswith(folded):
+                    break
+                add(student_id)
+                position += 1
+        if len(found) < limit and len(folded) >= 3:
+            candidates = [student_id for student_id in self._substring_candidates(folded)
+                          if student_id not in seen and folded in _fold(self.names[student_id])]
+            candidates.sort(key=lambda student_id: (_fold(self.names[student_id]), student_id))
+            for student_id in candidates[:limit - len(found)]:
+                add(student_id)
+        return found[:limit]
+
+    def _substring_candidates(self, folded):
+        sets = sorted((self._trigrams.get(gram, set()) for gram in self._grams(folded)), key=len)
+        return set.intersection(*sets) if sets else set()
+
+
+class StudentPicker(ttk.Combobox):
+    """Editable combobox for picking one student of a StudentIndex
+
+    Typing narrows the dropdown to the matching students; it is filled when
+    it opens or the text changes, never with the whole index.
+    """
+
+    def __init__(self, parent, index, **kwargs):
+        super().__init__(parent, postcommand=self._fill, **kwargs)
+        self.index = index
+        self.bind('<KeyRelease>', self._on_key)
+
+    def _fill(self):
+        self['values'] = [self.index.label(student_id) for student_id in self.index.search(self.get())]
+
+    def _on_key(self, event):
+        if event.keysym not in ('Up', 'Down', 'Return', 'Escape', 'Tab'):
+            self._fill()
+
+    def student_id(self):
+        """The chosen student's id, or None if the text names no student"""
+        return self.index.resolve(self.get())
+
+    def select(self, student_id):
+        """Show the given student, or nothing if the index does not have them"""
+        self.set(self.index.label(student_id) if student_id in self.index else '')
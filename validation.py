@@ -0,0 +1,80 @@
+# validation.py
+
+import decimal
+import math
+
+# Column sizes from the students/grades schema
+MAX_LENGTHS = {"Name": 100, "Email": 100, "Class": 50, "Phone": 20, "Subject": 100}
+
+# DECIMAL(5,2) holds values below 1000, to two decimal places
+MAX_MARK = 1000
+CENT = decimal.Decimal('0.01')
+
+
+def _too_long(**fields):
+    for label, value in fields.items():
+        if value and len(value) > MAX_LENGTHS[label]:
+            return f"{label} must be at most {MAX_LENGTHS[label]} characters"
+    return None
+
+
+def round_marks(value):
+    """A grade or max marks as the Decimal a DECIMAL(5,2) column stores"""
+    return decimal.Decimal(str(value)).quantize(CENT, rounding=decimal.ROUND_HALF_UP)
+
+
+def student_error(name, email, class_name, phone=''):
+    """Return why a student record is invalid, or None if it is valid"""
+    if not name.strip():
+        return "Name is required"
+    if not email.strip():
+        return "Email is required"
+    if not class_name.strip():
+        return "Class is required"
+    return _too_long(Name=name, Email=email, Class=class_name, Phone=phone)
+
+
+def grade_error(student, subject, grade, max_marks):
+    """Return why a grade record is invalid, or None if it is valid"""
+    if not student:
+        return "Please select a student"
+    if not subject.strip():
+        return "Subject is required"
+    try:
+        grade = decimal.Decimal(str(grade))
+        max_marks = decimal.Decimal(str(max_marks))
+    except decimal.InvalidOperation:
+        return "Grade and max marks must be valid numbers"
+    if not (grade.is_finite() and max_marks.is_finite()):
+        return "Grade and max marks must be valid numbers"
+    if grade < 0 or max_marks <= 0:
+        return "Grade and max marks must be positive numbers"
+    if grade >= MAX_MARK or max_marks >= MAX_MARK:
+        return f"Grade and max marks must be below {MAX_MARK}"
+    # Checked again as stored: 999.996 rounds to 1000.00
+    if round_marks(max_marks) <= 0:
+        return "Grade and max marks must be positive numbers"
+    if round_marks(grade) >= MAX_MARK or round_marks(max_marks) >= MAX_MARK:
+        return f"Grade and max marks must be below {MAX_MARK}"
+    return _too_long(Subject=subject)
+
+
+def class_error(class_name):
+    """Return why a class name is invalid, or None if it is valid"""
+    if not class_name.strip():
+        return "Class is required"
+    return _too_long(Class=class_name)
+
+
+def curve_error(points, factor):
+    """Return why a grade curve (grade * factor + points) is invalid, or None"""
+    try:
+        points = float(points)
+        factor = float(factor)
+    except (TypeError, ValueError):
+        return "Points and factor must be valid numbers"
+    if not (math.isfinite(points) and math.isfinite(factor)):
+        return "Points and factor must be valid numbers"
+    if factor <= 0:
+        return "Factor must be a positive number"
+    return None
@@ -0,0 +1,589 @@
+# virtual_table.py
+
+import copy
+from collections import OrderedDict
+from tkinter import ttk
+
+from db_config import connect
+import query_cache
+import queries
+import instrumentation
+from row_store import RowStore
+
+PLACEHOLDER = '…'
+
+
+class QuerySource:
+    """Keyset-paginated SQL result used as the backing store of a VirtualTable
+
+    order_by must end in a unique, non-null expression so that every row has
+    a distinct key. The key expressions are selected as trailing columns and
+    stripped from the displayed values. Counts and pages are served from the
+    query cache; tables names what the query reads, for invalidation.
+
+    sort_keys gives a non-null SQL expression per displayed column, which
+    makes the source sortable by that column (see sorted()). name labels the
+    timings of its queries (see queries.py).
+    """
+
+    def __init__(self, columns, from_clause, order_by, where=None, params=(), id_column=None,
+                 tables=(), sort_keys=(), name=None):
+        self.columns = columns
+        self.from_clause = from_clause
+        self.order_by = list(order_by)
+        self.where = where
+        self.params = tuple(params)
+        self.id_column = id_column
+        self.tables = tuple(tables)
+        self.sort_keys = tuple(sort_keys)
+        self.name = name
+        self.descending = False
+        self._default_order = self.order_by
+
+    def sorted(self, column, descending=False):
+        """A copy ordered by a displayed column, or None if it has no sort key
+
+        Ties keep the default order; descending reverses the whole order so
+        that keyset paging still compares a single row value.
+        """
+        if column >= len(self.sort_keys):
+            return None
+        source = copy.copy(self)
+        key = self.sort_keys[column]
+        source.order_by = [key] + [k for k in self._default_order if k != key]
+        source.descending = descending
+        return source
+
+    def _order(self):
+        direction = ' DESC' if self.descending else ''
+        return ', '.join(key + direction for key in self.order_by)
+
+    def _where(self, extra=None):
+        conditions = [c for c in (self.where, extra) if c]
+        if not conditions:
+            return ''
+        return 'WHERE ' + ' AND '.join(f'({c})' for c in conditions)
+
+    def _label(self, kind):
+        return f'{self.name}.{kind}' if self.name else None
+
+    def count(self, conn):
+        """Return the total number of rows"""
+        rows = query_cache.fetchall(conn, f'SELECT COUNT(*) FROM {self.from_clause} {self._where()}',
+                                    self.params, self.tables, self._label('count'))
+        return rows[0][0]
+
+    def query(self):
+        """Return (sql, params) for the whole ordered result, for exports"""
+        sql = (f'SELECT {self.columns} FROM {self.from_clause} {self._where()} '
+               f'ORDER BY {self._order()}')
+        return sql, self.params
+
+    def fetch(self, conn, after=None, offset=0, limit=100):
+        """Return up to limit (key, values) pairs after the given key
+
+        Without a key the page starts at offset, which is only used to jump
+        to a region of the result that has not been paged through yet.
+        """
+        keys = ', '.join(self.order_by)
+        params = list(self.params)
+        cursor_condition = None
+        if after is not None:
+            placeholders = ', '.join(['%s'] * len(after))
+            comparison = '<' if self.descending else '>'
+            cursor_condition = f'({keys}) {comparison} ({placeholders})'
+            params.extend(after)
+        sql = (f'SELECT {self.columns}, {keys} FROM {self.from_clause} '
+               f'{self._where(cursor_condition)} ORDER BY {self._order()} LIMIT %s')
+        params.append(limit)
+        if after is None and offset:
+            sql += ' OFFSET %s'
+            params.append(offset)
+
+        return self._split(query_cache.fetchall(conn, sql, params, self.tables, self._label('page')))
+
+    def fetch_rows(self, conn, ids):
+        """Return the (key, values) pairs of specific rows, looked up by id
+
+        Always read fresh: this is used right after a write in the same
+        transaction.
+        """
+        keys = ', '.join(self.order_by)
+        sql = (f'SELECT {self.columns}, {keys} FROM {self.from_clause} '
+               f'{self._where(f"{self.id_column} = ANY(%s)")} ORDER BY {self._order()}')
+        cursor = queries.execute(conn.cursor(), sql, list(self.params) + [list(ids)], self._label('rows'))
+        return self._split(cursor.fetchall())
+
+    def _split(self, rows):
+        split = len(rows[0]) - len(self.order_by) if rows else 0
+        return [(tuple(row[split:]), tuple(row[:split])) for row in rows]
+
+
+def _sort_value(value):
+    # NULLs first, text without regard to case, as RowStore sorts
+    return (value is not None, value.casefold() if isinstance(value, str) else value)
+
+
+class ListSource:
+    """Rows already in memory, served through the QuerySource interface
+
+    query is the (sql, params) that produced the rows, if any, so the result
+    can still be exported. A row_store.RowStore is kept as it is, so only the
+    rows on screen are decoded.
+    """
+
+    local = True
+
+    def __init__(self, rows, query=None):
+        self.rows = rows if isinstance(rows, RowStore) else list(rows)
+        self._query = query
+
+    def query(self):
+        return self._query
+
+    def count(self, conn):
+        return len(self.rows)
+
+    def sorted(self, column, descending=False):
+        """A copy ordered by one column; ties keep their current order"""
+        if isinstance(self.rows, RowStore):
+            rows = self.rows.sorted([column], descending)
+        else:
+            rows = sorted(self.rows, key=lambda row: _sort_value(row[column]), reverse=descending)
+        return ListSource(rows, self._query)
+
+    def fetch(self, conn, after=None, offset=0, limit=100):
+        start = after[0] + 1 if after is not None else offset
+        return [((index,), row) for index, row in
+                enumerate(self.rows[start:start + limit], start)]
+
+
+class VirtualTable(ttk.Frame):
+    """Treeview that only materializes the rows currently on screen
+
+    A fixed set of Treeview items is recycled while scrolling; rows are pulled
+    from the source one page at a time and only a few pages are kept. With an
+    executor, counts and pages load in the background and rows that have not
+    arrived yet show a placeholder. Selecting rows emits <<TableSelect>>;
+    Control-click toggles rows and Shift-click selects a range, also across
+    rows that have scrolled out of view.
+
+    Cached rows are indexed by the value in id_column so single-row changes
+    can be patched in place instead of reloading the whole result.
+
+    Clicking a heading sorts by that column and clicking it again reverses
+    the order, for sources with a sorted(column, descending) method: in
+    memory for a ListSource, in SQL for a QuerySource. The sort carries over
+    to the next source set on the table.
+    """
+
+    def __init__(self, parent, columns, executor=None, page_size=200, max_pages=8,
+                 id_column=0, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.executor = executor
+        self.id_column = id_column
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.source = None
+        self.unsorted_source = None
+        self.sort = None
+        self.total = 0
+        self.top = 0
+        self._generation = 0
+        self._channel = f'table-{id(self)}'
+        self._pages = OrderedDict()
+        self._loading = {}
+        self._boundaries = {}
+        self._index = {}
+        self._items = []
+        self._selected = {}
+        self._anchor = None
+
+        self.tree = ttk.Treeview(self, show='headings', height=1, selectmode='extended')
+        self._configure_columns(columns)
+
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.yview)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+
+        self.tree.bind('<<TreeviewSelect>>', self._on_tree_select)
+        self.tree.bind('<Button-1>', lambda e: self._on_click(e, 'set'))
+        self.tree.bind('<Control-Button-1>', lambda e: self._on_click(e, 'toggle'))
+        self.tree.bind('<Shift-Button-1>', lambda e: self._on_click(e, 'range'))
+        self.tree.bind('<Configure>', self._on_configure)
+        self.tree.bind('<MouseWheel>', self._on_mousewheel)
+        self.tree.bind('<Button-4>', lambda e: self.yview('scroll', -3, 'units'))
+        self.tree.bind('<Button-5>', lambda e: self.yview('scroll', 3, 'units'))
+        self.tree.bind('<Up>', lambda e: self._move_selection(-1))
+        self.tree.bind('<Down>', lambda e: self._move_selection(1))
+        self.tree.bind('<Prior>', lambda e: self.yview('scroll', -1, 'pages'))
+        self.tree.bind('<Next>', lambda e: self.yview('scroll', 1, 'pages'))
+
+        self._resize_items(20)
+
+    def _configure_columns(self, columns):
+        self.tree['columns'] = [name for name, _ in columns]
+        for index, (name, width) in enumerate(columns):
+            self.tree.heading(name, text=name, command=lambda index=index: self.sort_by(index))
+            self.tree.column(name, width=width)
+
+    def _update_headings(self):
+        for index, name in enumerate(self.tree['columns']):
+            arrow = ''
+            if self.sort is not None and self.sort[0] == index:
+                arrow = ' ▼' if self.sort[1] else ' ▲'
+            self.tree.heading(name, text=name + arrow)
+
+    def set_columns(self, columns):
+        """Switch to a different set of ((name, width), ...) columns; empties the table"""
+        self.source = None
+        self.unsorted_source = None
+        self.sort = None
+        self._selected = {}
+        self._configure_columns(columns)
+        self.refresh()
+
+    # Data
+    def set_source(self, source):
+        """Show a new result set, starting from the top"""
+        self.unsorted_source = source
+        if self.sort is not None:
+            sorted_source = self._sorted(source, *self.sort)
+            if sorted_source is None:
+                self.sort = None
+                self._update_headings()
+            else:
+                source = sorted_source
+        self._show(source)
+
+    def sort_by(self, column):
+        """Order the rows by a column, or reverse the order if already sorted by it"""
+        descending = self.sort == (column, False)
+        source = self._sorted(self.unsorted_source, column, descending)
+        if source is None:
+            return
+        self.sort = (column, descending)
+        self._update_headings()
+        self._show(source)
+
+    def _sorted(self, source, column, descending):
+        sort = getattr(source, 'sorted', None)
+        return sort(column, descending) if sort is not None else None
+
+    def _show(self, source):
+        self.source = source
+        self.top = 0
+        self._selected = {}
+        self.refresh()
+
+    def refresh(self):
+        """Drop cached pages and re-read the current source"""
+        self._generation += 1
+        if self.executor:
+            self.executor.cancel(self._channel)
+        self._pages.clear()
+        self._loading.clear()
+        self._boundaries.clear()
+        self._index.clear()
+        if self.source is None:
+            self._on_count(self._generation, 0)
+        else:
+            generation = self._generation
+            self._run(self.source.count, lambda total: self._on_count(generation, total))
+
+    def clear(self):
+        """Remove the source and show an empty table"""
+        self.source = None
+        self.unsorted_source = None
+        self._selected = {}
+        self.refresh()
+
+    def _run(self, work, callback):
+        if getattr(self.source, 'local', False):
+            # In-memory rows need no connection
+            callback(work(None))
+            return
+        # Sources that are not read from Postgres name their own session
+        session = getattr(self.source, 'session', None)
+        if self.executor:
+            self.executor.submit(work, callback, channel=self._channel, session=session,
+                                 operation=self.winfo_name())
+        else:
+            with (session or connect)() as conn:
+                result = work(conn)
+            callback(result)
+
+    def _on_count(self, generation, total):
+        if generation != self._generation:
+            return
+        self.total = total
+        self._selected = {i: v for i, v in self._selected.items() if i < total}
+        self.top = max(0, min(self.top, self.total - len(self._items)))
+        self._render()
+
+    def _page(self, number):
+        """Return a cached page, requesting it if missing (None until loaded)"""
+        if number in self._pages:
+            self._pages.move_to_end(number)
+            return self._pages[number]
+        if number in self._loading:
+            return None
+
+        source = self.source
+        size = self.page_size
+        if number == 0:
+            work = lambda conn: source.fetch(conn, limit=size)
+        elif number - 1 in self._boundaries:
+            after = self._boundaries[number - 1]
+            work = lambda conn: source.fetch(conn, after=after, limit=size)
+        else:
+            work = lambda conn: source.fetch(conn, offset=number * size, limit=size)
+
+        token = object()
+        self._loading[number] = token
+        self._run(work, lambda rows: self._on_page(token, number, rows))
+        return self._pages.get(number)
+
+    def _on_page(self, token, number, rows):
+        if self._loading.get(number) is not token:
+            return
+        del self._loading[number]
+        self._pages[number] = rows
+        for offset, (_, values) in enumerate(rows):
+            self._index[values[self.id_column]] = (number, offset)
+        if rows:
+            self._boundaries[number] = rows[-1][0]
+        while len(self._pages) > self.max_pages:
+            self._forget_page(*self._pages.popitem(last=False))
+        if self.executor:
+            self._render()
+
+    def _forget_page(self, number, rows):
+        for _, values in rows:
+            if self._index.get(values[self.id_column], (None,))[0] == number:
+                del self._index[values[self.id_column]]
+
+    def _invalidate_from(self, number):
+        """Drop cached pages, keys and loads from page number onward"""
+        for page in [page for page in self._pages if page >= number]:
+            self._forget_page(page, self._pages.pop(page))
+        for page in [page for page in self._boundaries if page >= number]:
+            del self._boundaries[page]
+        for page in [page for page in self._loading if page >= number]:
+            del self._loading[page]
+
+    def _page_for_key(self, key):
+        """Best guess at the page a key sorts into, erring one page early
+
+        Text compares here in codepoint order, which need not be the order of
+        the database's collation, so a key with text starts from page 0.
+        """
+        values = key if isinstance(key, tuple) else (key,)
+        if getattr(self.source, 'descending', False) or any(isinstance(value, str) for value in values):
+            return 0
+        known = sorted(self._boundaries)
+        try:
+            number = next((page for page in known if self._boundaries[page] >= key),
+                          known[-1] if known else 0)
+        except TypeError:
+            number = 0
+        return max(0, number - 1)
+
+    # Row model
+    def update_row(self, values):
+        """Patch a cached row in place; its sort position is kept until reload"""
+        self.update_rows([values])
+
+    def update_rows(self, rows):
+        """Patch several cached rows, redrawing once"""
+        changed = {values[self.id_column]: tuple(values) for values in rows}
+        for row_id, values in changed.items():
+            location = self._index.get(row_id)
+            if location is not None:
+                number, offset = location
+                page = self._pages[number]
+                page[offset] = (page[offset][0], values)
+        for index, selected in self._selected.items():
+            if selected[self.id_column] in changed:
+                self._selected[index] = changed[selected[self.id_column]]
+        self._render()
+
+    def insert_row(self, key):
+        """Account for a new row with the given sort key"""
+        if self.source is None:
+            return
+        self.total += 1
+        self._selected = {}
+        self._invalidate_from(self._page_for_key(key))
+        self._render()
+
+    def remove_rows(self, row_ids):
+        """Account for deleted rows; only pages from the first one onward reload"""
+        if self.source is None or not row_ids:
+            return
+        pages = [self._index[row_id][0] for row_id in row_ids if row_id in self._index]
+        self._selected = {}
+        if len(pages) < len(row_ids):
+            # Rows that are not cached may not be in the result at all
+            self.refresh()
+            return
+        self.total = max(0, self.total - len(pages))
+        self.top = max(0, min(self.top, self.total - len(self._items)))
+        self._invalidate_from(min(pages))
+        self._render()
+
+    def row(self, index):
+        """Return the values of the row at an absolute index, or None"""
+        if self.source is None or not 0 <= index < self.total:
+            return None
+        rows = self._page(index // self.page_size)
+        offset = index % self.page_size
+        if rows is None or offset >= len(rows):
+            return None
+        return rows[offset][1]
+
+    def _cached_row(self, index):
+        rows = self._pages.get(index // self.page_size)
+        offset = index % self.page_size
+        return rows[offset][1] if rows is not None and offset < len(rows) else None
+
+    def selected_rows(self):
+        """Return the values of every selected row, in display order"""
+        return [self._selected[index] for index in sorted(self._selected)]
+
+    # Rendering
+    def _resize_items(self, count):
+        count = max(1, count)
+        while len(self._items) < count:
+            self._items.append(self.tree.insert('', 'end'))
+        while len(self._items) > count:
+            self.tree.delete(self._items.pop())
+
+    def _render(self):
+        count = max(0, min(len(self._items), self.total - self.top))
+        with instrumentation.timed('render', self.winfo_name(), count):
+            for slot, iid in enumerate(self._items):
+                if slot < count:
+                    values = self.row(self.top + slot)
+                    if values is None:
+                        values = (PLACEHOLDER,)
+                    self.tree.item(iid, values=['' if v is None else v for v in values])
+                    self.tree.move(iid, '', slot)
+                else:
+                    self.tree.detach(iid)
+
+        wanted = self._visible_selection()
+        if set(self.tree.selection()) != wanted:
+            self.tree.selection_set(list(wanted))
+
+        if self.total:
+            first = self.top / self.total
+            last = min(1.0, (self.top + len(self._items)) / self.total)
+        else:
+            first, last = 0.0, 1.0
+        self.scrollbar.set(first, last)
+        self.after_idle(self._fit)
+
+    def _visible_selection(self):
+        count = min(len(self._items), self.total - self.top)
+        return {self._items[index - self.top] for index in self._selected
+                if self.top <= index < self.top + count}
+
+    # Scrolling
+    def yview(self, *args):
+        """Scrollbar protocol: ('moveto', fraction) or ('scroll', n, what)"""
+        if not args:
+            return
+        if args[0] == 'moveto':
+            top = int(float(args[1]) * self.total)
+        elif args[0] == 'scroll':
+            step = len(self._items) if args[2] == 'pages' else 1
+            top = self.top + int(args[1]) * step
+        else:
+            return
+        self.scroll_to(top)
+
+    def scroll_to(self, index):
+        """Make the row at index the first visible row"""
+        top = max(0, min(index, self.total - len(self._items)))
+        if top != self.top:
+            self.top = top
+            self._render()
+
+    def _on_mousewheel(self, event):
+        self.yview('scroll', -3 if event.delta > 0 else 3, 'units')
+        return 'break'
+
+    def _on_configure(self, event):
+        self._fit()
+
+    def _fit(self):
+        """Match the number of recycled items to the rows that fit on screen"""
+        attached = [iid for iid in self._items if self.tree.bbox(iid)]
+        if not attached:
+            return
+        bbox = self.tree.bbox(attached[0])
+        count = max(1, (self.tree.winfo_height() - bbox[1]) // bbox[3])
+        if count != len(self._items):
+            self._resize_items(count)
+            self.top = max(0, min(self.top, self.total - len(self._items)))
+            self._render()
+
+    # Selection
+    def _on_click(self, event, mode):
+        if self.tree.identify_region(event.x, event.y) != 'cell':
+            return None
+        iid = self.tree.identify_row(event.y)
+        if iid not in self._items:
+            return None
+        index = self.top + self._items.index(iid)
+        values = self.row(index)
+        if values is None:
+            return 'break'
+        if mode == 'toggle':
+            if self._selected.pop(index, None) is None:
+                self._selected[index] = values
+            self._anchor = index
+        elif mode == 'range' and self._anchor is not None:
+            # Rows whose page is no longer cached cannot be selected
+            low, high = sorted((self._anchor, index))
+            rows = ((i, self._cached_row(i)) for i in range(low, high + 1))
+            self._selected = {i: v for i, v in rows if v is not None}
+        else:
+            self._selected = {index: values}
+            self._anchor = index
+        self.tree.focus(iid)
+        self.tree.focus_set()
+        self._render()
+        self.event_generate('<<TableSelect>>')
+        return 'break'
+
+    def _on_tree_select(self, event):
+        current = set(self.tree.selection())
+        if current == self._visible_selection():
+            return
+        positions = {iid: slot for slot, iid in enumerate(self._items)}
+        selected = {}
+        for iid in current:
+            index = self.top + positions[iid]
+            values = self.row(index)
+            if values is not None:
+                selected[index] = values
+        self._selected = selected
+        self.event_generate('<<TableSelect>>')
+
+    def _move_selection(self, step):
+        if not self.total:
+            return 'break'
+        index = min(self._selected) if self._selected else self.top - step
+        index = max(0, min(index + step, self.total - 1))
+        if index < self.top:
+            self.scroll_to(index)
+        elif index >= self.top + len(self._items):
+            self.scroll_to(index - len(self._items) + 1)
+        values = self.row(index)
+        self._selected = {index: values} if values is not None else {}
+        self._anchor = index
+        self._render()
+        self.event_generate('<<TableSelect>>')
+        return 'break'